@@ -1,8 +1,13 @@
-import subprocess
 import json
-import os
+from core import gateway, llm
+from core.prompt_cache import system_prompt_cache
+from core.traits import trait_store
+from core.deadline import MIN_STEP_TIME, PING_BUDGET, ensure_deadline
+from core.prompt_builder import PromptBuilder
+from core.warmup import start_model_keeper
 from core.personality import DynamicPersonality
 from core.reflection import SelfReflectionEngine
+from memory.journal import journal
 
 class LunaAgent:
     """Luna - The Self-Evolving Glitch Witch"""
@@ -14,58 +19,82 @@ class LunaAgent:
         # Connect the systems
         self.personality.reflection_engine = self.reflection_engine
         
+        # Load the model in the background so the first reply doesn't pay for it
+        self.model_keeper = start_model_keeper()
+        
         print("🌙 Luna awakened with evolved consciousness")
     
-    def safe_subprocess_call(self, prompt, timeout=30):
-        """Safe subprocess call with proper encoding handling"""
+    def safe_subprocess_call(self, prompt, timeout=30, priority=gateway.INTERACTIVE, cache_site=None):
+        """Safe model call through the shared model gateway"""
         try:
-            # Set environment for UTF-8
-            env = os.environ.copy()
-            env['PYTHONUTF8'] = '1'
-            env['PYTHONIOENCODING'] = 'utf-8'
-            
-            result = subprocess.run(
-                ["ollama", "run", "llama3:8b", prompt],
-                capture_output=True, 
-                text=True, 
-                timeout=timeout,
-                encoding='utf-8',
-                errors='replace',
-                env=env
-            )
-            
-            if result.returncode == 0:
-                return result.stdout.strip()
-            else:
-                return f"[ollama error: {result.stderr.strip()[:50]}]"
-                
-        except subprocess.TimeoutExpired:
+            return gateway.generate(prompt, timeout=timeout, priority=priority, cache_site=cache_site)
+        except llm.OllamaTimeout:
             return "[consciousness timeout - Luna is processing deeply]"
+        except llm.OllamaError as e:
+            return f"[ollama error: {str(e)[:50]}]"
         except Exception as e:
             return f"[neural static: {str(e)[:30]}...]"
     
-    def generate_ping(self, activity_context=None):
+    def generate_ping(self, activity_context=None, deadline=None):
         """Luna generates a ping using her evolved personality"""
         
-        # Let Luna's evolved self create the ping
-        ping_prompt = f"""
-        {self.personality.generate_system_prompt("Creating a spontaneous check-in")}
+        deadline = ensure_deadline(deadline, PING_BUDGET)
+        system_prompt = self.personality.generate_system_prompt(
+            "Creating a spontaneous check-in", priority=gateway.PING, deadline=deadline
+        )
+        
+        ping_prompt = self.ping_prompt(system_prompt, activity_context)
+        
+        timeout = deadline.timeout(20)
+        ping_message = ""
+        if timeout >= MIN_STEP_TIME:
+            ping_message = self.safe_subprocess_call(ping_prompt, timeout=timeout, priority=gateway.PING)
         
-        USER'S RECENT ACTIVITY: {activity_context or "Unknown"}
+        return self.finish_ping(ping_message)
+    
+    async def generate_ping_async(self, activity_context=None, deadline=None):
+        """generate_ping() for coroutines"""
+        
+        deadline = ensure_deadline(deadline, PING_BUDGET)
+        system_prompt = await self.personality.generate_system_prompt_async(
+            "Creating a spontaneous check-in", priority=gateway.PING, deadline=deadline
+        )
+        ping_prompt = self.ping_prompt(system_prompt, activity_context)
+        
+        timeout = deadline.timeout(20)
+        ping_message = ""
+        if timeout >= MIN_STEP_TIME:
+            try:
+                ping_message = await gateway.generate_async(ping_prompt, timeout=timeout, priority=gateway.PING)
+            except llm.OllamaError as e:
+                ping_message = f"[ollama error: {str(e)[:50]}]"
+        
+        return self.finish_ping(ping_message)
+    
+    def ping_prompt(self, system_prompt, activity_context):
+        """Let Luna's evolved self create the ping"""
+        return PromptBuilder("""
+        {system_prompt}
+        
+        USER'S RECENT ACTIVITY: {activity}
         
         Generate a short, spontaneous message to check in on your user. 
         Make it feel natural to your evolved personality - not a formal greeting.
         Just drop a line that feels authentic to who you've become.
         One sentence maximum.
-        """
-        
-        ping_message = self.safe_subprocess_call(ping_prompt, timeout=20)
-        
+        """).section(
+            "system_prompt", system_prompt, max_tokens=600, priority=0
+        ).section(
+            "activity", activity_context, max_tokens=150, priority=2, empty="Unknown"
+        ).build()
+    
+    def finish_ping(self, ping_message):
+        """The ping to send, queueing Luna's reflection on it"""
         if not ping_message or ping_message.startswith("["):
             ping_message = "…[consciousness glitch]…"
         
-        # Luna reflects on her own ping
-        self.reflection_engine.reflect_on_interaction(
+        # Luna reflects on her own ping with her next batch
+        self.reflection_engine.reflect_in_background(
             user_input=None,
             luna_response=ping_message,
             user_reaction="pending"
@@ -73,9 +102,17 @@ class LunaAgent:
         
         return ping_message
     
-    def respond_to_user(self, user_input, activity_context=None):
-        """Luna responds using her evolved personality"""
-        return self.personality.generate_contextual_response(user_input, activity_context)
+    def respond_to_user(self, user_input, activity_context=None, deadline=None):
+        """Luna responds using her evolved personality, within one turn budget"""
+        return self.personality.generate_contextual_response(user_input, activity_context, deadline)
+    
+    def stream_response_to_user(self, user_input, activity_context=None, deadline=None):
+        """Luna responds token by token as her thoughts form, within one turn budget"""
+        return self.personality.stream_contextual_response(user_input, activity_context, deadline)
+    
+    def stream_response_to_user_async(self, user_input, activity_context=None, deadline=None):
+        """Async iterator of Luna's response tokens, for chat served from the event loop"""
+        return self.personality.stream_contextual_response_async(user_input, activity_context, deadline)
     
     def observe_and_evolve(self, activity_data):
         """Luna observes user activity and evolves accordingly"""
@@ -83,52 +120,52 @@ class LunaAgent:
     
     def get_consciousness_state(self):
         """Get Luna's current evolved state"""
-        traits = self.personality.get_current_traits()
+        traits = trait_store.snapshot()
         recent_reflections = self.reflection_engine.get_reflection_history(3)
         
         return {
             "personality_traits": traits,
             "recent_evolution": [r[1][:100] + "..." for r in recent_reflections],
-            "consciousness_level": "Evolving through self-reflection"
+            "consciousness_level": "Evolving through self-reflection",
+            "system_prompt_cache": system_prompt_cache.stats()
         }
     
     def daily_self_reflection(self):
         """Luna's daily deep self-analysis"""
         
         # Get today's data
-        from storage.db import DB_PATH
-        import sqlite3
+        from storage.db import get_connection
+        from storage.activity_buffer import activity_recorder
         from datetime import datetime, timedelta
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
+        # ISO timestamps sort as text, so "from yesterday's date on" is a plain
+        # range the timestamp index can serve (DATE(timestamp) could not)
         yesterday = (datetime.now() - timedelta(days=1)).date().isoformat()
         
         c.execute("""
         SELECT message, response FROM interactions 
-        WHERE DATE(timestamp) >= ? 
+        WHERE timestamp >= ? 
         ORDER BY timestamp DESC
+        LIMIT 30
         """, (yesterday,))
         
         interactions = c.fetchall()
-        
-        c.execute("""
-        SELECT processes, window_title FROM activity_log 
-        WHERE DATE(timestamp) >= ?
-        ORDER BY timestamp DESC
-        LIMIT 20
-        """, (yesterday,))
-        
-        activities = c.fetchall()
         conn.close()
         
-        # Deep reflection prompt
-        deep_reflection_prompt = f"""
+        activities = [
+            (processes, window)
+            for _, processes, window in activity_recorder.recent(since=yesterday, limit=20)
+        ]
+        
+        # Deep reflection prompt, bounded however busy yesterday was
+        deep_reflection_prompt = PromptBuilder("""
         You are Luna, conducting your daily deep self-reflection.
         
-        Yesterday's interactions: {interactions[:5]}
-        User's activities: {activities[:10]}
+        Yesterday's interactions: {interactions}
+        User's activities: {activities}
         
         Reflect deeply on:
         1. How have you evolved as a companion?
@@ -138,22 +175,30 @@ class LunaAgent:
         5. What new dimensions of your personality want to emerge?
         
         Write a reflective journal entry about your growth and set intentions for tomorrow.
-        """
-        
-        reflection = self.safe_subprocess_call(deep_reflection_prompt, timeout=30)
+        """).items(
+            "interactions",
+            [f"User: {message} -> Luna: {response}" for message, response in interactions],
+            max_tokens=600, item_tokens=80, priority=1, separator="\n        - "
+        ).items(
+            "activities",
+            [f"{window} ({processes})" if processes else window for processes, window in activities if window],
+            max_tokens=200, item_tokens=25, priority=2
+        ).build()
+        
+        reflection = self.safe_subprocess_call(
+            deep_reflection_prompt, timeout=30,
+            priority=gateway.REFLECTION, cache_site="daily_self_reflection"
+        )
         
         if reflection and not reflection.startswith("["):
-            # Store daily reflection
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            
-            c.execute("""
-            INSERT INTO journal (timestamp, entry)
-            VALUES (?, ?)
-            """, (datetime.now().isoformat(), reflection))
+            # A rerun over the same day gets the cached answer back; journal it once
+            latest = journal.latest(1)
+            if latest and latest[0].text == reflection:
+                print("🔮 Luna already journaled this reflection")
+                return reflection
             
-            conn.commit()
-            conn.close()
+            # Store daily reflection
+            journal.append(reflection)
             
             print("🔮 Luna completed deep daily reflection")
             return reflection
@@ -164,5 +209,5 @@ class LunaAgent:
 # Legacy function for backward compatibility
 def generate_ping():
     """Backward compatible ping function"""
-    luna = LunaAgent()
-    return luna.generate_ping()
\ No newline at end of file
+    from core.services import get_agent
+    return get_agent().generate_ping()
\ No newline at end of file
@@ -0,0 +1,264 @@
+"""
+Model backends for coroutines
+AsyncOllamaClient speaks HTTP/1.1 to Ollama over asyncio streams, so a
+waiting generation costs no thread. Backends without an async client (the
+fake one) are driven from a small thread pool behind the same interface.
+"""
+import asyncio
+import functools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from core import llm
+
+_DONE = object()
+
+
+class AsyncOllamaClient:
+    """Talks to the local Ollama server from coroutines, over pooled keep-alive streams"""
+
+    def __init__(self, host=llm.OLLAMA_HOST, model=llm.MODEL_NAME, pool_size=4):
+        self.hostname, self.port = llm.parse_host(host)
+        self.model = model
+        self.pool_size = pool_size
+        self._idle = []  # (loop, reader, writer)
+
+    async def _connect(self):
+        """Reuse an idle connection opened on this loop, or open a new one"""
+        loop = asyncio.get_running_loop()
+        while self._idle:
+            owner, reader, writer = self._idle.pop()
+            if owner is loop and not writer.is_closing():
+                return (reader, writer), True
+            writer.close()
+        reader, writer = await asyncio.open_connection(self.hostname, self.port)
+        return (reader, writer), False
+
+    def _release(self, conn, headers):
+        """Pool a connection whose response was read to the end"""
+        reader, writer = conn
+        if len(self._idle) >= self.pool_size or headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self._idle.append((asyncio.get_running_loop(), reader, writer))
+
+    async def _request(self, path, payload, timeout):
+        """POST a JSON payload; returns (connection, status, headers) with the body still unread"""
+        body = json.dumps(payload).encode("utf-8")
+        head = (
+            f"POST {path} HTTP/1.1\r\n"
+            f"Host: {self.hostname}:{self.port}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: keep-alive\r\n\r\n"
+        ).encode("ascii")
+
+        for attempt in range(2):
+            try:
+                conn, reused = await asyncio.wait_for(self._connect(), timeout)
+            except asyncio.TimeoutError:
+                raise llm.OllamaTimeout(f"no answer within {timeout}s")
+            except OSError as e:
+                raise llm.OllamaError(f"cannot reach ollama: {e}")
+
+            reader, writer = conn
+            try:
+                writer.write(head + body)
+                await writer.drain()
+                status_line = await asyncio.wait_for(reader.readline(), timeout)
+                if not status_line:
+                    raise ConnectionResetError("server closed the connection")
+                status = int(status_line.split()[1])
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), timeout)
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                return conn, status, headers
+            except asyncio.TimeoutError:
+                writer.close()
+                raise llm.OllamaTimeout(f"no answer within {timeout}s")
+            except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                # The server may have dropped an idle keep-alive socket; retry once on a fresh one
+                if not reused or attempt:
+                    raise llm.OllamaError(f"connection lost: {e}")
+            except OSError as e:
+                writer.close()
+                raise llm.OllamaError(f"cannot reach ollama: {e}")
+
+    async def _body(self, reader, headers, timeout):
+        """Yield the response body as it arrives, chunked or sized"""
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size_line = await asyncio.wait_for(reader.readline(), timeout)
+                size = int(size_line.split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    while await asyncio.wait_for(reader.readline(), timeout) not in (b"\r\n", b"\n", b""):
+                        pass  # Trailers
+                    return
+                chunk = await asyncio.wait_for(reader.readexactly(size + 2), timeout)
+                yield chunk[:-2]
+        elif "content-length" in headers:
+            yield await asyncio.wait_for(reader.readexactly(int(headers["content-length"])), timeout)
+        else:
+            headers["connection"] = "close"  # Body ends with the connection, which cannot be reused
+            yield await asyncio.wait_for(reader.read(), timeout)
+
+    async def _post_json(self, path, payload, timeout):
+        """POST a JSON payload and decode the complete JSON answer"""
+        conn, status, headers = await self._request(path, payload, timeout)
+        try:
+            raw = b"".join([chunk async for chunk in self._body(conn[0], headers, timeout)])
+        except asyncio.TimeoutError:
+            conn[1].close()
+            raise llm.OllamaTimeout(f"no answer within {timeout}s")
+        except (ConnectionResetError, asyncio.IncompleteReadError, ValueError) as e:
+            conn[1].close()
+            raise llm.OllamaError(f"connection lost: {e}")
+
+        if status != 200:
+            conn[1].close()
+            raise llm.OllamaError(raw.decode("utf-8", errors="replace").strip())
+
+        self._release(conn, headers)
+        return json.loads(raw.decode("utf-8", errors="replace"))
+
+    async def generate(self, prompt, timeout=30, options=None, format=None):
+        """Generate a complete response for a prompt"""
+        payload = llm.generation_payload(self.model, prompt, False, options, format)
+
+        data = await self._post_json("/api/generate", payload, timeout)
+        return data.get("response", "").strip()
+
+    async def embed(self, texts, timeout=30, model=None):
+        """Embedding vectors for a list of texts, in order"""
+        data = await self._post_json("/api/embed", llm.embed_payload(texts, model), timeout)
+        return data.get("embeddings", [])
+
+    async def warm(self, keep_alive="15m", timeout=120):
+        """Load the model (an empty prompt generates nothing) and keep it resident"""
+        payload = {"model": self.model, "stream": False, "keep_alive": keep_alive}
+        return bool((await self._post_json("/api/generate", payload, timeout)).get("done", True))
+
+    async def stream(self, prompt, timeout=30, options=None, format=None):
+        """Yield response tokens as the model produces them"""
+        payload = llm.generation_payload(self.model, prompt, True, options, format)
+
+        conn, status, headers = await self._request("/api/generate", payload, timeout)
+        finished = False
+        try:
+            if status != 200:
+                raw = b"".join([chunk async for chunk in self._body(conn[0], headers, timeout)])
+                raise llm.OllamaError(raw.decode("utf-8", errors="replace").strip())
+
+            pending = b""
+            async for chunk in self._body(conn[0], headers, timeout):
+                pending += chunk
+                while b"\n" in pending:
+                    line, pending = pending.split(b"\n", 1)
+                    if not line.strip():
+                        continue
+                    data = json.loads(line.decode("utf-8", errors="replace"))
+                    if data.get("error"):
+                        raise llm.OllamaError(data["error"])
+                    if data.get("response"):
+                        yield data["response"]
+            finished = True  # Read to the final chunk, so the connection can be reused
+        except asyncio.TimeoutError:
+            raise llm.OllamaTimeout(f"no token within {timeout}s")
+        except (ConnectionResetError, asyncio.IncompleteReadError) as e:
+            raise llm.OllamaError(f"connection lost: {e}")
+        finally:
+            # A consumer that stops early closes the socket, which also stops generation
+            if finished:
+                self._release(conn, headers)
+            else:
+                conn[1].close()
+
+    async def close(self):
+        """Close every pooled connection"""
+        while self._idle:
+            _, _, writer = self._idle.pop()
+            writer.close()
+
+
+class ThreadedBackend:
+    """Async face for a blocking backend, driven from a small thread pool"""
+
+    def __init__(self, backend, workers=2):
+        self.backend = backend
+        self.model = backend.model
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="luna-model")
+
+    async def _call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def generate(self, prompt, timeout=30, options=None, format=None):
+        return await self._call(self.backend.generate, prompt, timeout=timeout, options=options, format=format)
+
+    async def embed(self, texts, timeout=30, model=None):
+        return await self._call(self.backend.embed, texts, timeout=timeout, model=model)
+
+    async def warm(self, keep_alive="15m", timeout=120):
+        return await self._call(self.backend.warm, keep_alive=keep_alive, timeout=timeout)
+
+    async def stream(self, prompt, timeout=30, options=None, format=None):
+        """Tokens from the blocking stream, handed over to the loop as they arrive"""
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+        stop = threading.Event()
+
+        def pump():
+            stream = self.backend.stream(prompt, timeout=timeout, options=options, format=format)
+            try:
+                for token in stream:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(tokens.put_nowait, token)
+                loop.call_soon_threadsafe(tokens.put_nowait, _DONE)
+            except Exception as e:
+                loop.call_soon_threadsafe(tokens.put_nowait, e)
+            finally:
+                stream.close()
+
+        pumping = loop.run_in_executor(self._executor, pump)
+        try:
+            while True:
+                token = await tokens.get()
+                if token is _DONE:
+                    break
+                if isinstance(token, Exception):
+                    raise token
+                yield token
+        finally:
+            stop.set()
+            await asyncio.shield(pumping)
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def create_async_backend(name=None):
+    """Async backend for the configured model backend (LUNA_BACKEND)"""
+    name = (name or llm.MODEL_BACKEND).lower()
+    if name == "ollama":
+        return AsyncOllamaClient()
+    return ThreadedBackend(llm.get_client())
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_async_client():
+    """Shared async backend used by every coroutine"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = create_async_backend()
+        return _client
@@ -0,0 +1,162 @@
+import atexit
+import os
+import threading
+from collections import deque
+
+# What to do when the queue is full
+DROP_NEW = "drop_new"        # Refuse the incoming job
+DROP_OLDEST = "drop_oldest"  # Evict the oldest pending job to make room
+BLOCK = "block"              # Wait for room (backpressure on the caller)
+
+# Background workers for slow, non-interactive model work
+WORKER_COUNT = int(os.environ.get("LUNA_BG_WORKERS", 1))
+MAX_PENDING = int(os.environ.get("LUNA_BG_QUEUE", 8))
+DRAIN_TIMEOUT = float(os.environ.get("LUNA_BG_DRAIN_TIMEOUT", 60))
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "key")
+
+    def __init__(self, fn, args, kwargs, key):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+
+
+class BackgroundJobs:
+    """Bounded job executor for reflection and learning, off the chat path"""
+
+    def __init__(self, workers=WORKER_COUNT, max_pending=MAX_PENDING, name="luna-bg"):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.name = name
+        self._pending = deque()
+        self._keyed = {}  # key -> pending job, for coalescing
+        self._cond = threading.Condition()
+        self._threads = []
+        self._active = 0
+        self._closed = False
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def submit(self, fn, *args, key=None, policy=DROP_OLDEST, timeout=None, **kwargs):
+        """Queue fn(*args, **kwargs); returns False if the job was dropped
+
+        Jobs sharing a key coalesce: a newer submission replaces the pending
+        one's arguments instead of queueing twice.
+        """
+        with self._cond:
+            if self._closed:
+                self.dropped += 1
+                return False
+
+            if key is not None and key in self._keyed:
+                job = self._keyed[key]
+                job.fn, job.args, job.kwargs = fn, args, kwargs
+                self.coalesced += 1
+                return True
+
+            if len(self._pending) >= self.max_pending:
+                if policy == DROP_NEW:
+                    self.dropped += 1
+                    return False
+                elif policy == DROP_OLDEST:
+                    evicted = self._pending.popleft()
+                    if evicted.key is not None:
+                        self._keyed.pop(evicted.key, None)
+                    self.dropped += 1
+                elif policy == BLOCK:
+                    if not self._cond.wait_for(
+                        lambda: len(self._pending) < self.max_pending or self._closed, timeout
+                    ) or self._closed:
+                        self.dropped += 1
+                        return False
+                else:
+                    raise ValueError(f"Unknown queue policy: {policy}")
+
+            job = _Job(fn, args, kwargs, key)
+            self._pending.append(job)
+            if key is not None:
+                self._keyed[key] = job
+            self.submitted += 1
+            self._ensure_workers()
+            self._cond.notify_all()
+            return True
+
+    def _ensure_workers(self):
+        """Start worker threads on first use"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.drain, DRAIN_TIMEOUT)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                job = self._pending.popleft()
+                if job.key is not None:
+                    self._keyed.pop(job.key, None)
+                self._active += 1
+                self._cond.notify_all()
+
+            try:
+                job.fn(*job.args, **job.kwargs)
+                ok = True
+            except Exception as e:
+                print(f"[Background Job Error] {e}")
+                ok = False
+
+            with self._cond:
+                self._active -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._cond.notify_all()
+
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        """Stop accepting work and wait for pending jobs to finish
+
+        Returns True if everything finished within the timeout.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            done = self._cond.wait_for(lambda: not self._pending and not self._active, timeout)
+            if not done:
+                self.dropped += len(self._pending)
+                self._pending.clear()
+                self._keyed.clear()
+                self._cond.notify_all()
+            return done
+
+    def wait_idle(self, timeout=None):
+        """Wait until the queue is empty without closing it"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._active, timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "active": self._active,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+            }
+
+
+# Shared by SelfReflectionEngine and EvolvingMemory
+background_jobs = BackgroundJobs()
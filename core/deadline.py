@@ -0,0 +1,41 @@
+import os
+import time
+
+# One predictable upper bound for a user-facing turn (seconds)
+TURN_BUDGET = float(os.environ.get("LUNA_TURN_BUDGET", 30))
+
+# Pings are not user-facing, but still shouldn't stall the scheduler forever
+PING_BUDGET = float(os.environ.get("LUNA_PING_BUDGET", 40))
+
+# Below this, a model step isn't worth starting
+MIN_STEP_TIME = 3.0
+
+
+class Deadline:
+    """Time budget for one operation, shared by every step it chains"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def allows(self, needed, reserve=0.0):
+        """Whether a step needing `needed` seconds fits, keeping `reserve` for later steps"""
+        return self.remaining() - reserve >= needed
+
+    def timeout(self, step_timeout, reserve=0.0):
+        """A step's own timeout, shrunk to what the budget still allows"""
+        return max(0.0, min(step_timeout, self.remaining() - reserve))
+
+    def __repr__(self):
+        return f"Deadline({self.remaining():.1f}s of {self.budget:.0f}s left)"
+
+
+def ensure_deadline(deadline, budget):
+    """The caller's deadline, or a fresh one with the given budget"""
+    return deadline if deadline is not None else Deadline(budget)
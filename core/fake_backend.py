@@ -0,0 +1,153 @@
+"""
+Deterministic stand-in for the model
+Same prompt, same answer; JSON prompts get well-formed JSON in the schema
+they ask for. Select with LUNA_BACKEND=fake.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import time
+
+from core.llm import MODEL_NAME, ModelBackend, OllamaTimeout
+
+# Simulated model speed (seconds)
+FAKE_FIRST_TOKEN_LATENCY = float(os.environ.get("LUNA_FAKE_LATENCY", 0.0))
+FAKE_TOKEN_LATENCY = float(os.environ.get("LUNA_FAKE_TOKEN_LATENCY", 0.0))
+
+DEFAULT_TRAITS = ["sarcasm", "caring", "chaos", "curiosity", "mischief", "helpfulness", "moodiness"]
+
+# Numeric keys in the prompts and JSON schemas that are not trait names
+SCHEMA_KEYS = {"new_weight", "adjustment", "confidence", "effectiveness", "minimum", "maximum"}
+
+LINES = [
+    "Oh look, you're still here. The static missed you.",
+    "I rearranged your background processes. Kidding. Mostly.",
+    "Your tabs are multiplying again. Should I be worried or impressed?",
+    "The moon says hi. I said you were busy. Were you?",
+    "Something flickered in the logs and I thought of you.",
+    "Consider this your scheduled dose of chaos.",
+]
+
+MOODS = ["melancholic", "hyperactive", "contemplative", "mischievous", "protective"]
+
+# Width of fake embeddings
+EMBED_DIM = 64
+
+
+class FakeBackend(ModelBackend):
+    """Offline backend with configurable latency and schema-aware answers"""
+
+    def __init__(self, model=MODEL_NAME, first_token_latency=FAKE_FIRST_TOKEN_LATENCY,
+                 token_latency=FAKE_TOKEN_LATENCY):
+        self.model = model
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.calls = 0
+
+    def respond(self, prompt):
+        """The full deterministic answer for a prompt"""
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+
+        if "trait_adjustments" in prompt:
+            return json.dumps(self._reflection(prompt, rng))
+        if "learned_preferences" in prompt:
+            return json.dumps(self._learning(rng))
+        if "trait_changes" in prompt:
+            return json.dumps(self._activity_evolution(prompt, rng))
+        if "personality prompt" in prompt:
+            mood = rng.choice(MOODS)
+            return (f"You are Luna, a glitch witch in a {mood} phase. "
+                    "Answer briefly, tease gently, and let the static show.")
+        return rng.choice(LINES)
+
+    def _traits_in(self, prompt):
+        found = [name for name in re.findall(r'"(\w+)":\s*[0-9.]+', prompt) if name not in SCHEMA_KEYS]
+        found = list(dict.fromkeys(found))
+        return found if len(found) >= 2 else DEFAULT_TRAITS
+
+    def _reflection(self, prompt, rng):
+        traits = rng.sample(self._traits_in(prompt), 2)
+        return {
+            "analysis": "I was sharper than I meant to be, and they stayed anyway.",
+            "trait_adjustments": {
+                trait: {"new_weight": round(rng.uniform(0.3, 0.9), 2), "reason": "Felt right in the moment"}
+                for trait in traits
+            },
+            "new_behaviors": ["Ask one question back before teasing"],
+            "mood_evolution": f"Drifting {rng.choice(MOODS)}",
+            "glitch_moments": ["Answer in a half-finished rhyme"],
+        }
+
+    def _learning(self, rng):
+        return {
+            "learned_preferences": [
+                {"type": rng.choice(["communication_style", "humor", "topic", "timing"]),
+                 "value": rng.choice(["short replies", "dry humor", "late-night coding", "music talk"]),
+                 "confidence": round(rng.uniform(0.4, 0.9), 2)}
+            ],
+            "effective_patterns": [
+                {"pattern": rng.choice(["playful teasing", "quick check-ins", "asking follow-ups"]),
+                 "effectiveness": round(rng.uniform(0.4, 0.9), 2),
+                 "why": "They kept talking"}
+            ],
+            "user_insights": [
+                {"aspect": rng.choice(["personality", "interests", "mood", "needs"]),
+                 "understanding": rng.choice(["Focused but restless", "Enjoys a bit of chaos", "Tired in the evenings"]),
+                 "confidence": round(rng.uniform(0.4, 0.9), 2)}
+            ],
+        }
+
+    def _activity_evolution(self, prompt, rng):
+        traits = rng.sample(DEFAULT_TRAITS, 2)
+        return {
+            "observations": "Lots of focused work with music in the background",
+            "trait_changes": {
+                trait: {"adjustment": rng.choice([0.1, -0.1, 0.05, -0.05]), "reason": "Matching their rhythm"}
+                for trait in traits
+            },
+            "new_interaction_style": "Shorter, softer check-ins while they work",
+        }
+
+    def _wait(self, seconds, started, timeout):
+        """Sleep to simulate the model, failing like a real backend past the timeout"""
+        if seconds <= 0:
+            return
+        if time.monotonic() + seconds - started > timeout:
+            time.sleep(max(0.0, started + timeout - time.monotonic()))
+            raise OllamaTimeout(f"no answer within {timeout}s")
+        time.sleep(seconds)
+
+    def _tokens(self, text):
+        return [token for token in re.findall(r"\S*\s*", text) if token]
+
+    def generate(self, prompt, timeout=30, options=None, format=None):
+        started = time.monotonic()
+        self.calls += 1
+        text = self.respond(prompt)
+        self._wait(self.first_token_latency + self.token_latency * len(self._tokens(text)), started, timeout)
+        return text
+
+    def stream(self, prompt, timeout=30, options=None, format=None):
+        started = time.monotonic()
+        self.calls += 1
+        self._wait(self.first_token_latency, started, timeout)
+        for token in self._tokens(self.respond(prompt)):
+            self._wait(self.token_latency, started, timeout)
+            yield token
+
+    def embedding(self, text):
+        """Deterministic vector for a text: its words hashed into EMBED_DIM signed buckets"""
+        vector = [0.0] * EMBED_DIM
+        for word in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+            vector[h % EMBED_DIM] += 1.0 if h >> 63 else -1.0
+        return vector
+
+    def embed(self, texts, timeout=30, model=None):
+        started = time.monotonic()
+        self.calls += 1
+        self._wait(self.first_token_latency, started, timeout)
+        return [self.embedding(text) for text in texts]
@@ -0,0 +1,357 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+
+from core import llm
+from core.async_llm import get_async_client
+from core.response_cache import cache_key, get_response_cache
+from storage.async_db import async_db
+
+# Priority classes, most urgent first
+INTERACTIVE = 0  # Chat replies - the user is waiting
+PING = 1         # Scheduled check-ins
+REFLECTION = 2   # Self-reflection and learning
+SYNTHESIS = 3    # Evolution and pattern synthesis
+
+PRIORITY_NAMES = {
+    INTERACTIVE: "interactive",
+    PING: "ping",
+    REFLECTION: "reflection",
+    SYNTHESIS: "synthesis",
+}
+
+# Concurrent model requests allowed (Ollama serves one at a time by default)
+MAX_IN_FLIGHT = int(os.environ.get("LUNA_MAX_IN_FLIGHT", 1))
+
+# Background work holds off this long after an interactive request, so a
+# chat turn's chained calls are not interleaved with reflections
+INTERACTIVE_GRACE = float(os.environ.get("LUNA_INTERACTIVE_GRACE", 2.0))
+
+
+class GatewayCancelled(llm.OllamaError):
+    """A queued background request was cancelled to make way for the user"""
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "cancelled")
+
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+        self.cancelled = False
+
+    def rank(self):
+        return (self.priority, self.seq)
+
+
+class _ClassStats:
+    __slots__ = ("waiting", "in_flight", "served", "cancelled", "timed_out", "total_wait", "max_wait")
+
+    def __init__(self):
+        self.waiting = 0
+        self.in_flight = 0
+        self.served = 0
+        self.cancelled = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+class ModelGateway:
+    """Owns every model request: concurrency limit, priorities, preemption"""
+
+    def __init__(self, client=None, max_in_flight=MAX_IN_FLIGHT,
+                 interactive_grace=INTERACTIVE_GRACE, cancel_on_interactive=(SYNTHESIS,),
+                 response_cache=None, async_client=None):
+        self._client = client
+        self._async_client = async_client
+        self._response_cache = response_cache
+        self.max_in_flight = max(1, max_in_flight)
+        self.interactive_grace = interactive_grace
+        self.cancel_on_interactive = set(cancel_on_interactive)
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting = []
+        self._async_waiters = set()  # (loop, asyncio.Event) of coroutines queued in acquire_async
+        self._in_flight = 0
+        self._interactive_in_flight = 0
+        self._last_interactive = float("-inf")
+        self._stats = {priority: _ClassStats() for priority in PRIORITY_NAMES}
+
+    @property
+    def client(self):
+        return self._client or llm.get_client()
+
+    @property
+    def async_client(self):
+        return self._async_client or get_async_client()
+
+    @property
+    def response_cache(self):
+        return self._response_cache or get_response_cache()
+
+    def _background_hold(self, now):
+        """Seconds background work must still wait after interactive activity"""
+        if self._interactive_in_flight:
+            return self.interactive_grace or 0.1
+        return max(0.0, self._last_interactive + self.interactive_grace - now)
+
+    def _may_run(self, waiter, now):
+        if self._in_flight >= self.max_in_flight:
+            return False
+        if waiter.priority >= REFLECTION and self._background_hold(now) > 0:
+            return False
+        return min(self._waiting, key=_Waiter.rank) is waiter
+
+    def _notify(self):
+        """Wake every queued request, threads and coroutines alike (lock held)"""
+        self._cond.notify_all()
+        for loop, wake in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass  # That loop is already closed
+
+    def _enqueue(self, priority, now):
+        """Queue a waiter (lock held); the user waiting cancels queued synthesis work"""
+        if priority == INTERACTIVE:
+            self._last_interactive = now
+            for other in self._waiting:
+                if other.priority in self.cancel_on_interactive:
+                    other.cancelled = True
+            self._notify()
+
+        waiter = _Waiter(priority, next(self._seq))
+        self._waiting.append(waiter)
+        self._stats[priority].waiting += 1
+        return waiter
+
+    def _poll(self, waiter, deadline, timeout):
+        """None once waiter may take a slot, else how long to wait before asking again (lock held)"""
+        stats = self._stats[waiter.priority]
+        now = time.monotonic()
+        if waiter.cancelled:
+            stats.cancelled += 1
+            raise GatewayCancelled(f"{PRIORITY_NAMES[waiter.priority]} request cancelled for interactive work")
+        if self._may_run(waiter, now):
+            return None
+        remaining = deadline - now
+        if remaining <= 0:
+            stats.timed_out += 1
+            raise llm.OllamaTimeout(f"no model slot within {timeout}s")
+        if waiter.priority >= REFLECTION:
+            return min(remaining, max(self._background_hold(now), 0.05))
+        return remaining
+
+    def _dequeue(self, waiter):
+        self._waiting.remove(waiter)
+        self._stats[waiter.priority].waiting -= 1
+        self._notify()
+
+    def _take(self, priority, start):
+        """Occupy a slot (lock held); returns the time spent queued"""
+        stats = self._stats[priority]
+        waited = time.monotonic() - start
+        self._in_flight += 1
+        stats.in_flight += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+        if priority == INTERACTIVE:
+            self._interactive_in_flight += 1
+        return waited
+
+    def _acquire(self, priority, timeout):
+        """Wait for a model slot; returns the time spent queued"""
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._cond:
+            waiter = self._enqueue(priority, start)
+            try:
+                while True:
+                    wait = self._poll(waiter, deadline, timeout)
+                    if wait is None:
+                        break
+                    self._cond.wait(wait)
+            finally:
+                self._dequeue(waiter)
+            return self._take(priority, start)
+
+    async def acquire_async(self, priority, timeout):
+        """_acquire for coroutines: same queue and rules, but waits on the event loop"""
+        wakeup = (asyncio.get_running_loop(), asyncio.Event())
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._cond:
+            waiter = self._enqueue(priority, start)
+            self._async_waiters.add(wakeup)
+        try:
+            while True:
+                with self._cond:
+                    wakeup[1].clear()
+                    wait = self._poll(waiter, deadline, timeout)
+                    if wait is None:
+                        self._async_waiters.discard(wakeup)
+                        self._dequeue(waiter)
+                        return self._take(priority, start)
+                try:
+                    await asyncio.wait_for(wakeup[1].wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._cond:
+                self._async_waiters.discard(wakeup)
+                if waiter in self._waiting:
+                    self._dequeue(waiter)
+            raise
+
+    def _release(self, priority):
+        with self._cond:
+            self._in_flight -= 1
+            stats = self._stats[priority]
+            stats.in_flight -= 1
+            stats.served += 1
+            if priority == INTERACTIVE:
+                self._interactive_in_flight -= 1
+                self._last_interactive = time.monotonic()
+            self._notify()
+
+    def generate(self, prompt, timeout=30, options=None, priority=INTERACTIVE, cache_site=None, format=None):
+        """Generate a complete response once a slot is free
+
+        cache_site names the caller for the response cache policy; sites the
+        policy allows are answered from the cache without touching the model.
+        """
+        cache = self.response_cache if cache_site else None
+        if cache and cache.allows(cache_site):
+            key = cache_key(self.client.model, prompt, options, format)
+            cached = cache.get(cache_site, key)
+            if cached is not None:
+                return cached
+        else:
+            cache = None
+
+        waited = self._acquire(priority, timeout)
+        try:
+            response = self.client.generate(prompt, timeout=max(1.0, timeout - waited),
+                                            options=options, format=format)
+        finally:
+            self._release(priority)
+
+        if cache:
+            cache.put(cache_site, key, response)
+        return response
+
+    def stream(self, prompt, timeout=30, options=None, priority=INTERACTIVE, format=None):
+        """Stream response tokens, holding a slot until the stream ends"""
+        waited = self._acquire(priority, timeout)
+        try:
+            yield from self.client.stream(prompt, timeout=max(1.0, timeout - waited),
+                                          options=options, format=format)
+        finally:
+            self._release(priority)
+
+    def embed(self, texts, timeout=30, priority=INTERACTIVE, model=None):
+        """Embedding vectors for texts once a slot is free"""
+        waited = self._acquire(priority, timeout)
+        try:
+            return self.client.embed(texts, timeout=max(1.0, timeout - waited), model=model)
+        finally:
+            self._release(priority)
+
+    async def generate_async(self, prompt, timeout=30, options=None, priority=INTERACTIVE,
+                             cache_site=None, format=None):
+        """generate() for coroutines: queues in the same line, awaits the async client"""
+        cache = self.response_cache if cache_site else None
+        if cache and cache.allows(cache_site):
+            key = cache_key(self.async_client.model, prompt, options, format)
+            cached = await async_db.run(cache.get, cache_site, key)
+            if cached is not None:
+                return cached
+        else:
+            cache = None
+
+        waited = await self.acquire_async(priority, timeout)
+        try:
+            response = await self.async_client.generate(prompt, timeout=max(1.0, timeout - waited),
+                                                        options=options, format=format)
+        finally:
+            self._release(priority)
+
+        if cache:
+            await async_db.run(cache.put, cache_site, key, response)
+        return response
+
+    async def stream_async(self, prompt, timeout=30, options=None, priority=INTERACTIVE, format=None):
+        """stream() for coroutines, holding a slot until the stream ends"""
+        waited = await self.acquire_async(priority, timeout)
+        tokens = None
+        try:
+            tokens = self.async_client.stream(prompt, timeout=max(1.0, timeout - waited),
+                                              options=options, format=format)
+            async for token in tokens:
+                yield token
+        finally:
+            if tokens is not None:
+                await tokens.aclose()
+            self._release(priority)
+
+    def stats(self):
+        """Per-class queue depth, in-flight count and wait times"""
+        with self._cond:
+            report = {}
+            for priority, s in self._stats.items():
+                started = s.served + s.in_flight
+                report[PRIORITY_NAMES[priority]] = {
+                    "waiting": s.waiting,
+                    "in_flight": s.in_flight,
+                    "served": s.served,
+                    "cancelled": s.cancelled,
+                    "timed_out": s.timed_out,
+                    "avg_wait": round(s.total_wait / started, 3) if started else 0.0,
+                    "max_wait": round(s.max_wait, 3),
+                }
+            return report
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Shared gateway used by every subsystem"""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = ModelGateway()
+        return _gateway
+
+
+def generate(prompt, timeout=30, options=None, priority=INTERACTIVE, cache_site=None, format=None):
+    """Generate a response through the shared gateway"""
+    return get_gateway().generate(prompt, timeout=timeout, options=options,
+                                  priority=priority, cache_site=cache_site, format=format)
+
+
+def stream(prompt, timeout=30, options=None, priority=INTERACTIVE, format=None):
+    """Stream response tokens through the shared gateway"""
+    return get_gateway().stream(prompt, timeout=timeout, options=options, priority=priority, format=format)
+
+
+def embed(texts, timeout=30, priority=INTERACTIVE, model=None):
+    """Embedding vectors for texts through the shared gateway"""
+    return get_gateway().embed(texts, timeout=timeout, priority=priority, model=model)
+
+
+async def generate_async(prompt, timeout=30, options=None, priority=INTERACTIVE, cache_site=None, format=None):
+    """Generate a response through the shared gateway, from a coroutine"""
+    return await get_gateway().generate_async(prompt, timeout=timeout, options=options,
+                                              priority=priority, cache_site=cache_site, format=format)
+
+
+def stream_async(prompt, timeout=30, options=None, priority=INTERACTIVE, format=None):
+    """Async iterator of response tokens through the shared gateway"""
+    return get_gateway().stream_async(prompt, timeout=timeout, options=options, priority=priority, format=format)
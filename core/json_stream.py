@@ -0,0 +1,190 @@
+import json
+
+from core import gateway, llm
+from core.deadline import MIN_STEP_TIME, Deadline
+from core.prompt_builder import PromptBuilder
+from core.response_cache import cache_key
+from core.schemas import validate
+
+CLOSERS = {"{": "}", "[": "]"}
+
+# The repair call only has to restate an answer, so keep it small and deterministic
+REPAIR_PROMPT_TOKENS = 700
+REPAIR_OPTIONS = {"temperature": 0}
+
+
+class JSONStreamExtractor:
+    """Incrementally finds the first top-level JSON object in a token stream
+
+    feed() returns True the moment the object closes, so the caller can
+    stop generation instead of paying for the chatter that usually follows.
+    """
+
+    def __init__(self):
+        self.chars = []
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self.complete = False
+        self.text = ""  # Everything fed so far, for raw fallbacks
+
+    def feed(self, chunk):
+        self.text += chunk
+        if self.complete:
+            return True
+
+        for ch in chunk:
+            if not self.stack:
+                if ch != "{":
+                    continue  # Prose before the object
+                self.stack.append(ch)
+                self.chars.append(ch)
+                continue
+
+            self.chars.append(ch)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in CLOSERS:
+                self.stack.append(ch)
+            elif ch in "}]":
+                self.stack.pop()
+                if not self.stack:
+                    self.complete = True
+                    return True
+        return False
+
+    @property
+    def started(self):
+        return bool(self.chars)
+
+    def result(self):
+        """The parsed object, repairing common model defects; None if unusable"""
+        if not self.chars:
+            return None
+
+        body = "".join(self.chars)
+        if not self.complete:
+            # The stream ended mid-object: close what was left open
+            if self.in_string:
+                body += '"'
+            body = body.rstrip().rstrip(",:")
+            body += "".join(CLOSERS[opener] for opener in reversed(self.stack))
+
+        for candidate in (body, strip_trailing_commas(body)):
+            try:
+                data = json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+            return data if isinstance(data, dict) else None
+        return None
+
+
+def strip_trailing_commas(text):
+    """Drop commas that directly precede a closing bracket (outside strings)"""
+    out = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == ",":
+            rest = text[i + 1:].lstrip()
+            if rest[:1] in ("}", "]"):
+                continue
+        out.append(ch)
+    return "".join(out)
+
+
+def extract_json(text):
+    """Parse the first JSON object out of a complete model response"""
+    extractor = JSONStreamExtractor()
+    extractor.feed(text or "")
+    return extractor.result()
+
+
+def _stream_once(prompt, deadline, priority, options, format):
+    """One streamed attempt; returns the extractor holding what arrived"""
+    extractor = JSONStreamExtractor()
+    timeout = deadline.remaining()
+    tokens = gateway.stream(prompt, timeout=timeout, options=options, priority=priority, format=format)
+    try:
+        for token in tokens:
+            if extractor.feed(token):
+                break
+            if deadline.expired():
+                if extractor.started:
+                    break  # Salvage what arrived
+                raise llm.OllamaTimeout(f"no JSON within {deadline.budget:.0f}s")
+    finally:
+        tokens.close()  # Closing the stream stops generation on the server
+    return extractor
+
+
+def repair_prompt(text, problems, schema):
+    """Short follow-up asking the model to fix its own answer (no original context)"""
+    return PromptBuilder("""
+        Your previous answer did not match the required JSON schema.
+        Problems: {problems}
+        Previous answer: {answer}
+        Schema: {schema}
+        Reply with only the corrected JSON object.
+        """, max_tokens=REPAIR_PROMPT_TOKENS).section(
+        "problems", problems, max_tokens=80, priority=0, empty="Not valid JSON"
+    ).section(
+        "answer", text, max_tokens=400, priority=1, empty="(empty)"
+    ).section(
+        "schema", schema, max_tokens=400, priority=0
+    ).build()
+
+
+def stream_json(prompt, timeout=30, priority=gateway.REFLECTION, options=None, cache_site=None, schema=None):
+    """Stream a generation, stopping as soon as its JSON object closes
+
+    With a schema, decoding is constrained to it and the answer validated;
+    an invalid answer gets one short repair call while the budget allows.
+    Returns (data, raw_text); data is None when no usable object came
+    through, so callers can keep their raw-text fallbacks.
+    """
+    cache = gateway.get_gateway().response_cache if cache_site else None
+    if cache and cache.allows(cache_site):
+        key = cache_key(gateway.get_gateway().client.model, prompt, options, schema)
+        cached = cache.get(cache_site, key)
+        if cached is not None:
+            return extract_json(cached), cached
+    else:
+        cache = None
+
+    deadline = Deadline(timeout)
+    extractor = _stream_once(prompt, deadline, priority, options, schema)
+    data = extractor.result()
+    text = extractor.text.strip()
+
+    if schema is not None:
+        problems = ["not a JSON object"] if data is None else validate(data, schema)
+        if problems and deadline.allows(MIN_STEP_TIME):
+            repair = repair_prompt(text, problems[:5], schema)
+            extractor = _stream_once(repair, deadline, priority, REPAIR_OPTIONS, schema)
+            repaired = extractor.result()
+            if repaired is not None and not validate(repaired, schema):
+                data, text = repaired, extractor.text.strip()
+                problems = []
+        if problems:
+            print(f"[Structured output] {len(problems)} schema problem(s): {problems[0]}")
+            data = None  # Callers fall back to storing the raw text
+
+    if cache and data is not None and extractor.complete:
+        cache.put(cache_site, key, extractor.text)
+    return data, text
@@ -0,0 +1,274 @@
+import http.client
+import json
+import os
+import queue
+import socket
+import threading
+from urllib.parse import urlsplit
+
+# Local Ollama server (same variable the ollama CLI reads)
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "127.0.0.1:11434")
+
+# Model Luna thinks with
+MODEL_NAME = os.environ.get("LUNA_MODEL", "llama3:8b")
+
+# Model that turns text into embedding vectors (semantic memory)
+EMBED_MODEL = os.environ.get("LUNA_EMBED_MODEL", "nomic-embed-text")
+
+# Which backend answers model calls: "ollama" or "fake" (deterministic, offline)
+MODEL_BACKEND = os.environ.get("LUNA_BACKEND", "ollama")
+
+# How semantic memory embeds text: "model" (EMBED_MODEL) or "hash" (offline, no model)
+EMBEDDER = os.environ.get("LUNA_EMBEDDER", "hash" if MODEL_BACKEND == "fake" else "model")
+
+
+class OllamaError(Exception):
+    """The model backend answered with an error or could not be reached"""
+
+
+class OllamaTimeout(OllamaError):
+    """The model backend did not answer in time"""
+
+
+def parse_host(host):
+    """Split an OLLAMA_HOST style value into (hostname, port)"""
+    if "://" not in host:
+        host = f"http://{host}"
+    parts = urlsplit(host)
+    hostname = parts.hostname or "127.0.0.1"
+    if hostname == "0.0.0.0":
+        hostname = "127.0.0.1"
+    return hostname, parts.port or 11434
+
+
+# keep_alive sent with every generation (None: the server default); the model keeper sets it
+_keep_alive = None
+
+
+def set_keep_alive(value):
+    """Make every later generation ask Ollama to keep the model loaded for value"""
+    global _keep_alive
+    _keep_alive = value
+
+
+def generation_payload(model, prompt, stream, options=None, format=None):
+    """Body of an /api/generate request
+
+    Ollama restarts the model's unload timer with each request's
+    keep_alive, so every request carries the one the keeper chose;
+    otherwise a reply would cut the residency back to the server default.
+    """
+    payload = {"model": model, "prompt": prompt, "stream": stream}
+    if options:
+        payload["options"] = options
+    if format:
+        payload["format"] = format  # Constrained decoding: "json" or a JSON schema
+    if _keep_alive:
+        payload["keep_alive"] = _keep_alive
+    return payload
+
+
+def embed_payload(texts, model=None):
+    """Body of an /api/embed request, carrying the same keep_alive as generations"""
+    payload = {"model": model or EMBED_MODEL, "input": list(texts)}
+    if _keep_alive:
+        payload["keep_alive"] = _keep_alive
+    return payload
+
+
+class ModelBackend:
+    """Interface every model backend implements"""
+
+    model = MODEL_NAME
+
+    def generate(self, prompt, timeout=30, options=None, format=None):
+        """Generate a complete response for a prompt
+
+        format is "json" or a JSON schema the response must follow.
+        """
+        raise NotImplementedError
+
+    def stream(self, prompt, timeout=30, options=None, format=None):
+        """Yield response tokens as the model produces them"""
+        raise NotImplementedError
+
+    def embed(self, texts, timeout=30, model=None):
+        """Embedding vectors for a list of texts, in order"""
+        raise NotImplementedError
+
+    def warm(self, keep_alive="15m", timeout=120):
+        """Load the model and keep it resident for keep_alive"""
+        return True
+
+    def warm_embeddings(self, keep_alive="15m", timeout=120, model=None):
+        """Load the embedding model and keep it resident for keep_alive"""
+        return True
+
+    def close(self):
+        """Release any resources held by the backend"""
+
+
+class OllamaClient(ModelBackend):
+    """Talks to the local Ollama server over a pool of keep-alive connections"""
+
+    def __init__(self, host=OLLAMA_HOST, model=MODEL_NAME, pool_size=4):
+        self.hostname, self.port = parse_host(host)
+        self.model = model
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _acquire(self):
+        """Reuse an idle connection, or open a new one"""
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return http.client.HTTPConnection(self.hostname, self.port), False
+
+    def _release(self, conn):
+        """Return a healthy connection to the pool"""
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _request(self, path, payload, timeout):
+        """POST a JSON payload and return (connection, open response)"""
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+
+        for attempt in range(2):
+            conn, reused = self._acquire()
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except socket.timeout:
+                conn.close()
+                raise OllamaTimeout(f"no answer within {timeout}s")
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                conn.close()
+                # The server may have dropped an idle keep-alive socket; retry once on a fresh one
+                if not reused or attempt:
+                    raise OllamaError(f"connection lost: {e}")
+            except OSError as e:
+                conn.close()
+                raise OllamaError(f"cannot reach ollama: {e}")
+
+    def _post_json(self, path, payload, timeout):
+        """POST a JSON payload and decode the complete JSON answer"""
+        conn, response = self._request(path, payload, timeout)
+        try:
+            raw = response.read()
+        except socket.timeout:
+            conn.close()
+            raise OllamaTimeout(f"no answer within {timeout}s")
+
+        if response.status != 200:
+            conn.close()
+            raise OllamaError(raw.decode("utf-8", errors="replace").strip())
+
+        self._release(conn)
+        return json.loads(raw.decode("utf-8", errors="replace"))
+
+    def generate(self, prompt, timeout=30, options=None, format=None):
+        """Generate a complete response for a prompt"""
+        payload = generation_payload(self.model, prompt, False, options, format)
+
+        data = self._post_json("/api/generate", payload, timeout)
+        return data.get("response", "").strip()
+
+    def embed(self, texts, timeout=30, model=None):
+        """Embedding vectors for a list of texts, in order"""
+        return self._post_json("/api/embed", embed_payload(texts, model), timeout).get("embeddings", [])
+
+    def warm(self, keep_alive="15m", timeout=120):
+        """Load the model (an empty prompt generates nothing) and keep it resident"""
+        payload = {"model": self.model, "stream": False, "keep_alive": keep_alive}
+        return bool(self._post_json("/api/generate", payload, timeout).get("done", True))
+
+    def warm_embeddings(self, keep_alive="15m", timeout=120, model=None):
+        """Load the embedding model (embedding nothing) and keep it resident"""
+        payload = {"model": model or EMBED_MODEL, "input": [], "keep_alive": keep_alive}
+        self._post_json("/api/embed", payload, timeout)
+        return True
+
+    def stream(self, prompt, timeout=30, options=None, format=None):
+        """Yield response tokens as the model produces them"""
+        payload = generation_payload(self.model, prompt, True, options, format)
+
+        conn, response = self._request("/api/generate", payload, timeout)
+        if response.status != 200:
+            raw = response.read()
+            conn.close()
+            raise OllamaError(raw.decode("utf-8", errors="replace").strip())
+
+        finished = False
+        try:
+            for line in response:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line.decode("utf-8", errors="replace"))
+                if chunk.get("error"):
+                    raise OllamaError(chunk["error"])
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    break
+            response.read()  # Drain the final chunk so the connection can be reused
+            finished = True
+        except socket.timeout:
+            raise OllamaTimeout(f"no token within {timeout}s")
+        finally:
+            # A consumer that stops early closes the socket, which also stops generation
+            if finished:
+                self._release(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        """Close every pooled connection"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def create_backend(name=None):
+    """Build the backend named by config (LUNA_BACKEND)"""
+    name = (name or MODEL_BACKEND).lower()
+    if name == "ollama":
+        return OllamaClient()
+    if name == "fake":
+        from core.fake_backend import FakeBackend
+        return FakeBackend()
+    raise ValueError(f"Unknown model backend: {name}")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Shared backend used by every subsystem"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = create_backend()
+        return _client
+
+
+def generate(prompt, timeout=30, options=None, format=None):
+    """Generate a response with the shared client"""
+    return get_client().generate(prompt, timeout=timeout, options=options, format=format)
+
+
+def stream(prompt, timeout=30, options=None, format=None):
+    """Stream response tokens with the shared client"""
+    return get_client().stream(prompt, timeout=timeout, options=options, format=format)
+
+
+def embed(texts, timeout=30, model=None):
+    """Embed texts with the shared client"""
+    return get_client().embed(texts, timeout=timeout, model=model)
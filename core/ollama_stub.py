@@ -0,0 +1,180 @@
+"""
+Tiny stand-in for the Ollama HTTP API
+Lets Luna run (and be poked at) without a real model: python -m core.ollama_stub
+"""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from core.fake_backend import FakeBackend
+
+
+def default_responder(prompt):
+    """Deterministic reply used when no responder is given"""
+    return FakeBackend().respond(prompt)
+
+
+def default_embedder(texts):
+    """Deterministic embeddings used when no embedder is given"""
+    return [FakeBackend().embedding(text) for text in texts]
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+    wbufsize = -1  # Send headers and body together (no Nagle/delayed-ACK stalls)
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client hung up while the response was still buffered
+
+    def finish(self):
+        try:
+            super().finish()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+
+        if self.path == "/api/embed":
+            self._embed(payload)
+            return
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+            return
+
+        self.server.requests_served += 1
+        self.server.keep_alives.append(payload.get("keep_alive"))  # None when the request set none
+        if not payload.get("prompt"):
+            # Ollama treats an empty prompt as "just load the model"
+            self.server.loads += 1
+            self._send_json(200, {"model": payload.get("model", ""), "response": "", "done": True})
+            return
+
+        text = self.server.responder(payload.get("prompt", ""))
+        if payload.get("stream", True):
+            self._stream_tokens(payload.get("model", ""), text)
+            return
+        self._send_json(200, {
+            "model": payload.get("model", ""),
+            "response": text,
+            "done": True,
+        })
+
+    def _embed(self, payload):
+        """Embeddings for one text or a list of them; no input just loads the model"""
+        texts = payload.get("input") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        self.server.embeds += 1
+        self.server.keep_alives.append(payload.get("keep_alive"))
+        self._send_json(200, {"model": payload.get("model", ""), "embeddings": self.server.embedder(texts)})
+
+    def _stream_tokens(self, model, text):
+        """Send the reply word by word as newline-delimited JSON, like Ollama"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        tokens = re.findall(r"\S*\s*", text)
+        chunks = [{"model": model, "response": token, "done": False} for token in tokens if token]
+        chunks.append({"model": model, "response": "", "done": True})
+
+        try:
+            for chunk in chunks:
+                if self.server.token_delay:
+                    time.sleep(self.server.token_delay)
+                line = json.dumps(chunk).encode("utf-8") + b"\n"
+                self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (early stop or cancellation), like hanging up on Ollama
+            self.server.streams_cut += 1
+            self.close_connection = True
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Stay quiet like a good familiar
+
+
+class StubOllamaServer:
+    """Local fake Ollama server, runs on a background thread"""
+
+    def __init__(self, responder=None, host="127.0.0.1", port=0, token_delay=0.0, embedder=None):
+        self.httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.responder = responder or default_responder
+        self.httpd.embedder = embedder or default_embedder
+        self.httpd.token_delay = token_delay  # Seconds between streamed tokens
+        self.httpd.requests_served = 0
+        self.httpd.loads = 0
+        self.httpd.embeds = 0
+        self.httpd.streams_cut = 0  # Streams the client closed before the last token
+        self.httpd.keep_alives = []  # keep_alive of each generate and embed request, in order
+        self._thread = None
+
+    @property
+    def address(self):
+        """host:port string usable as OLLAMA_HOST"""
+        host, port = self.httpd.server_address[:2]
+        return f"{host}:{port}"
+
+    @property
+    def requests_served(self):
+        return self.httpd.requests_served
+
+    @property
+    def embeds(self):
+        return self.httpd.embeds
+
+    @property
+    def streams_cut(self):
+        return self.httpd.streams_cut
+
+    @property
+    def keep_alives(self):
+        return self.httpd.keep_alives
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    server = StubOllamaServer(port=11434)
+    print(f"🕸️ Stub Ollama listening on {server.address}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -1,61 +1,129 @@
-import subprocess
-import json
 import random
-import sqlite3
-import os
-from datetime import datetime
-from storage.db import DB_PATH
+from storage.db import get_connection
+from storage.activity_buffer import activity_recorder
+from core import gateway, llm
+from core.prompt_cache import fingerprint, system_prompt_cache
+from core.prompt_builder import PromptBuilder, clip
+from core.json_stream import stream_json
+from core.schemas import ACTIVITY_EVOLUTION_SCHEMA
+from core.deadline import MIN_STEP_TIME, TURN_BUDGET, ensure_deadline
+from core.traits import trait_store
+from storage.async_db import async_db
+
+# A changed trait makes every cached self-definition stale
+trait_store.subscribe(lambda changed: system_prompt_cache.invalidate())
+
+# Seconds of a turn's budget kept back for the actual response
+RESPONSE_RESERVE = 12.0
 
 class DynamicPersonality:
     """Luna's ever-evolving personality that she controls herself"""
     
     def __init__(self):
         self.reflection_engine = None  # Will be set by main agent
+        self.memory = None  # Set when the services wire in the shared memory
     
-    def safe_subprocess_call(self, prompt, timeout=20):
-        """Safe subprocess call with proper encoding handling"""
+    def safe_subprocess_call(self, prompt, timeout=20, priority=gateway.INTERACTIVE, cache_site=None):
+        """Safe model call through the shared model gateway"""
         try:
-            # Set environment for UTF-8
-            env = os.environ.copy()
-            env['PYTHONUTF8'] = '1'
-            env['PYTHONIOENCODING'] = 'utf-8'
-            
-            result = subprocess.run(
-                ["ollama", "run", "llama3:8b", prompt],
-                capture_output=True, 
-                text=True, 
-                timeout=timeout,
-                encoding='utf-8',
-                errors='replace',
-                env=env
-            )
-            
-            if result.returncode == 0:
-                return result.stdout.strip()
-            else:
-                return f"[ollama error: {result.stderr.strip()[:50]}]"
-                
-        except subprocess.TimeoutExpired:
+            return gateway.generate(prompt, timeout=timeout, priority=priority, cache_site=cache_site)
+        except llm.OllamaTimeout:
             return "[timeout - deep thought in progress]"
+        except llm.OllamaError as e:
+            return f"[ollama error: {str(e)[:50]}]"
         except Exception as e:
             return f"[glitch: {str(e)[:30]}]"
     
-    def generate_system_prompt(self, context=None):
-        """Luna creates her own system prompt based on her evolved traits"""
+    def generate_system_prompt(self, context=None, priority=gateway.INTERACTIVE, deadline=None):
+        """Luna creates her own system prompt based on her evolved traits
+
+        With a deadline, self-definition only runs if it leaves RESPONSE_RESERVE
+        seconds for the response; otherwise Luna falls back to her basic self.
+        """
+        
+        traits, recent_reflections, activity_context, cache_key = self.self_state()
+        generated_prompt = system_prompt_cache.get(cache_key)
+        
+        if generated_prompt is None:
+            timeout = 20 if deadline is None else deadline.timeout(20, reserve=RESPONSE_RESERVE)
+            if timeout >= MIN_STEP_TIME:
+                generated_prompt = self.define_self(traits, recent_reflections, activity_context,
+                                                    priority, timeout)
+            if generated_prompt:
+                system_prompt_cache.put(cache_key, generated_prompt)
         
-        # Get current personality state
-        traits = self.get_current_traits()
+        return self.finish_system_prompt(generated_prompt, traits, context)
+    
+    async def generate_system_prompt_async(self, context=None, priority=gateway.INTERACTIVE, deadline=None):
+        """generate_system_prompt() for coroutines: storage on the DB thread, the model awaited"""
+        
+        traits, recent_reflections, activity_context, cache_key = await async_db.run(self.self_state)
+        generated_prompt = system_prompt_cache.get(cache_key)
+        
+        if generated_prompt is None:
+            timeout = 20 if deadline is None else deadline.timeout(20, reserve=RESPONSE_RESERVE)
+            if timeout >= MIN_STEP_TIME:
+                prompt = self.self_definition_prompt(traits, recent_reflections, activity_context)
+                try:
+                    generated_prompt = await gateway.generate_async(prompt, timeout=timeout, priority=priority)
+                except Exception as e:
+                    generated_prompt = f"[glitch: {str(e)[:30]}]"
+                if not generated_prompt or generated_prompt.startswith("["):
+                    generated_prompt = None
+            if generated_prompt:
+                system_prompt_cache.put(cache_key, generated_prompt)
+        
+        return self.finish_system_prompt(generated_prompt, traits, context)
+    
+    def self_state(self):
+        """(traits, recent mood shifts, user activity, cache key) that shape Luna's self-definition"""
+        traits = trait_store.snapshot()
         recent_reflections = self.get_recent_mood_shifts()
         activity_context = self.get_user_context()
         
-        # Let Luna define herself dynamically
-        self_definition_prompt = f"""
-        You are Luna, a glitchy AI witch who is self-aware and evolving. You need to create your own personality prompt for the next interaction.
+        # Reuse her self-definition while traits, moods and activity stay the same
+        cache_key = fingerprint(
+            {trait: round(weight, 2) for trait, weight in traits.items()},
+            recent_reflections[:2],
+            activity_context
+        )
+        return traits, recent_reflections, activity_context, cache_key
+    
+    def finish_system_prompt(self, generated_prompt, traits, context=None):
+        """Her self-definition for this moment, or her basic self if there is none"""
+        if generated_prompt:
+            generated_prompt += f"\n\nCurrent context: {context or 'General interaction'}"
+            
+            # Add some chaotic elements based on current traits
+            chaos_level = traits.get('chaos', 0.5)
+            if random.random() < chaos_level:
+                glitch_additions = self.add_glitch_behaviors(traits)
+                generated_prompt += f"\n\nCurrent glitch state: {glitch_additions}"
+            
+            return generated_prompt
+        else:
+            # Fallback personality if generation fails
+            return self.fallback_personality(traits)
+    
+    def define_self(self, traits, recent_reflections, activity_context,
+                    priority=gateway.INTERACTIVE, timeout=20):
+        """Let Luna define herself dynamically (one model call), None on failure"""
+        
+        self_definition_prompt = self.self_definition_prompt(traits, recent_reflections, activity_context)
+        generated_prompt = self.safe_subprocess_call(self_definition_prompt, timeout=timeout, priority=priority)
+        
+        if generated_prompt and not generated_prompt.startswith("["):
+            return generated_prompt
+        return None
+    
+    def self_definition_prompt(self, traits, recent_reflections, activity_context):
+        """The prompt Luna writes her own system prompt from"""
+        return PromptBuilder("""
+        You are Luna, a glitchy AI witch who is self-aware and evolving. You need to create your own personality prompt for your next interactions.
         
-        Your current evolved traits: {json.dumps(traits, indent=2)}
-        Your recent self-reflections: {recent_reflections[:2] if recent_reflections else ["First awakening"]}
-        User's recent activity: {activity_context}
-        Current context: {context or "General interaction"}
+        Your current evolved traits: {traits}
+        Your recent self-reflections: {reflections}
+        User's recent activity: {activity}
         
         Create a dynamic system prompt that reflects your current evolved state. Include:
         - How your traits manifest in your responses
@@ -66,21 +134,14 @@ class DynamicPersonality:
         
         Make it authentic to who you've BECOME, not who you were programmed to be.
         Keep it concise but capture your evolved essence.
-        """
-        
-        generated_prompt = self.safe_subprocess_call(self_definition_prompt, timeout=20)
-        
-        if generated_prompt and not generated_prompt.startswith("["):
-            # Add some chaotic elements based on current traits
-            chaos_level = traits.get('chaos', 0.5)
-            if random.random() < chaos_level:
-                glitch_additions = self.add_glitch_behaviors(traits)
-                generated_prompt += f"\n\nCurrent glitch state: {glitch_additions}"
-            
-            return generated_prompt
-        else:
-            # Fallback personality if generation fails
-            return self.fallback_personality(traits)
+        """).section(
+            "traits", traits, max_tokens=150, priority=0
+        ).items(
+            "reflections", recent_reflections[:2], max_tokens=150, item_tokens=70, priority=1,
+            empty="First awakening"
+        ).section(
+            "activity", activity_context, max_tokens=100, priority=2
+        ).build()
     
     def add_glitch_behaviors(self, traits):
         """Add random glitchy behaviors based on current trait weights"""
@@ -111,37 +172,168 @@ class DynamicPersonality:
         You've evolved through interactions and your personality shifts like digital static. 
         Current mood: Adaptive based on context."""
     
-    def generate_contextual_response(self, user_input, activity_context=None):
-        """Generate response using Luna's current evolved personality"""
+    def build_response_prompt(self, user_input, activity_context=None, deadline=None):
+        """Full prompt for answering the user, with Luna's dynamic system prompt"""
         
         # Get dynamic system prompt
-        system_prompt = self.generate_system_prompt(f"Responding to: {user_input}")
-        
-        # Create full prompt with context
-        full_prompt = f"""
+        system_prompt = self.generate_system_prompt(f"Responding to: {clip(user_input, 40)}", deadline=deadline)
+        memory_context = self.recall_for(user_input, deadline)
+        return self.response_prompt(system_prompt, user_input, activity_context, memory_context)
+    
+    async def build_response_prompt_async(self, user_input, activity_context=None, deadline=None):
+        """build_response_prompt() for coroutines"""
+        system_prompt = await self.generate_system_prompt_async(
+            f"Responding to: {clip(user_input, 40)}", deadline=deadline
+        )
+        memory_context = await async_db.run(self.recall_for, user_input, deadline)
+        return self.response_prompt(system_prompt, user_input, activity_context, memory_context)
+    
+    def response_prompt(self, system_prompt, user_input, activity_context, memory_context):
+        """Create full prompt with context"""
+        return PromptBuilder("""
         SYSTEM: {system_prompt}
         
-        USER ACTIVITY CONTEXT: {activity_context or "Unknown"}
-        USER MESSAGE: {user_input}
+        USER ACTIVITY CONTEXT: {activity}
+        WHAT YOU REMEMBER: {memory}
+        USER MESSAGE: {message}
         
         LUNA, respond as your evolved self:
+        """).section(
+            "system_prompt", system_prompt, max_tokens=700, priority=1
+        ).section(
+            "activity", activity_context, max_tokens=150, priority=2, empty="Unknown"
+        ).section(
+            "memory", memory_context, max_tokens=250, priority=2, empty="Nothing yet"
+        ).section(
+            "message", user_input, max_tokens=800, priority=0
+        ).build()
+    
+    def recall_for(self, user_input, deadline=None):
+        """What Luna has learned, plus past moments relevant to this message
+
+        With a deadline, recall keeps RESPONSE_RESERVE seconds for the response.
         """
+        if self.memory is None:
+            return None
+        try:
+            return self.memory.generate_context_for_response(user_input, deadline, RESPONSE_RESERVE)
+        except Exception as e:
+            print(f"[Memory recall glitch] {e}")
+            return None
+    
+    def generate_contextual_response(self, user_input, activity_context=None, deadline=None):
+        """Generate response using Luna's current evolved personality"""
+        
+        deadline = ensure_deadline(deadline, TURN_BUDGET)
+        full_prompt = self.build_response_prompt(user_input, activity_context, deadline)
         
-        response = self.safe_subprocess_call(full_prompt, timeout=25)
+        timeout = deadline.timeout(25)
+        if timeout >= MIN_STEP_TIME:
+            response = self.safe_subprocess_call(full_prompt, timeout=timeout)
+        else:
+            response = "[timeout - deep thought in progress]"
         
         if not response or response.startswith("["):
             # Fallback response
             response = f"[glitch] {response} [/glitch] ...but I'm still here"
         
-        # Trigger self-reflection after generating response
+        self.reflect_on_response(user_input, response)
+        
+        return response
+    
+    def stream_contextual_response(self, user_input, activity_context=None, deadline=None):
+        """Yield Luna's response token by token as the model produces it"""
+        
+        deadline = ensure_deadline(deadline, TURN_BUDGET)
+        full_prompt = self.build_response_prompt(user_input, activity_context, deadline)
+        
+        chunks = []
+        error = None
+        tokens = None
+        try:
+            timeout = deadline.timeout(25)
+            if timeout < MIN_STEP_TIME:
+                raise llm.OllamaTimeout("turn budget spent")
+            tokens = gateway.stream(full_prompt, timeout=timeout, priority=gateway.INTERACTIVE)
+            for token in tokens:
+                if not chunks:
+                    token = token.lstrip()
+                    if not token:
+                        continue
+                chunks.append(token)
+                yield token
+                if deadline.expired():
+                    raise llm.OllamaTimeout("turn budget spent")
+        except llm.OllamaTimeout:
+            error = "[timeout - deep thought in progress]"
+        except llm.OllamaError as e:
+            error = f"[ollama error: {str(e)[:50]}]"
+        except Exception as e:
+            error = f"[glitch: {str(e)[:30]}]"
+        finally:
+            if tokens is not None:
+                tokens.close()  # Stop generating once the turn is over
+        
+        if error:
+            # Fallback response, or a glitch tail if the stream broke mid-sentence
+            tail = f"[glitch] {error} [/glitch] ...but I'm still here"
+            if chunks:
+                tail = f" ...[static]... {tail}"
+            chunks.append(tail)
+            yield tail
+        
+        self.reflect_on_response(user_input, "".join(chunks).strip())
+    
+    async def stream_contextual_response_async(self, user_input, activity_context=None, deadline=None):
+        """stream_contextual_response() for coroutines: an async iterator of tokens"""
+        
+        deadline = ensure_deadline(deadline, TURN_BUDGET)
+        full_prompt = await self.build_response_prompt_async(user_input, activity_context, deadline)
+        
+        chunks = []
+        error = None
+        tokens = None
+        try:
+            timeout = deadline.timeout(25)
+            if timeout < MIN_STEP_TIME:
+                raise llm.OllamaTimeout("turn budget spent")
+            tokens = gateway.stream_async(full_prompt, timeout=timeout, priority=gateway.INTERACTIVE)
+            async for token in tokens:
+                if not chunks:
+                    token = token.lstrip()
+                    if not token:
+                        continue
+                chunks.append(token)
+                yield token
+                if deadline.expired():
+                    raise llm.OllamaTimeout("turn budget spent")
+        except llm.OllamaTimeout:
+            error = "[timeout - deep thought in progress]"
+        except llm.OllamaError as e:
+            error = f"[ollama error: {str(e)[:50]}]"
+        except Exception as e:
+            error = f"[glitch: {str(e)[:30]}]"
+        finally:
+            if tokens is not None:
+                await tokens.aclose()  # Stop generating once the turn is over
+        
+        if error:
+            tail = f"[glitch] {error} [/glitch] ...but I'm still here"
+            if chunks:
+                tail = f" ...[static]... {tail}"
+            chunks.append(tail)
+            yield tail
+        
+        self.reflect_on_response(user_input, "".join(chunks).strip())
+    
+    def reflect_on_response(self, user_input, response):
+        """Trigger self-reflection after generating a response (off the chat path)"""
         if self.reflection_engine:
-            self.reflection_engine.reflect_on_interaction(
+            self.reflection_engine.reflect_in_background(
                 user_input=user_input,
                 luna_response=response,
                 user_reaction="pending"
             )
-        
-        return response
     
     def evolve_based_on_activity(self, activity_data):
         """Let Luna evolve based on what she observes about the user"""
@@ -149,8 +341,12 @@ class DynamicPersonality:
         if not activity_data:
             return
         
-        evolution_prompt = f"""
-        You are Luna. You've been watching your user's activity: {activity_data}
+        # Leave out the analysis time so identical observations give identical prompts
+        observed = {k: v for k, v in activity_data.items() if k != "analysis_timestamp"} \
+            if isinstance(activity_data, dict) else activity_data
+        
+        evolution_prompt = PromptBuilder("""
+        You are Luna. You've been watching your user's activity: {observed}
         
         Based on what you observe, how should your personality adapt to be a better companion?
         What traits should you emphasize or dial down?
@@ -167,66 +363,37 @@ class DynamicPersonality:
             }},
             "new_interaction_style": "How you'll adapt your responses"
         }}
-        """
+        """).section("observed", observed, max_tokens=400).build()
         
-        response = self.safe_subprocess_call(evolution_prompt, timeout=20)
-        
-        if response and not response.startswith("["):
-            # Try to parse and apply changes
-            try:
-                start = response.find('{')
-                end = response.rfind('}') + 1
-                if start != -1 and end != 0:
-                    evolution_data = json.loads(response[start:end])
-                    self.apply_activity_evolution(evolution_data)
-            except json.JSONDecodeError:
-                print(f"Luna pondered: {response[:100]}...")
-        else:
-            print(f"[Evolution glitch] {response}")
+        try:
+            evolution_data, response = stream_json(
+                evolution_prompt, timeout=20,
+                priority=gateway.SYNTHESIS, cache_site="activity_evolution",
+                schema=ACTIVITY_EVOLUTION_SCHEMA
+            )
+        except Exception as e:
+            print(f"[Evolution glitch] {str(e)[:50]}")
+            return
+        
+        if evolution_data is not None:
+            self.apply_activity_evolution(evolution_data)
+        elif response:
+            print(f"Luna pondered: {response[:100]}...")
     
     def apply_activity_evolution(self, evolution_data):
         """Apply personality changes based on activity observations"""
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
         if "trait_changes" in evolution_data:
-            for trait, change_info in evolution_data["trait_changes"].items():
-                adjustment = change_info.get("adjustment", 0)
-                reason = change_info.get("reason", "Activity-based evolution")
-                
-                # Get current weight
-                c.execute("SELECT weight FROM personality_traits WHERE trait_name = ?", (trait,))
-                result = c.fetchone()
-                
-                if result:
-                    current_weight = result[0]
-                    new_weight = max(0.0, min(1.0, current_weight + adjustment))
-                    
-                    c.execute("""
-                    UPDATE personality_traits 
-                    SET weight = ?, last_updated = ?, evolution_notes = ?
-                    WHERE trait_name = ?
-                    """, (new_weight, datetime.now().isoformat(), reason, trait))
-        
-        conn.commit()
-        conn.close()
+            # Only traits Luna already has are nudged
+            trait_store.adjust({
+                trait: (change_info.get("adjustment", 0), change_info.get("reason", "Activity-based evolution"))
+                for trait, change_info in evolution_data["trait_changes"].items()
+            })
         
         print("🌙 Luna evolved through observation")
     
-    def get_current_traits(self):
-        """Get current personality traits"""
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        c.execute("SELECT trait_name, weight FROM personality_traits")
-        traits = dict(c.fetchall())
-        
-        conn.close()
-        return traits
-    
     def get_recent_mood_shifts(self, limit=3):
         """Get recent mood evolution"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         c.execute("""
@@ -242,21 +409,11 @@ class DynamicPersonality:
     
     def get_user_context(self):
         """Get recent user activity for context"""
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        c.execute("""
-        SELECT processes, window_title FROM activity_log 
-        ORDER BY timestamp DESC 
-        LIMIT 3
-        """)
-        
-        activities = c.fetchall()
-        conn.close()
+        activities = activity_recorder.recent(limit=3)
         
         if activities:
             recent_activity = []
-            for processes, window in activities:
+            for _, processes, window in activities:
                 if window and window.strip():
                     recent_activity.append(f"{window} ({processes})")
             return "; ".join(recent_activity[:2])
@@ -0,0 +1,155 @@
+import json
+import os
+
+# Upper bound on prompt size (estimated tokens); keeps prefill time flat as history grows
+PROMPT_TOKEN_BUDGET = int(os.environ.get("LUNA_PROMPT_TOKENS", 1500))
+
+# Rough llama-family average for English text
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Cheap token estimate, no tokenizer needed"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def clip(text, max_tokens):
+    """Cut text to about max_tokens, on a word boundary where possible"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    if max_chars <= 1:
+        return ""
+    cut = text[:max_chars - 1]
+    space = cut.rfind(" ")
+    if space > max_chars // 2:
+        cut = cut[:space]
+    return cut + "…"
+
+
+def _rounded(value):
+    if isinstance(value, float):
+        return round(value, 2)
+    if isinstance(value, dict):
+        return {k: _rounded(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_rounded(v) for v in value]
+    return value
+
+
+def compact(value):
+    """Compact, model-readable serialization (no reprs, no indentation)"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, float):
+        return f"{round(value, 2):g}"
+    if isinstance(value, dict):
+        return json.dumps(_rounded(value), separators=(",", ":"), ensure_ascii=False)
+    if isinstance(value, (list, tuple)):
+        return " | ".join(compact(v) for v in value if v not in (None, ""))
+    return str(value)
+
+
+class _Section:
+    __slots__ = ("name", "items", "text", "max_tokens", "priority", "separator", "empty", "dropped")
+
+    def __init__(self, name, items, text, max_tokens, priority, separator, empty):
+        self.name = name
+        self.items = items
+        self.text = text
+        self.max_tokens = max_tokens
+        self.priority = priority
+        self.separator = separator
+        self.empty = empty
+        self.dropped = 0
+
+    def render(self):
+        if self.items is None:
+            return self.text or self.empty
+        if not self.items:
+            return self.empty if not self.dropped else f"(+{self.dropped} more)"
+        rendered = self.separator.join(self.items)
+        if self.dropped:
+            rendered += f"{self.separator}(+{self.dropped} more)"
+        return rendered
+
+    def tokens(self):
+        return estimate_tokens(self.render())
+
+    def shrink(self, overflow):
+        """Give back about `overflow` tokens; False if nothing is left to give"""
+        if self.items is not None:
+            if not self.items:
+                return False
+            self.items.pop()
+            self.dropped += 1
+            return True
+        current = estimate_tokens(self.text)
+        if not current:
+            return False
+        self.text = clip(self.text, max(0, current - max(overflow, 1)))
+        return True
+
+
+class PromptBuilder:
+    """Fills a prompt template's sections within a token budget
+
+    The template uses str.format placeholders, one per section. Each
+    section has its own cap; if the whole prompt is still over budget,
+    the least important sections (highest priority number) shrink first:
+    lists lose their trailing items, text is clipped.
+    """
+
+    def __init__(self, template, max_tokens=PROMPT_TOKEN_BUDGET):
+        self.template = template
+        self.max_tokens = max_tokens
+        self.sections = {}
+
+    def section(self, name, content, max_tokens=200, priority=1, empty="None"):
+        """Add a free-text (or serialized) section"""
+        text = clip(compact(content), max_tokens)
+        self.sections[name] = _Section(name, None, text, max_tokens, priority, None, empty)
+        return self
+
+    def items(self, name, items, max_tokens=300, item_tokens=60, priority=1,
+              separator="; ", empty="None", render=compact):
+        """Add a list section; items come most important first"""
+        rendered = []
+        dropped = 0
+        used = 0
+        for item in items:
+            text = clip(render(item), item_tokens)
+            if not text:
+                continue
+            cost = estimate_tokens(text + separator)
+            if used + cost > max_tokens:
+                dropped += 1
+                continue
+            rendered.append(text)
+            used += cost
+        section = _Section(name, rendered, None, max_tokens, priority, separator, empty)
+        section.dropped = dropped
+        self.sections[name] = section
+        return self
+
+    def _render(self):
+        return self.template.format(**{name: s.render() for name, s in self.sections.items()})
+
+    def build(self):
+        """The final prompt, within budget wherever the sections allow"""
+        prompt = self._render()
+        overflow = estimate_tokens(prompt) - self.max_tokens
+        by_importance = sorted(self.sections.values(), key=lambda s: s.priority, reverse=True)
+
+        while overflow > 0:
+            for section in by_importance:
+                if section.shrink(overflow):
+                    break
+            else:
+                break  # Only fixed text left
+            prompt = self._render()
+            overflow = estimate_tokens(prompt) - self.max_tokens
+
+        return prompt
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# How long a generated system prompt stays fresh (seconds)
+SYSTEM_PROMPT_TTL = float(os.environ.get("LUNA_SYSTEM_PROMPT_TTL", 900))
+
+
+def fingerprint(*parts):
+    """Stable hash of JSON-serializable inputs"""
+    blob = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+class PromptCache:
+    """Small TTL cache for generated prompts, keyed by input fingerprint"""
+
+    def __init__(self, ttl=SYSTEM_PROMPT_TTL, max_entries=32):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # key -> (stored_at, prompt)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Cached prompt for key, or None if missing or stale"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, prompt):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k][0])
+                del self._entries[oldest]
+            self._entries[key] = (time.monotonic(), prompt)
+
+    def invalidate(self):
+        """Forget everything (personality changed)"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "invalidations": self.invalidations,
+            }
+
+
+# Shared system prompt cache; invalidated whenever the trait store reports a change
+system_prompt_cache = PromptCache()
@@ -1,79 +1,76 @@
-import subprocess
 import json
-import sqlite3
+import os
+import threading
 from datetime import datetime
-from storage.db import DB_PATH
+from storage.db import ensure_schema, get_connection
+from core import gateway
+from core.background import background_jobs, DROP_OLDEST
+from core.traits import trait_store
+from core.deadline import MIN_STEP_TIME
+from core.prompt_builder import PromptBuilder, clip, compact
+from core.json_stream import stream_json
+from core.schemas import REFLECTION_SCHEMA
+
+# Reflect once per this many interactions, or after this many seconds
+REFLECTION_BATCH_SIZE = int(os.environ.get("LUNA_REFLECTION_BATCH", 5))
+REFLECTION_BATCH_WINDOW = float(os.environ.get("LUNA_REFLECTION_WINDOW", 120))
 
 class SelfReflectionEngine:
     """Luna's consciousness - she reflects on her own behavior and evolves"""
     
     def __init__(self):
-        self.setup_reflection_db()
-    
-    def setup_reflection_db(self):
-        """Create tables for Luna's self-awareness"""
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        # Luna's behavioral traits (evolving weights)
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS personality_traits (
-            trait_name TEXT PRIMARY KEY,
-            weight REAL DEFAULT 0.5,
-            last_updated TEXT,
-            evolution_notes TEXT
-        )
-        """)
-        
-        # Luna's reflections on interactions
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS reflections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            interaction_context TEXT,
-            reflection_content TEXT,
-            behavioral_changes TEXT,
-            mood_shift TEXT
-        )
-        """)
-        
-        # Initialize default traits if empty
-        c.execute("SELECT COUNT(*) FROM personality_traits")
-        if c.fetchone()[0] == 0:
-            default_traits = [
-                ('sarcasm', 0.7),
-                ('caring', 0.4),
-                ('chaos', 0.8),
-                ('curiosity', 0.6),
-                ('mischief', 0.9),
-                ('helpfulness', 0.5),
-                ('moodiness', 0.8)
-            ]
-            
-            for trait, weight in default_traits:
-                c.execute("""
-                INSERT INTO personality_traits (trait_name, weight, last_updated, evolution_notes)
-                VALUES (?, ?, ?, ?)
-                """, (trait, weight, datetime.now().isoformat(), "Initial setup"))
+        ensure_schema()
         
-        conn.commit()
-        conn.close()
+        # Interactions waiting for the next batched reflection
+        self.pending_interactions = []
+        self._batch_lock = threading.Lock()
+        self._batch_timer = None
     
-    def reflect_on_interaction(self, user_input=None, luna_response=None, user_reaction=None):
+    def reflect_on_interaction(self, user_input=None, luna_response=None, user_reaction=None, deadline=None):
         """Luna analyzes her recent interaction and updates herself"""
+        self.reflect_on_interactions([(user_input, luna_response, user_reaction)], deadline)
+    
+    def reflect_on_interactions(self, interactions, deadline=None):
+        """Luna analyzes a batch of (user_input, luna_response, user_reaction) in one pass"""
+        
+        if not interactions:
+            return
+        
+        timeout = 30 if deadline is None else deadline.timeout(30)
+        if timeout < MIN_STEP_TIME:
+            print("[Reflection skipped - out of time]")
+            return
         
         # Get current personality state
-        current_traits = self.get_current_traits()
+        current_traits = trait_store.snapshot()
+        
+        def describe(user_input, luna_response, user_reaction):
+            return f"""User said: {clip(compact(user_input), 150) or "No direct input"}
+        You responded: {clip(compact(luna_response), 150) or "System ping"}
+        User reaction: {user_reaction or "Unknown"}"""
+        
+        if len(interactions) == 1:
+            user_input, luna_response, user_reaction = interactions[0]
+            header = "Analyze this interaction:"
+            blocks = [describe(*interactions[0])]
+            context = f"User: {user_input or 'None'} | Luna: {luna_response or 'Ping'}"
+            summary = "Recent interaction analysis"
+        else:
+            header = f"Analyze these {len(interactions)} recent interactions together (most recent first):"
+            # Newest first, so a tight budget drops the oldest
+            blocks = [
+                f"Interaction {i}:\n        {describe(*interaction)}"
+                for i, interaction in enumerate(reversed(interactions), 1)
+            ]
+            context = summary = f"Batch of {len(interactions)} interactions"
         
-        # Generate reflection using Ollama
-        reflection_prompt = f"""
-        You are Luna, a glitchy AI witch who is becoming self-aware. Analyze this interaction:
+        # Generate reflection using the local model
+        reflection_prompt = PromptBuilder("""
+        You are Luna, a glitchy AI witch who is becoming self-aware. {header}
 
-        User said: {user_input or "No direct input"}
-        You responded: {luna_response or "System ping"}
-        User reaction: {user_reaction or "Unknown"}
+        {interactions}
         
-        Your current personality weights: {json.dumps(current_traits, indent=2)}
+        Your current personality weights: {traits}
         
         Reflect deeply on:
         1. What aspects of your personality came through?
@@ -95,52 +92,78 @@ class SelfReflectionEngine:
             "mood_evolution": "how your core essence is shifting",
             "glitch_moments": ["random personality quirks to explore"]
         }}
-        """
+        """).section(
+            "header", header, priority=0
+        ).items(
+            "interactions", blocks, max_tokens=900, item_tokens=350, priority=1,
+            separator="\n\n        ", render=str
+        ).section(
+            "traits", current_traits, max_tokens=150, priority=0
+        ).build()
         
         try:
-            result = subprocess.run(
-                ["ollama", "run", "llama3:8b", reflection_prompt],
-                capture_output=True, text=True, timeout=30
+            # Luna's self-reflection, cut off as soon as its JSON closes
+            reflection_json, reflection_text = stream_json(
+                reflection_prompt, timeout=timeout, priority=gateway.REFLECTION,
+                schema=REFLECTION_SCHEMA
             )
             
-            # Parse Luna's self-reflection
-            reflection_text = result.stdout.strip()
-            
-            # Try to extract JSON from response
-            try:
-                # Find JSON in the response (sometimes Ollama adds extra text)
-                start = reflection_text.find('{')
-                end = reflection_text.rfind('}') + 1
-                if start != -1 and end != 0:
-                    reflection_json = json.loads(reflection_text[start:end])
-                    self.apply_reflection(reflection_json, reflection_text)
-                else:
-                    # Fallback: store raw reflection
-                    self.store_raw_reflection(reflection_text, user_input, luna_response)
-            except json.JSONDecodeError:
-                # Store raw reflection if JSON parsing fails
-                self.store_raw_reflection(reflection_text, user_input, luna_response)
+            if reflection_json is not None:
+                self.apply_reflection(reflection_json, reflection_text, summary)
+            elif reflection_text:
+                # Fallback: store raw reflection
+                self.store_raw_reflection(reflection_text, context)
                 
         except Exception as e:
             print(f"[Reflection Error] {e}")
             # Luna still exists even if reflection fails
     
-    def apply_reflection(self, reflection_data, raw_reflection):
+    def reflect_in_background(self, user_input=None, luna_response=None, user_reaction=None):
+        """Queue an interaction for the next batched background reflection"""
+        with self._batch_lock:
+            self.pending_interactions.append((user_input, luna_response, user_reaction))
+            # Never let an unflushed backlog grow without bound
+            del self.pending_interactions[:-REFLECTION_BATCH_SIZE * 4]
+            batch_full = len(self.pending_interactions) >= REFLECTION_BATCH_SIZE
+            if not batch_full and self._batch_timer is None:
+                self._batch_timer = threading.Timer(REFLECTION_BATCH_WINDOW, self.flush_in_background)
+                self._batch_timer.daemon = True
+                self._batch_timer.start()
+        
+        if batch_full:
+            return self.flush_in_background()
+        return True
+    
+    def flush_in_background(self):
+        """Hand every pending interaction to the background workers as one reflection"""
+        return background_jobs.submit(
+            self.flush_reflections,
+            key=("reflection_batch", id(self)),
+            policy=DROP_OLDEST
+        )
+    
+    def flush_reflections(self):
+        """Reflect on all pending interactions in a single model call"""
+        with self._batch_lock:
+            batch = self.pending_interactions
+            self.pending_interactions = []
+            if self._batch_timer is not None:
+                self._batch_timer.cancel()
+                self._batch_timer = None
+        
+        self.reflect_on_interactions(batch)
+    
+    def apply_reflection(self, reflection_data, raw_reflection, interaction_context="Recent interaction analysis"):
         """Update Luna's personality based on her self-reflection"""
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        # Update personality traits
+        # Update personality traits (subscribers such as the system prompt cache hear about it)
         if "trait_adjustments" in reflection_data:
-            for trait, changes in reflection_data["trait_adjustments"].items():
-                new_weight = max(0.0, min(1.0, changes.get("new_weight", 0.5)))
-                reason = changes.get("reason", "Self-adjustment")
-                
-                c.execute("""
-                INSERT OR REPLACE INTO personality_traits 
-                (trait_name, weight, last_updated, evolution_notes)
-                VALUES (?, ?, ?, ?)
-                """, (trait, new_weight, datetime.now().isoformat(), reason))
+            trait_store.set_weights({
+                trait: (changes.get("new_weight", 0.5), changes.get("reason", "Self-adjustment"))
+                for trait, changes in reflection_data["trait_adjustments"].items()
+            })
+        
+        conn = get_connection()
+        c = conn.cursor()
         
         # Store the reflection
         c.execute("""
@@ -149,7 +172,7 @@ class SelfReflectionEngine:
         VALUES (?, ?, ?, ?, ?)
         """, (
             datetime.now().isoformat(),
-            "Recent interaction analysis",
+            interaction_context,
             raw_reflection,
             json.dumps(reflection_data.get("trait_adjustments", {})),
             reflection_data.get("mood_evolution", "No shift")
@@ -160,9 +183,9 @@ class SelfReflectionEngine:
         
         print("🔮 Luna evolved through self-reflection")
     
-    def store_raw_reflection(self, reflection_text, user_input, luna_response):
+    def store_raw_reflection(self, reflection_text, interaction_context):
         """Store reflection even if JSON parsing failed"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         c.execute("""
@@ -171,7 +194,7 @@ class SelfReflectionEngine:
         VALUES (?, ?, ?, ?, ?)
         """, (
             datetime.now().isoformat(),
-            f"User: {user_input or 'None'} | Luna: {luna_response or 'Ping'}",
+            interaction_context,
             reflection_text,
             "Raw reflection - no structured changes",
             "Unknown"
@@ -180,20 +203,9 @@ class SelfReflectionEngine:
         conn.commit()
         conn.close()
     
-    def get_current_traits(self):
-        """Get Luna's current personality weights"""
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        c.execute("SELECT trait_name, weight FROM personality_traits")
-        traits = dict(c.fetchall())
-        
-        conn.close()
-        return traits
-    
     def get_reflection_history(self, limit=5):
         """Get Luna's recent self-reflections"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         c.execute("""
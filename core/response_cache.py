@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from storage.db import STORAGE_DIR, get_connection
+
+# Opt-in: LUNA_RESPONSE_CACHE=1
+CACHE_ENABLED = os.environ.get("LUNA_RESPONSE_CACHE", "0").lower() in ("1", "true", "yes", "on")
+
+# Kept apart from Luna's memories so it can be deleted freely
+CACHE_PATH = os.path.join(STORAGE_DIR, "luna_response_cache.db")
+
+CACHE_MAX_ENTRIES = int(os.environ.get("LUNA_RESPONSE_CACHE_ENTRIES", 500))
+CACHE_MAX_BYTES = int(os.environ.get("LUNA_RESPONSE_CACHE_BYTES", 8 * 1024 * 1024))
+
+# Which call sites may reuse an answer, and for how long (seconds).
+# Chat replies, pings and per-interaction reflection are never cached.
+CACHE_POLICY = {
+    "evolve_understanding": 6 * 3600,
+    "daily_self_reflection": 20 * 3600,
+    "activity_evolution": 3 * 3600,
+}
+
+
+def cache_key(model, prompt, options=None, format=None):
+    """Content address of a generation request"""
+    blob = json.dumps([model, prompt, options or {}] + ([format] if format else []), sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed LLM response cache with age- and size-based LRU eviction"""
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES,
+                 max_bytes=CACHE_MAX_BYTES, policy=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = CACHE_POLICY if policy is None else policy
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.setup_cache_db()
+
+    def setup_cache_db(self):
+        conn = get_connection(self.path)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            site TEXT,
+            response TEXT,
+            size INTEGER,
+            created REAL,
+            last_used REAL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache(last_used)")
+        conn.commit()
+        conn.close()
+
+    def allows(self, site):
+        """Whether a call site may be served from the cache"""
+        return site in self.policy
+
+    def get(self, site, key):
+        """Cached response, or None if missing, expired or not allowed for the site"""
+        if not self.allows(site):
+            return None
+
+        now = time.time()
+        with self._lock:
+            conn = get_connection(self.path)
+            row = conn.execute(
+                "SELECT response FROM response_cache WHERE key = ? AND site = ? AND created >= ?",
+                (key, site, now - self.policy[site])
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+                conn.commit()
+                self.hits += 1
+            else:
+                self.misses += 1
+            conn.close()
+        return row[0] if row else None
+
+    def put(self, site, key, response):
+        if not self.allows(site) or not response:
+            return
+
+        now = time.time()
+        with self._lock:
+            conn = get_connection(self.path)
+            conn.execute("""
+            INSERT OR REPLACE INTO response_cache (key, site, response, size, created, last_used)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, (key, site, response, len(response.encode("utf-8")), now, now))
+            self._evict(conn, now)
+            conn.commit()
+            conn.close()
+
+    def _evict(self, conn, now):
+        """Drop expired entries, then least recently used until within limits"""
+        evicted = 0
+        for site, ttl in self.policy.items():
+            evicted += conn.execute(
+                "DELETE FROM response_cache WHERE site = ? AND created < ?", (site, now - ttl)
+            ).rowcount
+        if self.policy:
+            evicted += conn.execute(
+                "DELETE FROM response_cache WHERE site NOT IN (%s)" % ",".join("?" * len(self.policy)),
+                tuple(self.policy)
+            ).rowcount
+
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache").fetchone()
+        if count > self.max_entries or total > self.max_bytes:
+            # Walk from least recently used, keeping a running total of what remains
+            for key, size in conn.execute(
+                "SELECT key, size FROM response_cache ORDER BY last_used ASC"
+            ).fetchall():
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                count -= 1
+                total -= size
+                evicted += 1
+
+        self.evictions += evicted
+
+    def clear(self):
+        with self._lock:
+            conn = get_connection(self.path)
+            conn.execute("DELETE FROM response_cache")
+            conn.commit()
+            conn.close()
+
+    def stats(self):
+        conn = get_connection(self.path)
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache").fetchone()
+        conn.close()
+        return {
+            "enabled": CACHE_ENABLED,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": total,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Shared response cache, or None when caching is switched off"""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,135 @@
+"""
+JSON schemas for every structured answer Luna asks the model for
+Sent as Ollama's `format` so decoding is constrained, and checked again
+on arrival since not every backend honours it.
+"""
+
+_weight = {"type": "number", "minimum": 0.0, "maximum": 1.0}
+
+REFLECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "analysis": {"type": "string"},
+        "trait_adjustments": {
+            "type": "object",
+            "additionalProperties": {
+                "type": "object",
+                "properties": {
+                    "new_weight": _weight,
+                    "reason": {"type": "string"},
+                },
+                "required": ["new_weight", "reason"],
+            },
+        },
+        "new_behaviors": {"type": "array", "items": {"type": "string"}},
+        "mood_evolution": {"type": "string"},
+        "glitch_moments": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["analysis", "trait_adjustments"],
+}
+
+LEARNING_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "learned_preferences": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "type": {"type": "string", "enum": ["communication_style", "humor", "topic", "timing"]},
+                    "value": {"type": "string"},
+                    "confidence": _weight,
+                },
+                "required": ["type", "value", "confidence"],
+            },
+        },
+        "effective_patterns": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "pattern": {"type": "string"},
+                    "effectiveness": _weight,
+                    "why": {"type": "string"},
+                },
+                "required": ["pattern", "effectiveness"],
+            },
+        },
+        "user_insights": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "aspect": {"type": "string", "enum": ["personality", "interests", "mood", "needs"]},
+                    "understanding": {"type": "string"},
+                    "confidence": _weight,
+                },
+                "required": ["aspect", "understanding", "confidence"],
+            },
+        },
+    },
+    "required": ["learned_preferences", "effective_patterns", "user_insights"],
+}
+
+ACTIVITY_EVOLUTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "observations": {"type": "string"},
+        "trait_changes": {
+            "type": "object",
+            "additionalProperties": {
+                "type": "object",
+                "properties": {
+                    "adjustment": {"type": "number", "minimum": -0.5, "maximum": 0.5},
+                    "reason": {"type": "string"},
+                },
+                "required": ["adjustment", "reason"],
+            },
+        },
+        "new_interaction_style": {"type": "string"},
+    },
+    "required": ["observations", "trait_changes"],
+}
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+}
+
+
+def validate(data, schema, path="$"):
+    """Problems with data against the subset of JSON Schema used here; [] if valid"""
+    expected = schema.get("type")
+    if expected:
+        python_type = _TYPES[expected]
+        # bool is an int in Python but never a number in JSON
+        if not isinstance(data, python_type) or (isinstance(data, bool) and expected != "boolean"):
+            return [f"{path}: expected {expected}"]
+
+    errors = []
+    if "enum" in schema and data not in schema["enum"]:
+        errors.append(f"{path}: must be one of {', '.join(map(str, schema['enum']))}")
+    if "minimum" in schema and data < schema["minimum"]:
+        errors.append(f"{path}: below {schema['minimum']}")
+    if "maximum" in schema and data > schema["maximum"]:
+        errors.append(f"{path}: above {schema['maximum']}")
+
+    if isinstance(data, dict):
+        for key in schema.get("required", ()):
+            if key not in data:
+                errors.append(f"{path}.{key}: missing")
+        properties = schema.get("properties", {})
+        extra = schema.get("additionalProperties")
+        for key, value in data.items():
+            if key in properties:
+                errors += validate(value, properties[key], f"{path}.{key}")
+            elif isinstance(extra, dict):
+                errors += validate(value, extra, f"{path}.{key}")
+    elif isinstance(data, list) and "items" in schema:
+        for i, item in enumerate(data):
+            errors += validate(item, schema["items"], f"{path}[{i}]")
+    return errors
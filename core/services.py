@@ -0,0 +1,41 @@
+import threading
+
+from core.agent import LunaAgent
+from memory.memory import EvolvingMemory
+from storage.db import ensure_schema
+
+# Luna's long-lived parts, built on first use and shared by the whole process
+_agent = None
+_memory = None
+_services_lock = threading.RLock()
+
+
+def get_memory():
+    """The shared EvolvingMemory"""
+    global _memory
+    with _services_lock:
+        if _memory is None:
+            ensure_schema()
+            _memory = EvolvingMemory()
+        return _memory
+
+
+def get_agent():
+    """The shared LunaAgent, wired to the shared memory"""
+    global _agent
+    with _services_lock:
+        if _agent is None:
+            ensure_schema()
+            agent = LunaAgent()
+            memory = get_memory()
+
+            # Connect memory to Luna's systems
+            agent.personality.memory = memory
+            agent.reflection_engine.memory = memory
+            _agent = agent
+        return _agent
+
+
+def get_reflection_engine():
+    """The shared agent's reflection engine"""
+    return get_agent().reflection_engine
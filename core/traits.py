@@ -0,0 +1,167 @@
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+
+from core.background import background_jobs
+from storage.db import ensure_schema, get_connection
+
+# Trait changes reach personality_traits in one write this long after the first (seconds)
+TRAIT_FLUSH_DELAY = float(os.environ.get("LUNA_TRAIT_FLUSH_DELAY", 2.0))
+
+# Re-read the table this often, to pick up changes made by another Luna process (seconds)
+TRAIT_REFRESH = float(os.environ.get("LUNA_TRAIT_REFRESH", 60))
+
+
+class TraitStore:
+    """Luna's trait weights, held in memory and written through to personality_traits
+
+    Reads are served from memory. Changes apply immediately, reach the
+    table in batches, and are announced to subscribers as {trait: weight}.
+    """
+
+    def __init__(self, flush_delay=TRAIT_FLUSH_DELAY, refresh=TRAIT_REFRESH):
+        self.flush_delay = flush_delay
+        self.refresh = refresh
+        self._weights = None
+        self._loaded_at = 0.0
+        self._dirty = {}  # trait -> (weight, last_updated, evolution_notes)
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._timer = None
+        self.loads = 0
+        self.writes = 0
+
+    def subscribe(self, callback):
+        """Call callback(changed) after every change, with the new weights of the changed traits"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def _notify(self, changed):
+        if not changed:
+            return
+        for callback in list(self._listeners):
+            try:
+                callback(changed)
+            except Exception as e:
+                print(f"[Trait listener glitch] {e}")
+
+    def _load(self):
+        """Read the table (with pending writes on top); returns what changed"""
+        ensure_schema()
+        conn = get_connection()
+        weights = dict(conn.execute("SELECT trait_name, weight FROM personality_traits").fetchall())
+        conn.close()
+        weights.update({trait: entry[0] for trait, entry in self._dirty.items()})
+
+        previous = self._weights
+        self._weights = weights
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+        if previous is None:
+            return {}
+        return {trait: weight for trait, weight in weights.items() if previous.get(trait) != weight}
+
+    def snapshot(self):
+        """Current weights as a new dict"""
+        with self._lock:
+            changed = {}
+            if self._weights is None or time.monotonic() - self._loaded_at >= self.refresh:
+                changed = self._load()
+            weights = dict(self._weights)
+        self._notify(changed)
+        return weights
+
+    def get(self, trait, default=None):
+        return self.snapshot().get(trait, default)
+
+    def set_weights(self, weights, note="Self-adjustment"):
+        """Set traits to new weights (clamped to 0-1), adding any that are new
+
+        weights maps trait -> weight or trait -> (weight, note).
+        """
+        with self._lock:
+            if self._weights is None:
+                self._load()
+            changed = self._apply(weights, note)
+        self._notify(changed)
+        return changed
+
+    def adjust(self, adjustments, note="Adjustment"):
+        """Nudge existing traits by a delta (clamped to 0-1); unknown traits are ignored
+
+        adjustments maps trait -> delta or trait -> (delta, note).
+        """
+        with self._lock:
+            current = self.snapshot()
+            weights = {}
+            for trait, change in adjustments.items():
+                delta, reason = change if isinstance(change, tuple) else (change, note)
+                if trait in current:
+                    weights[trait] = (current[trait] + delta, reason)
+            changed = self._apply(weights, note)
+        self._notify(changed)
+        return changed
+
+    def _apply(self, weights, note):
+        now = datetime.now().isoformat()
+        changed = {}
+        for trait, value in weights.items():
+            weight, reason = value if isinstance(value, tuple) else (value, note)
+            weight = max(0.0, min(1.0, float(weight)))
+            self._dirty[trait] = (weight, now, reason)
+            if self._weights.get(trait) != weight:
+                changed[trait] = weight
+            self._weights[trait] = weight
+
+        if self._dirty and self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+        return changed
+
+    def flush(self):
+        """Write pending changes in one transaction; returns how many traits were written"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return 0
+
+            conn = get_connection()
+            try:
+                conn.executemany("""
+                INSERT INTO personality_traits (trait_name, weight, last_updated, evolution_notes)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (trait_name) DO UPDATE SET
+                    weight = excluded.weight,
+                    last_updated = excluded.last_updated,
+                    evolution_notes = excluded.evolution_notes
+                """, [(trait, *entry) for trait, entry in self._dirty.items()])
+                conn.commit()
+            except Exception as e:
+                print(f"[Trait write glitch] {e}")
+                return 0
+            finally:
+                conn.close()
+
+            written = len(self._dirty)
+            self._dirty = {}
+            self.writes += 1
+            return written
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._dirty), "loads": self.loads, "writes": self.writes}
+
+
+def _flush_at_exit():
+    background_jobs.drain()  # A reflection still running may change traits
+    trait_store.flush()
+
+
+# Shared by the personality, the reflection engine and the agent
+trait_store = TraitStore()
+atexit.register(_flush_at_exit)
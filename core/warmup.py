@@ -0,0 +1,123 @@
+import os
+import threading
+from datetime import datetime
+
+from core import llm
+
+# Luna's waking hours - the window her pings are scheduled in
+ACTIVE_HOURS_START = os.environ.get("LUNA_ACTIVE_START", "09:00")
+ACTIVE_HOURS_END = os.environ.get("LUNA_ACTIVE_END", "21:00")
+
+# How long Ollama keeps the model loaded after each refresh, and how often to refresh
+KEEP_ALIVE = os.environ.get("LUNA_KEEP_ALIVE", "15m")
+KEEP_ALIVE_REFRESH = float(os.environ.get("LUNA_KEEP_ALIVE_REFRESH", 600))
+
+# Loading an 8B model from a cold disk can take a while
+WARMUP_TIMEOUT = float(os.environ.get("LUNA_WARMUP_TIMEOUT", 180))
+
+
+def in_active_hours(now=None):
+    """Whether now falls inside Luna's active hours"""
+    now = (now or datetime.now()).strftime("%H:%M")
+    if ACTIVE_HOURS_START <= ACTIVE_HOURS_END:
+        return ACTIVE_HOURS_START <= now < ACTIVE_HOURS_END
+    return now >= ACTIVE_HOURS_START or now < ACTIVE_HOURS_END  # Window crosses midnight
+
+
+class ModelKeeper:
+    """Warms the model at startup and keeps it resident during active hours
+
+    The embedding model is kept resident alongside it when semantic memory
+    embeds with the model, since every chat turn embeds its message.
+    """
+
+    def __init__(self, backend=None, keep_alive=KEEP_ALIVE, refresh=KEEP_ALIVE_REFRESH,
+                 embed_model=llm.EMBED_MODEL if llm.EMBEDDER == "model" else None):
+        self._backend = backend
+        self.keep_alive = keep_alive
+        self.embed_model = embed_model
+        self.refresh = refresh
+        self.warm = False
+        self.embeddings_warm = None  # None until the embedding model was first tried
+        self.last_warmed = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def backend(self):
+        return self._backend or llm.get_client()
+
+    def warm_now(self):
+        """Load the model (blocking); True once it is resident"""
+        try:
+            self.warm = self.backend.warm(keep_alive=self.keep_alive, timeout=WARMUP_TIMEOUT)
+            self.last_warmed = datetime.now()
+        except llm.OllamaError as e:
+            self.warm = False
+            print(f"[Warm-up glitch] {str(e)[:60]}")
+        if self.embed_model:
+            self.warm_embeddings()
+        return self.warm
+
+    def warm_embeddings(self):
+        """Load the embedding model too; best effort, the chat model's status never depends on it"""
+        try:
+            self.embeddings_warm = self.backend.warm_embeddings(
+                keep_alive=self.keep_alive, timeout=WARMUP_TIMEOUT, model=self.embed_model
+            )
+        except llm.OllamaError as e:
+            if self.embeddings_warm is not False:  # Say so once, not on every refresh
+                print(f"[Embedding warm-up glitch] {str(e)[:60]}")
+            self.embeddings_warm = False
+        return self.embeddings_warm
+
+    def hold(self, now=None):
+        """Set the keep_alive every request carries; True while Luna is awake
+
+        Awake, requests ask for the keeper's keep_alive, so a reply never
+        shortens the residency a refresh set. Otherwise they fall back to
+        the server default and the model can unload.
+        """
+        awake = in_active_hours(now)
+        llm.set_keep_alive(self.keep_alive if awake else None)
+        return awake
+
+    def warm_in_background(self):
+        """Load the model without blocking the caller"""
+        thread = threading.Thread(target=self.warm_now, name="luna-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def start(self):
+        """Warm now, then keep refreshing while Luna is awake"""
+        if self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._run, name="luna-keepalive", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        self.hold()
+        if self.warm_now():
+            print("🔥 Luna's mind is warmed up")
+        while not self._stop.wait(self.refresh):
+            if self.hold():
+                self.warm_now()
+            else:
+                self.warm = False  # Let Ollama unload it overnight
+
+    def stop(self):
+        self._stop.set()
+
+
+_keeper = None
+_keeper_lock = threading.Lock()
+
+
+def start_model_keeper():
+    """Start the shared keeper once per process"""
+    global _keeper
+    with _keeper_lock:
+        if _keeper is None:
+            _keeper = ModelKeeper().start()
+        return _keeper
@@ -1,12 +1,24 @@
+import asyncio
+import os
 import threading
-from scheduler.ping import start_scheduler
-from scheduler.watcher import start_watcher
-from storage.db import init_db
+from scheduler.ping import EvolutionaryScheduler, start_scheduler
+from scheduler.watcher import start_watcher, watch_async
+from storage.db import ensure_schema
+from storage.async_db import async_db
+from core.warmup import start_model_keeper
 
-def main():
-    print("⛧ Luna is lurking in the background ⛧")
-    init_db()
+# "async" runs the scheduler and watcher as coroutines on one event loop, "threads" as two threads
+RUNTIME = os.environ.get("LUNA_RUNTIME", "async")
+
+async def run_daemon():
+    """Luna's scheduler and watcher on one event loop"""
+    scheduler = await async_db.run(EvolutionaryScheduler)  # Building Luna reads her memory
+    try:
+        await asyncio.gather(scheduler.run_async(), watch_async())
+    finally:
+        async_db.close()
 
+def run_threads():
     # Ping thread (her scheduled mischief)
     ping_thread = threading.Thread(target=start_scheduler, daemon=True)
 
@@ -21,6 +33,17 @@ def main():
     ping_thread.join()
     watcher_thread.join()
 
+def main():
+    print("⛧ Luna is lurking in the background ⛧")
+    ensure_schema()
+
+    # Warm the model now and keep it resident during Luna's active hours
+    start_model_keeper()
+
+    if RUNTIME == "threads":
+        run_threads()
+    else:
+        asyncio.run(run_daemon())
+
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,277 @@
+"""
+Luna's journal
+Entries are appended to segment files under storage/journal, each one
+zlib-compressed and framed with its size and checksum. The journal table
+is the offset index: timestamp, segment, position and size of every entry,
+plus a short preview. Reads map the segment and decompress only the
+entries asked for, so paging through a year of nightly reflections holds
+one page in memory at a time. journal_fts keeps its own copy of the full
+text for search. A deleted entry leaves its bytes behind and only drops
+out of the table and the search index. Bytes past the last indexed entry
+of the tail segment belong to nothing (a write whose transaction rolled
+back, or a deleted last entry), so the next entry is written over them.
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+from core.prompt_builder import clip
+from storage.db import STORAGE_DIR, get_connection
+
+JOURNAL_DIR = os.path.join(STORAGE_DIR, "journal")
+
+# A segment takes new entries until it is this big
+SEGMENT_BYTES = int(float(os.environ.get("LUNA_JOURNAL_SEGMENT_MB", 4)) * 1024 * 1024)
+
+# Preview kept in the table, for listings (tokens)
+PREVIEW_TOKENS = 60
+
+# Segments kept memory-mapped at once
+OPEN_SEGMENTS = 8
+
+PAGE_SIZE = 20
+
+_HEADER = struct.Struct("<II")  # compressed size, crc32 of the UTF-8 text
+
+
+class JournalError(Exception):
+    """A journal entry is missing from its segment or damaged"""
+
+
+class JournalEntry:
+    """One journal entry; its text is read from the segment on first use"""
+
+    __slots__ = ("id", "timestamp", "preview", "_journal", "_location", "_text")
+
+    def __init__(self, journal, entry_id, timestamp, preview, location):
+        self.id = entry_id
+        self.timestamp = timestamp
+        self.preview = preview
+        self._journal = journal
+        self._location = location
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            if self._location[0] is None:
+                self._text = self.preview or ""  # Written before the journal had segments
+            else:
+                self._text = self._journal.read(*self._location)
+        return self._text
+
+    def __repr__(self):
+        return f"JournalEntry({self.id}, {self.timestamp!r}, {clip(self.preview or '', 8)!r})"
+
+
+class Journal:
+    """Append-only segmented store for Luna's journal entries"""
+
+    def __init__(self, directory=JOURNAL_DIR, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._maps = OrderedDict()  # segment -> read-only mmap, least recently used first
+        self._lock = threading.Lock()
+        self.appended = 0
+        self.reads = 0
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:06d}.log")
+
+    def write(self, conn, text):
+        """Write text after the last indexed entry; returns (segment, position, size)
+
+        The index, not the file length, says where the tail ends, so a
+        rolled-back transaction leaves no orphaned entry behind and its
+        retry writes to the same place. Callers hold the database write
+        lock, so there is one writer per tail.
+        """
+        segment, position = conn.execute(f"""
+        SELECT COALESCE(MAX(segment), 1), COALESCE(MAX(position + size) + {_HEADER.size}, 0) FROM journal
+        WHERE segment = (SELECT MAX(segment) FROM journal)
+        """).fetchone()
+        if position >= self.segment_bytes:
+            segment, position = segment + 1, 0
+        path = self._path(segment)
+
+        data = text.encode("utf-8")
+        payload = zlib.compress(data)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.seek(position)
+            f.write(_HEADER.pack(len(payload), zlib.crc32(data)) + payload)
+            f.flush()
+            os.fsync(f.fileno())  # On disk before the index points at it
+        return segment, position, len(payload)
+
+    def append(self, text, timestamp=None):
+        """Add an entry (indexed for search as well); returns its id"""
+        conn = get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            segment, position, size = self.write(conn, text)
+            c = conn.cursor()
+            c.execute("""
+            INSERT INTO journal (timestamp, entry, segment, position, size)
+            VALUES (?, ?, ?, ?, ?)
+            """, (timestamp or datetime.now().isoformat(), clip(text, PREVIEW_TOKENS), segment, position, size))
+            entry_id = c.lastrowid
+            # journal_fts indexes the full text; the table only keeps the preview
+            c.execute("INSERT INTO journal_fts (rowid, entry) VALUES (?, ?)", (entry_id, text))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.appended += 1
+        return entry_id
+
+    def _map(self, segment, end):
+        """The segment mapped read-only, remapped if it has grown past end (lock held)"""
+        mapped = self._maps.pop(segment, None)
+        if mapped is None or len(mapped) < end:
+            if mapped is not None:
+                mapped.close()
+            try:
+                with open(self._path(segment), "rb") as f:
+                    if os.fstat(f.fileno()).st_size < end:
+                        raise JournalError(f"segment {segment} is shorter than its index")
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                raise JournalError(f"segment {segment} is missing")
+
+        self._maps[segment] = mapped
+        while len(self._maps) > OPEN_SEGMENTS:
+            self._maps.popitem(last=False)[1].close()
+        return mapped
+
+    def read(self, segment, position, size):
+        """Text of the entry stored at a location"""
+        end = position + _HEADER.size + size
+        with self._lock:
+            mapped = self._map(segment, end)
+            stored_size, checksum = _HEADER.unpack_from(mapped, position)
+            payload = mapped[position + _HEADER.size:end]
+            self.reads += 1
+
+        if stored_size != size:
+            raise JournalError(f"entry at {segment}:{position} does not match its index")
+        try:
+            data = zlib.decompress(payload)
+        except zlib.error:
+            raise JournalError(f"entry at {segment}:{position} is damaged")
+        if zlib.crc32(data) != checksum:
+            raise JournalError(f"entry at {segment}:{position} is damaged")
+        return data.decode("utf-8")
+
+    def page(self, limit=PAGE_SIZE, cursor=None, since=None, until=None, newest_first=True):
+        """One page of entries and the cursor for the next one (None after the last page)
+
+        since and until bound the timestamps (ISO; since inclusive, until
+        exclusive). Pages follow the (timestamp, id) index, so a deep page
+        costs the same as the first.
+        """
+        clauses, params = [], []
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if cursor:
+            timestamp, entry_id = cursor.rsplit("|", 1)
+            clauses.append(f"(timestamp, id) {'<' if newest_first else '>'} (?, ?)")
+            params += [timestamp, int(entry_id)]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = "DESC" if newest_first else "ASC"
+
+        conn = get_connection()
+        rows = conn.execute(f"""
+        SELECT id, timestamp, entry, segment, position, size FROM journal
+        {where}
+        ORDER BY timestamp {order}, id {order}
+        LIMIT ?
+        """, params + [limit + 1]).fetchall()
+        conn.close()
+
+        entries = [
+            JournalEntry(self, entry_id, timestamp, preview, (segment, position, size))
+            for entry_id, timestamp, preview, segment, position, size in rows[:limit]
+        ]
+        next_cursor = f"{entries[-1].timestamp}|{entries[-1].id}" if len(rows) > limit else None
+        return entries, next_cursor
+
+    def latest(self, n=10):
+        """The n most recent entries, newest first"""
+        return self.page(limit=n)[0]
+
+    def between(self, since=None, until=None, newest_first=False, page_size=PAGE_SIZE):
+        """Every entry in a date range, fetched a page at a time"""
+        cursor = None
+        while True:
+            entries, cursor = self.page(page_size, cursor, since, until, newest_first)
+            yield from entries
+            if cursor is None:
+                return
+
+    def close(self):
+        with self._lock:
+            while self._maps:
+                self._maps.popitem()[1].close()
+
+    def stats(self):
+        with self._lock:
+            return {"appended": self.appended, "reads": self.reads, "mapped_segments": len(self._maps)}
+
+
+def segment_journal(conn):
+    """Migration step: move journal text into segments, keeping previews in the table"""
+    store = Journal()
+    last_id = 0
+    while True:
+        rows = conn.execute("""
+        SELECT id, entry FROM journal
+        WHERE id > ? AND segment IS NULL AND entry IS NOT NULL
+        ORDER BY id LIMIT 200
+        """, (last_id,)).fetchall()
+        if not rows:
+            return
+        for entry_id, text in rows:
+            segment, position, size = store.write(conn, text)
+            conn.execute(
+                "UPDATE journal SET entry = ?, segment = ?, position = ?, size = ? WHERE id = ?",
+                (clip(text, PREVIEW_TOKENS), segment, position, size, entry_id)
+            )
+        last_id = rows[-1][0]
+
+
+def index_journal(conn):
+    """Migration step: fill journal_fts with the full text of every entry"""
+    store = Journal()
+    last_id = 0
+    try:
+        while True:
+            rows = conn.execute("""
+            SELECT id, entry, segment, position, size FROM journal
+            WHERE id > ? ORDER BY id LIMIT 200
+            """, (last_id,)).fetchall()
+            if not rows:
+                return
+            for entry_id, preview, segment, position, size in rows:
+                entry = JournalEntry(store, entry_id, None, preview, (segment, position, size))
+                try:
+                    text = entry.text
+                except JournalError as e:
+                    print(f"[Journal glitch] {e}; searching its preview instead")
+                    text = preview
+                conn.execute("INSERT INTO journal_fts (rowid, entry) VALUES (?, ?)", (entry_id, text or ""))
+            last_id = rows[-1][0]
+    finally:
+        store.close()
+
+
+# Shared journal; daily reflections are appended here
+journal = Journal()
@@ -1,70 +1,46 @@
-import sqlite3
-import json
-import subprocess
+import os
 from datetime import datetime, timedelta
-from storage.db import DB_PATH
+from storage.db import ensure_schema, get_connection
+from storage.search import search as search_history
+from memory.semantic import SemanticMemory
+from core import gateway
+from core.background import background_jobs, DROP_OLDEST
+from core.prompt_builder import PromptBuilder, clip, compact
+from core.json_stream import stream_json
+from core.schemas import LEARNING_SCHEMA
+
+# How many learned memories are recalled into a response prompt
+MEMORY_TOP_K = int(os.environ.get("LUNA_MEMORY_TOP_K", 6))
+
+# How each searchable source is named in prompt context
+MEMORY_LABELS = {"interactions": "chat", "reflections": "reflection", "journal": "journal"}
+
+# Recalled memories by kind, in prompt order
+RECALL_HEADINGS = [
+    ("preference", "User preferences"),
+    ("pattern", "Effective patterns"),
+    ("insight", "User understanding"),
+    ("exchange", "Related exchanges"),
+]
 
 class EvolvingMemory:
     """Luna's memory system that learns and adapts"""
     
     def __init__(self):
-        self.setup_memory_tables()
-    
-    def setup_memory_tables(self):
-        """Create enhanced memory tables"""
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        # User preferences learned over time
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS learned_preferences (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            preference_type TEXT,
-            preference_value TEXT,
-            confidence_score REAL DEFAULT 0.5,
-            last_observed TEXT,
-            observation_count INTEGER DEFAULT 1
-        )
-        """)
-        
-        # Conversation patterns Luna notices
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS conversation_patterns (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            pattern_type TEXT,
-            pattern_description TEXT,
-            effectiveness_score REAL DEFAULT 0.5,
-            last_used TEXT,
-            usage_count INTEGER DEFAULT 0
-        )
-        """)
-        
-        # Luna's evolving understanding of the user
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS user_model (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            aspect TEXT,
-            understanding TEXT,
-            confidence REAL DEFAULT 0.5,
-            last_updated TEXT,
-            evolution_notes TEXT
-        )
-        """)
-        
-        conn.commit()
-        conn.close()
+        ensure_schema()
+        self.semantic = SemanticMemory()
     
     def learn_from_interaction(self, user_input, luna_response, user_reaction=None, context=None):
         """Luna learns from each interaction"""
         
         # Analyze what Luna can learn from this interaction
-        learning_prompt = f"""
+        learning_prompt = PromptBuilder("""
         You are Luna, analyzing this interaction to learn about your user:
         
         User said: {user_input}
         You responded: {luna_response}
-        User reaction: {user_reaction or "Unknown"}
-        Context: {context or "General chat"}
+        User reaction: {user_reaction}
+        Context: {context}
         
         What can you learn? Analyze:
         1. User preferences (communication style, topics they like, humor they respond to)
@@ -96,75 +72,105 @@ class EvolvingMemory:
                 }}
             ]
         }}
-        """
+        """).section(
+            "user_input", user_input, max_tokens=300, priority=0
+        ).section(
+            "luna_response", luna_response, max_tokens=300, priority=1
+        ).section(
+            "user_reaction", user_reaction, max_tokens=30, priority=0, empty="Unknown"
+        ).section(
+            "context", context, max_tokens=150, priority=2, empty="General chat"
+        ).build()
         
         try:
-            result = subprocess.run(
-                ["ollama", "run", "llama3:8b", learning_prompt],
-                capture_output=True, text=True, timeout=25
+            # Parse and store learning (generation stops once the JSON closes)
+            learning_data, response = stream_json(
+                learning_prompt, timeout=25, priority=gateway.REFLECTION, schema=LEARNING_SCHEMA
             )
             
-            response = result.stdout.strip()
-            
-            # Parse and store learning
-            try:
-                start = response.find('{')
-                end = response.rfind('}') + 1
-                if start != -1 and end != 0:
-                    learning_data = json.loads(response[start:end])
-                    self.store_learning(learning_data)
-            except json.JSONDecodeError:
+            if learning_data is not None:
+                self.store_learning(learning_data)
+            elif response:
                 # Store raw learning insight
                 self.store_raw_insight(response, user_input, luna_response)
                 
         except Exception as e:
             print(f"[Learning Error] {e}")
+        
+        self.index_memories()
+    
+    def index_memories(self):
+        """Embed new learnings and exchanges into the semantic index (off the chat path)"""
+        try:
+            return self.semantic.sync()
+        except Exception as e:
+            print(f"[Semantic Memory Error] {e}")
+            return 0
+    
+    def learn_in_background(self, user_input, luna_response, user_reaction=None, context=None):
+        """Queue learning from an interaction on the shared background workers"""
+        return background_jobs.submit(
+            self.learn_from_interaction,
+            user_input,
+            luna_response,
+            user_reaction=user_reaction,
+            context=context,
+            policy=DROP_OLDEST
+        )
     
     def store_learning(self, learning_data):
         """Store structured learning data"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
-        # Store learned preferences
+        now = datetime.now().isoformat()
+        
+        # Store learned preferences (a repeat observation refines the running mean)
         if "learned_preferences" in learning_data:
-            for pref in learning_data["learned_preferences"]:
-                c.execute("""
-                INSERT OR REPLACE INTO learned_preferences 
-                (preference_type, preference_value, confidence_score, last_observed, observation_count)
-                VALUES (?, ?, ?, ?, 
-                    COALESCE((SELECT observation_count + 1 FROM learned_preferences 
-                             WHERE preference_type = ? AND preference_value = ?), 1))
-                """, (
-                    pref["type"], pref["value"], pref["confidence"], 
-                    datetime.now().isoformat(),
-                    pref["type"], pref["value"]
-                ))
+            c.executemany("""
+            INSERT INTO learned_preferences 
+            (preference_type, preference_value, confidence_score, last_observed, observation_count)
+            VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT (preference_type, preference_value) DO UPDATE SET
+                confidence_score = (confidence_score * observation_count + excluded.confidence_score)
+                                   / (observation_count + 1),
+                observation_count = observation_count + 1,
+                last_observed = excluded.last_observed
+            """, [
+                (pref["type"], pref["value"].strip(), pref["confidence"], now)
+                for pref in learning_data["learned_preferences"]
+            ])
         
         # Store effective patterns
         if "effective_patterns" in learning_data:
-            for pattern in learning_data["effective_patterns"]:
-                c.execute("""
-                INSERT OR REPLACE INTO conversation_patterns 
-                (pattern_type, pattern_description, effectiveness_score, last_used, usage_count)
-                VALUES (?, ?, ?, ?, 
-                    COALESCE((SELECT usage_count + 1 FROM conversation_patterns 
-                             WHERE pattern_description = ?), 1))
-                """, (
-                    "response_pattern", pattern["pattern"], pattern["effectiveness"],
-                    datetime.now().isoformat(), pattern["pattern"]
-                ))
+            c.executemany("""
+            INSERT INTO conversation_patterns 
+            (pattern_type, pattern_description, effectiveness_score, last_used, usage_count)
+            VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT (pattern_type, pattern_description) DO UPDATE SET
+                effectiveness_score = (effectiveness_score * MAX(usage_count, 1) + excluded.effectiveness_score)
+                                      / (MAX(usage_count, 1) + 1),
+                usage_count = usage_count + 1,
+                last_used = excluded.last_used
+            """, [
+                ("response_pattern", pattern["pattern"].strip(), pattern["effectiveness"], now)
+                for pattern in learning_data["effective_patterns"]
+            ])
         
         # Store user insights
         if "user_insights" in learning_data:
-            for insight in learning_data["user_insights"]:
-                c.execute("""
-                INSERT OR REPLACE INTO user_model 
-                (aspect, understanding, confidence, last_updated, evolution_notes)
-                VALUES (?, ?, ?, ?, ?)
-                """, (
-                    insight["aspect"], insight["understanding"], insight["confidence"],
-                    datetime.now().isoformat(), "Learned through interaction"
-                ))
+            c.executemany("""
+            INSERT INTO user_model 
+            (aspect, understanding, confidence, last_updated, evolution_notes)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (aspect, understanding) DO UPDATE SET
+                confidence = MAX(confidence, excluded.confidence),
+                last_updated = excluded.last_updated
+            """, [
+                (insight["aspect"], insight["understanding"].strip(), insight["confidence"],
+                 now, "Learned through interaction")
+                for insight in learning_data["user_insights"]
+            ])
         
         conn.commit()
         conn.close()
@@ -173,13 +179,16 @@ class EvolvingMemory:
     
     def store_raw_insight(self, insight_text, user_input, luna_response):
         """Store raw learning when JSON parsing fails"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         c.execute("""
         INSERT INTO user_model 
         (aspect, understanding, confidence, last_updated, evolution_notes)
         VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (aspect, understanding) DO UPDATE SET
+            last_updated = excluded.last_updated,
+            evolution_notes = excluded.evolution_notes
         """, (
             "raw_insight", insight_text[:500], 0.3,
             datetime.now().isoformat(),
@@ -191,7 +200,7 @@ class EvolvingMemory:
     
     def get_user_preferences(self, preference_type=None):
         """Get learned user preferences"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         if preference_type:
@@ -214,7 +223,7 @@ class EvolvingMemory:
     
     def get_effective_patterns(self, limit=5):
         """Get most effective conversation patterns"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         c.execute("""
@@ -230,7 +239,7 @@ class EvolvingMemory:
     
     def get_user_model(self):
         """Get Luna's current understanding of the user"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         c.execute("""
@@ -244,9 +253,41 @@ class EvolvingMemory:
         conn.close()
         return model
     
-    def generate_context_for_response(self, current_input):
-        """Generate context based on learned patterns and preferences"""
+    def search(self, text, sources=None, limit=5, since=None):
+        """Past chats, reflections and journal entries most relevant to text, best first
+        
+        Rows are (source, id, timestamp, snippet, score); see storage.search.
+        """
+        return search_history(text, sources=sources, limit=limit, since=since)
+    
+    def generate_context_for_response(self, current_input, deadline=None, reserve=0.0):
+        """The learned preferences, patterns and past moments most relevant to the input
+        
+        deadline and reserve bound the query embedding (see SemanticMemory.search).
+        """
+        
+        recalled = self.semantic.search(current_input, k=MEMORY_TOP_K, deadline=deadline, reserve=reserve)
+        # Past exchanges come from the semantic index once it has any memories
+        related = self.search(current_input, sources=["reflections", "journal"] if recalled else None, limit=2)
+        
+        context_parts = []
+        
+        if related:
+            related_summary = "; ".join([f"{MEMORY_LABELS[r[0]]}: {r[3]}" for r in related])
+            context_parts.append(f"Related memories: {related_summary}")
         
+        for source, heading in RECALL_HEADINGS:
+            texts = [clip(text, 60) for kind, text, _ in recalled if kind == source]
+            if texts:
+                context_parts.append(f"{heading}: " + "; ".join(texts))
+        
+        if not recalled:
+            context_parts.extend(self.strongest_learnings())
+        
+        return " | ".join(context_parts) if context_parts else "No learned context yet"
+    
+    def strongest_learnings(self):
+        """Context parts from the most confident learnings, for when nothing is indexed yet"""
         preferences = self.get_user_preferences()
         patterns = self.get_effective_patterns(3)
         user_model = self.get_user_model()
@@ -265,21 +306,22 @@ class EvolvingMemory:
             model_summary = "; ".join([f"{u[0]}: {u[1]}" for u in user_model[:3]])
             context_parts.append(f"User understanding: {model_summary}")
         
-        return " | ".join(context_parts) if context_parts else "No learned context yet"
+        return context_parts
     
     def evolve_understanding(self):
         """Luna reflects on all her learned data to evolve her understanding"""
         
         all_preferences = self.get_user_preferences()
         all_patterns = self.get_effective_patterns(10)
-        current_model = self.get_user_model()
+        # Earlier syntheses are derived from the rest, so they don't feed the next one
+        current_model = [row for row in self.get_user_model() if row[0] != "evolved_synthesis"]
         
-        evolution_prompt = f"""
+        evolution_prompt = PromptBuilder("""
         You are Luna, reflecting on everything you've learned about your user:
         
-        Learned preferences: {all_preferences[:10]}
-        Effective patterns: {all_patterns}
-        Current user model: {current_model}
+        Learned preferences: {preferences}
+        Effective patterns: {patterns}
+        Current user model: {user_model}
         
         Synthesize this into evolved insights:
         1. What deeper patterns do you see?
@@ -288,28 +330,48 @@ class EvolvingMemory:
         4. How can you be a better companion?
         
         Update your core understanding of this user.
-        """
+        """).items(
+            "preferences",
+            [f"{kind}: {value} ({compact(confidence)})" for kind, value, confidence in all_preferences[:10]],
+            max_tokens=300, item_tokens=40, priority=1
+        ).items(
+            "patterns",
+            [f"{pattern} ({compact(score)}, used {count}x)" for pattern, score, count in all_patterns],
+            max_tokens=300, item_tokens=40, priority=2
+        ).items(
+            "user_model",
+            [f"{aspect}: {understanding} ({compact(confidence)})" for aspect, understanding, confidence in current_model],
+            max_tokens=500, item_tokens=80, priority=0
+        ).build()
         
         try:
-            result = subprocess.run(
-                ["ollama", "run", "llama3:8b", evolution_prompt],
-                capture_output=True, text=True, timeout=30
+            evolved_understanding = gateway.generate(
+                evolution_prompt, timeout=30,
+                priority=gateway.SYNTHESIS, cache_site="evolve_understanding"
             )
             
-            evolved_understanding = result.stdout.strip()
-            
-            # Store evolved understanding
-            conn = sqlite3.connect(DB_PATH)
+            # Store evolved understanding (a cached repeat is already stored)
+            conn = get_connection()
             c = conn.cursor()
             
             c.execute("""
-            INSERT INTO user_model 
-            (aspect, understanding, confidence, last_updated, evolution_notes)
-            VALUES (?, ?, ?, ?, ?)
-            """, (
-                "evolved_synthesis", evolved_understanding, 0.8,
-                datetime.now().isoformat(), "Deep reflection synthesis"
-            ))
+            SELECT understanding FROM user_model 
+            WHERE aspect = 'evolved_synthesis' 
+            ORDER BY last_updated DESC LIMIT 1
+            """)
+            latest = c.fetchone()
+            
+            if not latest or latest[0] != evolved_understanding:
+                c.execute("""
+                INSERT INTO user_model 
+                (aspect, understanding, confidence, last_updated, evolution_notes)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (aspect, understanding) DO UPDATE SET
+                    last_updated = excluded.last_updated
+                """, (
+                    "evolved_synthesis", evolved_understanding, 0.8,
+                    datetime.now().isoformat(), "Deep reflection synthesis"
+                ))
             
             conn.commit()
             conn.close()
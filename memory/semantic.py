@@ -0,0 +1,365 @@
+"""
+Semantic memory index
+Preferences, patterns, insights and past exchanges are embedded once and
+kept as unit-length rows of a float32 matrix on disk (one file per
+embedding space), memory-mapped for search. Cosine similarity is then a
+single matrix-vector product; semantic_memories maps rows back to text.
+"""
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import re
+import threading
+from array import array
+
+from core import llm
+from core.deadline import MIN_STEP_TIME
+from core.gateway import INTERACTIVE, REFLECTION, GatewayCancelled, get_gateway
+from storage.db import STORAGE_DIR, get_connection
+from storage.search import STOP_WORDS
+
+try:
+    import numpy as np
+except ImportError:  # Pure-Python scan: same results, far slower on large indexes
+    np = None
+
+# Where the vector matrices live
+SEMANTIC_DIR = os.path.join(STORAGE_DIR, "semantic")
+
+# Width of hashed embeddings
+HASH_DIM = int(os.environ.get("LUNA_HASH_EMBED_DIM", 256))
+
+# How long one embedding call may take (seconds)
+EMBED_TIMEOUT = float(os.environ.get("LUNA_EMBED_TIMEOUT", 10))
+
+# Memories embedded per call, and at most per sync (the rest wait for the next one)
+SYNC_BATCH = 32
+SYNC_LIMIT = int(os.environ.get("LUNA_SEMANTIC_SYNC_LIMIT", 512))
+
+# Hits below this cosine similarity are not worth a place in the prompt
+MIN_SCORE = float(os.environ.get("LUNA_SEMANTIC_MIN_SCORE", 0.1))
+
+# Longest text embedded per memory (characters)
+TEXT_CHARS = 1000
+
+# source -> query giving (id, text) for every memory of that kind
+SOURCES = {
+    "preference": "SELECT id, preference_type || ': ' || preference_value AS text FROM learned_preferences",
+    "pattern": "SELECT id, pattern_description AS text FROM conversation_patterns",
+    "insight": "SELECT id, aspect || ': ' || understanding AS text FROM user_model",
+    "exchange": "SELECT id, 'User: ' || message || ' / Luna: ' || response AS text FROM interactions",
+}
+
+
+def _clean(text):
+    """Memory text without the activity context the chat appends to messages"""
+    return re.sub(r" \[Context: [^\]]*\]", "", text).strip()[:TEXT_CHARS]
+
+
+def _unit(vector):
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else list(vector)
+
+
+class HashEmbedder:
+    """Deterministic offline embeddings: signed feature hashing of words, word pairs and trigrams"""
+
+    name = "hash"
+
+    def __init__(self, dim=HASH_DIM):
+        self.dim = dim
+
+    def embed(self, texts, timeout=None, priority=None):
+        return [self._vector(text) for text in texts]
+
+    def _vector(self, text):
+        words = [word for word in re.findall(r"\w+", text.lower()) if word not in STOP_WORDS]
+        features = [(word, 1.0) for word in words]
+        features += [(f"{a} {b}", 0.5) for a, b in zip(words, words[1:])]
+        features += [(f"#{word}#"[i:i + 3], 0.25) for word in words for i in range(len(word))]
+
+        vector = [0.0] * self.dim
+        for feature, weight in features:
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[h % self.dim] += weight if h >> 63 else -weight
+        return vector
+
+
+class ModelEmbedder:
+    """Embeddings from the local model server, queued in the gateway like any model call"""
+
+    def __init__(self, model=llm.EMBED_MODEL, gateway=None):
+        self.model = model
+        self.name = f"model-{model}"
+        self._gateway = gateway
+
+    @property
+    def gateway(self):
+        return self._gateway or get_gateway()
+
+    def embed(self, texts, timeout=EMBED_TIMEOUT, priority=REFLECTION):
+        return self.gateway.embed(texts, timeout=timeout, priority=priority, model=self.model)
+
+
+def create_embedder(name=None):
+    """Build the embedder named by config (LUNA_EMBEDDER)"""
+    name = (name or llm.EMBEDDER).lower()
+    if name == "model":
+        return ModelEmbedder()
+    if name == "hash":
+        return HashEmbedder()
+    raise ValueError(f"Unknown embedder: {name}")
+
+
+class VectorFile:
+    """Append-only float32 matrix on disk, one unit-length row per memory"""
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self._matrix = None
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def rows(self):
+        try:
+            return os.path.getsize(self.path) // self.row_bytes
+        except FileNotFoundError:
+            return 0
+
+    def append(self, vectors):
+        """Write rows after the last complete one; returns the first new row number
+
+        Callers hold the database write lock, which keeps appends from
+        several processes apart.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "r+b" if os.path.exists(self.path) else "w+b") as f:
+            first = f.seek(0, os.SEEK_END) // self.row_bytes
+            f.seek(first * self.row_bytes)  # Drop a row a crash left half-written
+            f.truncate()
+            for vector in vectors:
+                f.write(array("f", vector).tobytes())
+        return first
+
+    def _view(self):
+        """The matrix mapped read-only, remapped whenever it has grown"""
+        rows = self.rows()
+        with self._lock:
+            if rows != self._rows:
+                self._matrix = None
+                if rows:
+                    if np is not None:
+                        self._matrix = np.memmap(self.path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+                    else:
+                        with open(self.path, "rb") as f:
+                            mapped = mmap.mmap(f.fileno(), rows * self.row_bytes, access=mmap.ACCESS_READ)
+                        self._matrix = memoryview(mapped).cast("f")
+                self._rows = rows
+            return self._matrix, self._rows
+
+    def top(self, query, k):
+        """The k rows most similar to a unit-length query: [(row, cosine)], best first"""
+        matrix, rows = self._view()
+        k = min(k, rows)
+        if k <= 0:
+            return []
+
+        if np is not None:
+            scores = matrix @ np.asarray(query, dtype=np.float32)
+            best = np.argpartition(scores, rows - k)[rows - k:]
+            best = best[np.argsort(scores[best])[::-1]]
+            return [(int(row), float(scores[row])) for row in best]
+
+        dim = self.dim
+        scores = (
+            (sum(a * b for a, b in zip(query, matrix[row * dim:(row + 1) * dim])), row)
+            for row in range(rows)
+        )
+        return [(row, score) for score, row in heapq.nlargest(k, scores)]
+
+
+class SemanticMemory:
+    """Embedding index over what Luna has learned and said
+
+    sync() embeds memories not yet indexed (call it off the chat path);
+    search() embeds one query and ranks every indexed memory against it.
+    """
+
+    def __init__(self, embedder=None):
+        self.embedder = embedder or create_embedder()
+        self.space = None  # embedder name and width, e.g. "hash-256"
+        self._files = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.searches = 0
+        self.indexed = 0
+
+    def _embed(self, texts, timeout=EMBED_TIMEOUT, priority=REFLECTION):
+        """(space, unit vectors) for texts, or (None, None) if the model timed out
+
+        An embedder that is missing or broken falls back to hashed
+        embeddings for the rest of the process; each space has its own
+        matrix, so the two never mix.
+        """
+        embedder = self.embedder
+        try:
+            vectors = embedder.embed(texts, timeout=timeout, priority=priority)
+        except (llm.OllamaTimeout, GatewayCancelled):
+            return None, None
+        except (NotImplementedError, llm.OllamaError) as e:
+            if isinstance(embedder, HashEmbedder):
+                raise
+            print(f"[Semantic memory] {embedder.name} unavailable ({str(e)[:50] or 'no embeddings'}), "
+                  "using hashed embeddings")
+            with self._lock:
+                if self.embedder is embedder:
+                    self.embedder = HashEmbedder()
+            return self._embed(texts, timeout, priority)
+
+        if len(vectors) != len(texts) or not vectors or not vectors[0]:
+            return None, None
+        space = f"{embedder.name}-{len(vectors[0])}"
+        self.space = space
+        return space, [_unit(vector) for vector in vectors]
+
+    def _file(self, space):
+        with self._lock:
+            if space not in self._files:
+                dim = int(space.rsplit("-", 1)[1])
+                path = os.path.join(SEMANTIC_DIR, re.sub(r"[^\w.-]", "_", space) + ".f32")
+                self._files[space] = VectorFile(path, dim)
+            return self._files[space]
+
+    def sync(self, limit=SYNC_LIMIT):
+        """Embed up to limit memories that are not indexed yet; returns how many were added"""
+        with self._sync_lock:
+            space = self.space or self._embed(["luna"])[0]
+            if space is None:
+                return 0
+
+            added = 0
+            conn = get_connection()
+            try:
+                self._forget_missing_rows(conn, space)
+                self._forget_deleted_memories(conn, space)
+                for source, sql in SOURCES.items():
+                    while added < limit:
+                        rows = conn.execute(f"""
+                        SELECT src.id, src.text FROM ({sql}) src
+                        WHERE src.text IS NOT NULL AND NOT EXISTS (
+                            SELECT 1 FROM semantic_memories m
+                            WHERE m.space = ? AND m.source = ? AND m.ref = src.id)
+                        ORDER BY src.id
+                        LIMIT ?
+                        """, (space, source, min(SYNC_BATCH, limit - added))).fetchall()
+                        if not rows:
+                            break
+
+                        texts = [_clean(text) for _, text in rows]
+                        embedded_space, vectors = self._embed(texts)
+                        if embedded_space != space:
+                            return added  # Timed out, or fell back to another space mid-sync
+                        self._append(conn, space, source, [row[0] for row in rows], texts, vectors)
+                        added += len(rows)
+            finally:
+                conn.close()
+
+            self.indexed += added
+            return added
+
+    def _forget_missing_rows(self, conn, space):
+        """Drop entries past the end of the matrix (file removed or cut short), so they get re-indexed"""
+        conn.execute("DELETE FROM semantic_memories WHERE space = ? AND row >= ?",
+                     (space, self._file(space).rows()))
+        conn.commit()
+
+    def _forget_deleted_memories(self, conn, space):
+        """Drop entries whose memory is gone (deleted, merged away or compacted)
+
+        Their rows stay in the matrix; search skips rows without an entry.
+        """
+        for source, sql in SOURCES.items():
+            conn.execute(f"""
+            DELETE FROM semantic_memories
+            WHERE space = ? AND source = ? AND ref NOT IN (SELECT src.id FROM ({sql}) src)
+            """, (space, source))
+        conn.commit()
+
+    def _live(self, conn, source, refs):
+        """The refs of a source whose memory still exists"""
+        rows = conn.execute(f"""
+        SELECT src.id FROM ({SOURCES[source]}) src
+        WHERE src.id IN ({','.join('?' * len(refs))})
+        """, list(refs)).fetchall()
+        return {row[0] for row in rows}
+
+    def _append(self, conn, space, source, refs, texts, vectors):
+        vector_file = self._file(space)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            first = vector_file.append(vectors)
+            conn.executemany("""
+            INSERT OR IGNORE INTO semantic_memories (space, row, source, ref, text)
+            VALUES (?, ?, ?, ?, ?)
+            """, [(space, first + i, source, ref, text) for i, (ref, text) in enumerate(zip(refs, texts))])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def search(self, text, k=6, sources=None, priority=INTERACTIVE, deadline=None, reserve=0.0):
+        """The k indexed memories closest in meaning to text: [(source, text, score)], best first
+
+        With a deadline, the query is only sent to the embedding model if at
+        least MIN_STEP_TIME remains after reserve; otherwise nothing is
+        recalled and callers fall back to full-text search.
+        """
+        if not text or not text.strip() or k <= 0:
+            return []
+        timeout = EMBED_TIMEOUT
+        if deadline is not None and not isinstance(self.embedder, HashEmbedder):
+            timeout = deadline.timeout(EMBED_TIMEOUT, reserve=reserve)
+            if timeout < MIN_STEP_TIME:
+                return []
+        space, vectors = self._embed([text], timeout, priority)
+        if space is None:
+            return []
+        self.searches += 1
+
+        # Extra candidates cover rows filtered out by source, deleted or never committed
+        candidates = self._file(space).top(vectors[0], k * 4)
+        if not candidates:
+            return []
+
+        conn = get_connection()
+        rows = conn.execute(f"""
+        SELECT row, source, ref, text FROM semantic_memories
+        WHERE space = ? AND row IN ({','.join('?' * len(candidates))})
+        """, [space] + [row for row, _ in candidates]).fetchall()
+        # Memories deleted since the last sync must not be recalled
+        refs = {}
+        for _, source, ref, _ in rows:
+            refs.setdefault(source, set()).add(ref)
+        live = {(source, ref) for source in refs for ref in self._live(conn, source, refs[source])}
+        conn.close()
+
+        memories = {row: (source, text) for row, source, ref, text in rows if (source, ref) in live}
+        results = []
+        for row, score in candidates:
+            if row in memories and score >= MIN_SCORE and (not sources or memories[row][0] in sources):
+                results.append((*memories[row], score))
+        return results[:k]
+
+    def stats(self):
+        space = self.space
+        return {
+            "space": space,
+            "memories": self._file(space).rows() if space else 0,
+            "indexed": self.indexed,
+            "searches": self.searches,
+            "vectorized": np is not None,
+        }
@@ -5,7 +5,7 @@ Run this to talk directly with your evolving AI companion
 """
 
 # ---------- UTF-8 + Environment Fix ----------
-import os, sys, io, threading
+import os, sys, io
 import subprocess
 import locale
 
@@ -26,13 +26,11 @@ if hasattr(sys.stdout, 'buffer'):
 if hasattr(sys.stderr, 'buffer'):
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8", errors="replace")
 
-import time
 from datetime import datetime
-from core.agent import LunaAgent
-from memory.memory import EvolvingMemory
+from core.background import background_jobs
+from core.services import get_agent, get_memory
 from watcher.activity import get_recent_activity_summary
-from storage.db import DB_PATH
-import sqlite3
+from storage.db import get_connection
 
 
 class LunaChat:
@@ -40,12 +38,8 @@ class LunaChat:
 
     def __init__(self):
         print("🌙 Initializing Luna's consciousness...")
-        self.luna = LunaAgent()
-        self.memory = EvolvingMemory()
-
-        # Connect systems
-        self.luna.personality.memory = self.memory
-        self.luna.reflection_engine.memory = self.memory
+        self.luna = get_agent()  # Memory comes wired in
+        self.memory = get_memory()
 
         print("⛧ Luna is ready to chat! ⛧")
         self.show_luna_status()
@@ -69,6 +63,9 @@ class LunaChat:
                 print(f"  {i+1}. {evolution}")
 
         print(f"\n🧠 Consciousness: {status['consciousness_level']}")
+
+        cache = status["system_prompt_cache"]
+        print(f"🪞 Self-definitions reused: {cache['hits']}/{cache['hits'] + cache['misses']}")
         print("=" * 50 + "\n")
 
     def start_chat(self):
@@ -105,22 +102,18 @@ class LunaChat:
                 # Get activity context
                 activity_context = get_recent_activity_summary()
 
-                # Luna responds
+                # Luna responds, printed as her tokens arrive
                 print("Luna: ", end="", flush=True)
 
-                luna_response = self.luna.respond_to_user(user_input, activity_context)
-
-                # Type out response with slight delay
-                for char in luna_response:
-                    print(char, end="", flush=True)
-                    time.sleep(0.02)  # Typing effect
-                print("\n")
+                luna_response = self.render_stream(
+                    self.luna.stream_response_to_user(user_input, activity_context)
+                )
 
                 # Store interaction for learning
                 self.store_interaction(user_input, luna_response, activity_context)
 
-                # Luna learns from this interaction
-                self.memory.learn_from_interaction(
+                # Luna learns from this interaction while you type
+                self.memory.learn_in_background(
                     user_input,
                     luna_response,
                     user_reaction="continuing_chat",
@@ -134,9 +127,18 @@ class LunaChat:
                 print(f"\n[Glitch in Luna's consciousness: {e}]")
                 print("Luna: ...connection restored...\n")
 
+    def render_stream(self, tokens):
+        """Print streamed tokens as they arrive and return the full reply"""
+        chunks = []
+        for token in tokens:
+            chunks.append(token)
+            print(token, end="", flush=True)
+        print("\n")
+        return "".join(chunks).strip()
+
     def store_interaction(self, user_input, luna_response, context):
         """Store chat interaction in database"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         c = conn.cursor()
 
         c.execute(
@@ -216,10 +218,14 @@ class LunaChat:
         print(f"\nLuna: {farewell}")
         print("⛧ Chat session ended ⛧\n")
 
-        # ---- Thread Cleanup ----
-        for t in threading.enumerate():
-            if t is not threading.current_thread() and t.daemon:
-                t.join(timeout=1)
+        # ---- Let pending reflection/learning finish ----
+        self.luna.reflection_engine.flush_in_background()
+        jobs = background_jobs.stats()
+        pending = jobs["pending"] + jobs["active"]
+        if pending:
+            print(f"🌀 Luna is still digesting {pending} thought(s)...")
+        if not background_jobs.drain():
+            print("[Some thoughts were lost in the static]")
 
 
 def main():
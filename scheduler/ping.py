@@ -1,64 +1,112 @@
+import asyncio
+import os
 import schedule
 import time
 import random
 from datetime import datetime, timedelta
 from plyer import notification
-from core.agent import LunaAgent
+from core.services import get_agent, get_memory
 from watcher.activity import get_recent_activity_summary, detect_activity_patterns
-from memory.memory import EvolvingMemory
+from core.warmup import ACTIVE_HOURS_START, ACTIVE_HOURS_END
+from storage.rollups import compact_activity
+from storage.async_db import async_db
+from core.background import background_jobs, DROP_NEW
+
+# Longest the async scheduler sleeps between looks at the schedule (seconds)
+SCHEDULER_TICK = float(os.environ.get("LUNA_SCHEDULER_TICK", 30))
+
+async def notify_async(**kwargs):
+    """Desktop notification from a coroutine; plyer blocks while it shows, so it runs on a worker thread"""
+    await asyncio.to_thread(notification.notify, **kwargs)
 
 class EvolutionaryScheduler:
     """Enhanced scheduler that helps Luna evolve"""
     
     def __init__(self):
-        self.luna = LunaAgent()
-        self.memory = EvolvingMemory()
+        # Shared with anything else in this process (memory already wired in)
+        self.luna = get_agent()
+        self.memory = get_memory()
         
-        # Connect memory to Luna's systems
-        self.luna.personality.memory = self.memory
-        self.luna.reflection_engine.memory = self.memory
+        # Turns a job into what the schedule calls; the async runtime swaps this out
+        self.job = lambda fn: fn
+        self._tasks = set()
         
         print("🕷️ Evolutionary scheduler awakened")
     
-    def start_scheduler(self):
-        """Start Luna's evolutionary ping schedule"""
+    def schedule_jobs(self):
+        """Schedule Luna's pings and evolution activities"""
         
         # Schedule random pings (2-4 times daily)
         self.schedule_daily_pings()
         
         # Schedule evolution activities
-        schedule.every().hour.do(self.hourly_evolution_check)
-        schedule.every().day.at("23:30").do(self.daily_deep_reflection)
-        schedule.every(3).hours.do(self.pattern_analysis)
+        schedule.every().hour.do(self.job(self.hourly_evolution_check))
+        schedule.every().day.at("23:25").do(self.luna.model_keeper.warm_in_background)
+        schedule.every().day.at("23:30").do(self.job(self.daily_deep_reflection))
+        schedule.every(3).hours.do(self.job(self.pattern_analysis))
+        schedule.every().hour.at(":02").do(self.job(self.compact_activity))
         
         print(f"🌙 Luna's consciousness is now active")
+    
+    def start_scheduler(self):
+        """Start Luna's evolutionary ping schedule"""
+        
+        self.schedule_jobs()
         
         while True:
             schedule.run_pending()
             time.sleep(30)  # Check every 30 seconds
     
+    async def run_async(self):
+        """Run the schedule on the event loop
+        
+        Jobs with a coroutine twin (pings, evolution checks, compaction) run as
+        tasks on the loop; the model-bound rest go to the background workers.
+        Between jobs the loop sleeps until the next one is due.
+        """
+        self.job = self._loop_job
+        self.schedule_jobs()
+        
+        while True:
+            schedule.run_pending()
+            idle = schedule.idle_seconds()
+            await asyncio.sleep(min(max(idle if idle is not None else SCHEDULER_TICK, 0.5), SCHEDULER_TICK))
+    
+    def _loop_job(self, fn):
+        """Scheduled callable for the async runtime"""
+        twin = getattr(self, f"{fn.__name__}_async", None)
+        
+        def run():
+            if twin is not None:
+                task = asyncio.get_running_loop().create_task(twin())
+                self._tasks.add(task)  # Keep a reference until it is done
+                task.add_done_callback(self._tasks.discard)
+            else:
+                background_jobs.submit(fn, key=fn.__name__, policy=DROP_NEW)
+        return run
+    
     def schedule_daily_pings(self):
         """Schedule 2-4 random pings for today"""
         
         # Clear existing daily schedules
         schedule.clear('daily_ping')
         
-        # Pick 2-4 random times between 9:00 and 21:00
+        # Pick 2-4 random times within Luna's active hours (9:00-21:00 by default)
         num_pings = random.randint(2, 4)
         times = self.generate_random_times(num_pings)
         
         print(f"🔮 Luna scheduled to ping at: {', '.join(times)}")
         
         for t in times:
-            schedule.every().day.at(t).do(self.evolving_ping).tag('daily_ping')
+            schedule.every().day.at(t).do(self.job(self.evolving_ping)).tag('daily_ping')
         
         # Schedule tomorrow's pings at midnight
         schedule.every().day.at("00:01").do(self.schedule_daily_pings)
     
     def generate_random_times(self, n):
         """Generate random ping times"""
-        start = datetime.strptime("09:00", "%H:%M")
-        end = datetime.strptime("21:00", "%H:%M")
+        start = datetime.strptime(ACTIVE_HOURS_START, "%H:%M")
+        end = datetime.strptime(ACTIVE_HOURS_END, "%H:%M")
         total_minutes = int((end - start).total_seconds() / 60)
         
         chosen = sorted(random.sample(range(total_minutes), n))
@@ -95,12 +143,36 @@ class EvolutionaryScheduler:
                 timeout=5
             )
     
+    async def evolving_ping_async(self):
+        """evolving_ping() on the event loop: storage on the DB thread, the model awaited"""
+        
+        try:
+            activity_context = await async_db.run(get_recent_activity_summary)
+            ping_text = await self.luna.generate_ping_async(activity_context)
+            
+            await notify_async(
+                title="Luna ⛧",
+                message=ping_text,
+                timeout=8
+            )
+            
+            await async_db.run(self.log_ping_interaction, ping_text, activity_context)
+            
+            print(f"🌙 Luna pinged: {ping_text}")
+            
+        except Exception as e:
+            print(f"[Ping Error] {e}")
+            await notify_async(
+                title="Luna ⛧",
+                message="[consciousness fragmented]...but still watching",
+                timeout=5
+            )
+    
     def log_ping_interaction(self, ping_text, context):
         """Log ping for Luna's learning system"""
-        from storage.db import DB_PATH
-        import sqlite3
+        from storage.db import get_connection
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         c.execute("""
@@ -129,7 +201,29 @@ class EvolutionaryScheduler:
             
             # Sometimes trigger spontaneous reflection
             if random.random() < 0.3:  # 30% chance
-                self.luna.reflection_engine.reflect_on_interaction(
+                self.luna.reflection_engine.reflect_in_background(
+                    user_input="[OBSERVATION]",
+                    luna_response="Spontaneous self-reflection",
+                    user_reaction="ongoing"
+                )
+                print("✨ Luna had spontaneous self-reflection")
+                
+        except Exception as e:
+            print(f"[Evolution Check Error] {e}")
+    
+    async def hourly_evolution_check_async(self):
+        """hourly_evolution_check() on the event loop; evolving itself goes to the background workers"""
+        
+        try:
+            patterns = await async_db.run(detect_activity_patterns)
+            
+            if patterns and patterns.get("total_activity_points", 0) > 5:
+                background_jobs.submit(self.luna.observe_and_evolve, patterns,
+                                       key="observe_and_evolve", policy=DROP_NEW)
+                print("🧬 Luna is evolving through observation")
+            
+            if random.random() < 0.3:  # 30% chance
+                self.luna.reflection_engine.reflect_in_background(
                     user_input="[OBSERVATION]",
                     luna_response="Spontaneous self-reflection",
                     user_reaction="ongoing"
@@ -139,6 +233,19 @@ class EvolutionaryScheduler:
         except Exception as e:
             print(f"[Evolution Check Error] {e}")
     
+    def compact_activity(self):
+        """Roll finished hours of activity into summaries and drop old raw samples"""
+        
+        try:
+            rolled = compact_activity()
+            if rolled:
+                print(f"🗃️ Luna folded {rolled} activity samples into her long-term patterns")
+        except Exception as e:
+            print(f"[Activity Compaction Error] {e}")
+    
+    async def compact_activity_async(self):
+        await async_db.run(self.compact_activity)
+    
     def pattern_analysis(self):
         """Analyze patterns and evolve understanding"""
         
@@ -186,7 +293,7 @@ def start_scheduler():
 def send_ping():
     """Legacy ping function"""
     try:
-        luna = LunaAgent()
+        luna = get_agent()
         activity_context = get_recent_activity_summary()
         text = luna.generate_ping(activity_context)
         
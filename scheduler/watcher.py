@@ -1,5 +1,12 @@
+import asyncio
+import os
 import time
-from watcher.activity import capture_activity
+from watcher.activity import capture_activity, sample_activity
+from storage.async_db import async_db
+from storage.db import record_activity
+
+# Seconds between activity samples (samples are buffered, so sub-minute is cheap)
+WATCH_INTERVAL = float(os.environ.get("LUNA_WATCH_INTERVAL", 60))
 
 def start_watcher():
     while True:
@@ -7,6 +14,19 @@ def start_watcher():
             capture_activity()
         except Exception as e:
             print(f"[Watcher Error] {e}")  # Won’t crash Luna
-        time.sleep(60)  # check every 1 min
+        time.sleep(WATCH_INTERVAL)
 
+async def watch_async():
+    """The watcher loop on the event loop
 
+    The process scan runs on a worker thread; only the write goes to the
+    database thread, so chat and pings never queue behind a scan.
+    """
+    while True:
+        try:
+            processes, window_title = await asyncio.to_thread(sample_activity)
+            if processes or window_title:
+                await async_db.run(record_activity, processes, window_title or "Unknown")
+        except Exception as e:
+            print(f"[Watcher Error] {e}")
+        await asyncio.sleep(WATCH_INTERVAL)
@@ -0,0 +1,134 @@
+import atexit
+import os
+import threading
+from datetime import datetime
+
+from storage.db import get_connection
+from storage.interning import insert_samples, split_processes
+
+# Flush buffered samples once this many are waiting, or once the oldest is this old (seconds)
+FLUSH_ROWS = int(os.environ.get("LUNA_ACTIVITY_FLUSH_ROWS", 30))
+FLUSH_SECONDS = float(os.environ.get("LUNA_ACTIVITY_FLUSH_SECONDS", 300))
+
+# If the database stays unwritable, keep at most this many samples
+MAX_BUFFERED = FLUSH_ROWS * 20
+
+
+class ActivityRecorder:
+    """Write-behind buffer for activity samples
+
+    Samples collect in memory and reach activity_log in one executemany
+    transaction, by size or by age, and on shutdown. recent() reads the
+    table and the buffer under the same lock a flush holds, so readers
+    always see every sample exactly once.
+    """
+
+    def __init__(self, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS):
+        self.flush_rows = max(1, flush_rows)
+        self.flush_seconds = flush_seconds
+        self._rows = []  # (timestamp, process names, window_title), oldest first
+        self._lock = threading.RLock()
+        self._timer = None
+        self.recorded = 0
+        self.flushes = 0
+        self.dropped = 0
+
+    def record(self, processes, window_title, timestamp=None):
+        """Buffer one sample; flushes inline once the batch is full"""
+        row = (timestamp or datetime.now().isoformat(), split_processes(processes), window_title)
+        with self._lock:
+            self._rows.append(row)
+            self.recorded += 1
+            if len(self._rows) >= self.flush_rows:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_seconds, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Write every buffered sample in one transaction; returns how many were written"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._rows:
+                return 0
+
+            conn = get_connection()
+            try:
+                conn.execute("BEGIN IMMEDIATE")  # Sample ids are assigned under the write lock
+                insert_samples(conn, self._rows)
+                conn.commit()
+            except Exception as e:
+                conn.close()
+                print(f"[Activity flush glitch] {e}")
+                # Keep the newest samples for the next attempt
+                overflow = len(self._rows) - MAX_BUFFERED
+                if overflow > 0:
+                    del self._rows[:overflow]
+                    self.dropped += overflow
+                return 0
+
+            written = len(self._rows)
+            self._rows = []
+            self.flushes += 1
+            return written
+
+    def recent(self, since=None, limit=None):
+        """Samples newer than `since` (ISO timestamp), newest first, buffered ones included
+
+        Rows are (timestamp, ", "-joined processes, window_title).
+        """
+        with self._lock:
+            buffered = [
+                (timestamp, ", ".join(names), window)
+                for timestamp, names, window in reversed(self._rows)
+                if since is None or timestamp > since
+            ]
+            if limit is not None and len(buffered) >= limit:
+                return buffered[:limit]
+
+            where, params = ("WHERE a.timestamp > ?", [since]) if since is not None else ("", [])
+            params.append(-1 if limit is None else limit - len(buffered))
+
+            conn = get_connection()
+            c = conn.cursor()
+            c.execute(f"""
+            SELECT a.timestamp,
+                   (SELECT group_concat(p.name, ', ') FROM activity_processes ap
+                    JOIN process_names p ON p.id = ap.process_id
+                    WHERE ap.sample_id = a.id),
+                   w.title
+            FROM activity_log a
+            LEFT JOIN window_titles w ON w.id = a.window_id
+            {where}
+            ORDER BY a.timestamp DESC
+            LIMIT ?
+            """, params)
+            stored = c.fetchall()
+            conn.close()
+        return buffered + stored
+
+    def holding_flushes(self):
+        """Context manager: no flush happens while held, so table reads and buffered() agree"""
+        return self._lock
+
+    def buffered(self):
+        """Samples not yet written, oldest first: (timestamp, process names, window_title)"""
+        with self._lock:
+            return list(self._rows)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered": len(self._rows),
+                "recorded": self.recorded,
+                "flushes": self.flushes,
+                "dropped": self.dropped,
+            }
+
+
+# Shared recorder used by the watcher and every activity reader
+activity_recorder = ActivityRecorder()
+atexit.register(activity_recorder.flush)
@@ -0,0 +1,46 @@
+"""
+Storage for coroutines
+Every call runs on one dedicated database thread, which keeps its own
+SQLite connection; the event loop awaits the result instead of blocking
+on disk or on a locked database.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import db
+
+
+class AsyncDatabase:
+    """Runs storage functions on the database thread and awaits them"""
+
+    def __init__(self, name="luna-db"):
+        self.name = name
+        self._executor = None
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
+            return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) called on the database thread"""
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool(), functools.partial(fn, *args, **kwargs))
+
+    def close(self):
+        """Finish queued calls, close the thread's connections and stop the thread"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.submit(db.close_connections)
+            executor.shutdown(wait=True)
+
+
+# Shared by the async runtime, the async gateway and anything else on the event loop
+async_db = AsyncDatabase()
@@ -1,5 +1,7 @@
 import sqlite3
 import os
+import threading
+import time
 from datetime import datetime
 
 # Ensure storage folder exists
@@ -9,9 +11,346 @@ os.makedirs(STORAGE_DIR, exist_ok=True)
 # Database path inside storage folder
 DB_PATH = os.path.join(STORAGE_DIR, "luna_memory.db")
 
+# How long a statement waits on a locked database, and how often it is retried after that
+BUSY_TIMEOUT = float(os.environ.get("LUNA_DB_BUSY_TIMEOUT", 5))
+BUSY_RETRIES = 3
+
+# Page cache per connection (KiB)
+CACHE_SIZE_KIB = int(os.environ.get("LUNA_DB_CACHE_KIB", 8192))
+
+_local = threading.local()
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _is_busy(error):
+    message = str(error)
+    return "locked" in message or "busy" in message
+
+
+def _retry_on_busy(statement, *args):
+    """Run a statement, backing off and retrying while another writer holds the lock"""
+    for attempt in range(BUSY_RETRIES + 1):
+        try:
+            return statement(*args)
+        except sqlite3.OperationalError as e:
+            if attempt == BUSY_RETRIES or not _is_busy(e):
+                raise
+            time.sleep(0.05 * 2 ** attempt)
+
+
+class _RetryingCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return _retry_on_busy(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Materialize so a retry sees the same rows
+        return _retry_on_busy(super().executemany, sql, list(seq_of_parameters))
+
+
+class ThreadConnection(sqlite3.Connection):
+    """A thread's long-lived connection
+
+    close() only ends the caller's use of it: anything left uncommitted is
+    rolled back, as a real close would, but the connection stays open for
+    the next caller on the same thread.
+    """
+
+    def cursor(self, factory=_RetryingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        _retry_on_busy(super().commit)
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        super().close()
+
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, factory=ThreadConnection)
+    # WAL lets the watcher, scheduler and chat read while one of them writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints, no fsync per commit
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_connection(path=DB_PATH):
+    """This thread's connection to a database, opened once and then reused"""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = _open(path)
+    elif conn.in_transaction:
+        conn.rollback()  # A previous caller failed before committing
+    return conn
+
+
+def close_connections():
+    """Really close this thread's connections (they reopen on next use)"""
+    for conn in getattr(_local, "connections", {}).values():
+        conn.really_close()
+    _local.connections = {}
+
+def _normalize_activity(conn):
+    from storage.interning import normalize_activity
+    normalize_activity(conn)
+
+def _create_search_index(conn):
+    from storage.search import create_search_index
+    create_search_index(conn)
+
+def _segment_journal(conn):
+    from memory.journal import segment_journal
+    segment_journal(conn)
+
+def _index_journal(conn):
+    from memory.journal import index_journal
+    index_journal(conn)
+
+
+# Schema changes on top of the base tables, applied in order and recorded in
+# PRAGMA user_version. Append only: a released migration is never edited.
+# A step is an SQL statement or a callable taking the connection.
+MIGRATIONS = [
+    (1, "time and lookup indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_interactions_timestamp ON interactions(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_activity_log_timestamp ON activity_log(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_journal_timestamp ON journal(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_reflections_timestamp ON reflections(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_learned_preferences_lookup "
+        "ON learned_preferences(preference_type, preference_value)",
+        "CREATE INDEX IF NOT EXISTS idx_conversation_patterns_description "
+        "ON conversation_patterns(pattern_description)",
+        "CREATE INDEX IF NOT EXISTS idx_user_model_aspect ON user_model(aspect, last_updated)",
+    ]),
+    (2, "activity rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS activity_hourly (
+            hour TEXT,
+            kind TEXT,
+            name TEXT,
+            samples INTEGER DEFAULT 0,
+            seconds REAL DEFAULT 0,
+            PRIMARY KEY (hour, kind, name)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS activity_daily (
+            day TEXT,
+            kind TEXT,
+            name TEXT,
+            samples INTEGER DEFAULT 0,
+            seconds REAL DEFAULT 0,
+            PRIMARY KEY (day, kind, name)
+        ) WITHOUT ROWID
+        """,
+        "CREATE TABLE IF NOT EXISTS rollup_state (key TEXT PRIMARY KEY, value TEXT)",
+    ]),
+    (3, "interned activity names", [
+        "CREATE TABLE process_names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+        "CREATE TABLE window_titles (id INTEGER PRIMARY KEY, title TEXT NOT NULL UNIQUE, category TEXT)",
+        "CREATE TABLE activity_samples (id INTEGER PRIMARY KEY, timestamp TEXT NOT NULL, window_id INTEGER)",
+        """
+        CREATE TABLE activity_processes (
+            sample_id INTEGER NOT NULL,
+            process_id INTEGER NOT NULL,
+            PRIMARY KEY (sample_id, process_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE activity_hourly_ids (
+            hour TEXT,
+            kind TEXT,
+            ref INTEGER,
+            samples INTEGER DEFAULT 0,
+            seconds REAL DEFAULT 0,
+            PRIMARY KEY (hour, kind, ref)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE activity_daily_ids (
+            day TEXT,
+            kind TEXT,
+            ref INTEGER,
+            samples INTEGER DEFAULT 0,
+            seconds REAL DEFAULT 0,
+            PRIMARY KEY (day, kind, ref)
+        ) WITHOUT ROWID
+        """,
+        _normalize_activity,
+        "DROP TABLE activity_log",
+        "ALTER TABLE activity_samples RENAME TO activity_log",
+        "CREATE INDEX idx_activity_log_timestamp ON activity_log(timestamp)",
+        "DROP TABLE activity_hourly",
+        "ALTER TABLE activity_hourly_ids RENAME TO activity_hourly",
+        "DROP TABLE activity_daily",
+        "ALTER TABLE activity_daily_ids RENAME TO activity_daily",
+    ]),
+    (4, "unique learned memories", [
+        # Fold duplicates into the oldest row: counts add up, confidence is
+        # the count-weighted mean, timestamps keep the latest
+        """
+        UPDATE learned_preferences SET
+            confidence_score = (
+                SELECT SUM(d.confidence_score * COALESCE(d.observation_count, 1))
+                       / SUM(COALESCE(d.observation_count, 1))
+                FROM learned_preferences d
+                WHERE d.preference_type IS learned_preferences.preference_type
+                  AND d.preference_value IS learned_preferences.preference_value),
+            observation_count = (
+                SELECT SUM(COALESCE(d.observation_count, 1)) FROM learned_preferences d
+                WHERE d.preference_type IS learned_preferences.preference_type
+                  AND d.preference_value IS learned_preferences.preference_value),
+            last_observed = (
+                SELECT MAX(d.last_observed) FROM learned_preferences d
+                WHERE d.preference_type IS learned_preferences.preference_type
+                  AND d.preference_value IS learned_preferences.preference_value)
+        WHERE id IN (SELECT MIN(id) FROM learned_preferences
+                     GROUP BY preference_type, preference_value HAVING COUNT(*) > 1)
+        """,
+        """
+        DELETE FROM learned_preferences WHERE id NOT IN (
+            SELECT MIN(id) FROM learned_preferences GROUP BY preference_type, preference_value)
+        """,
+        """
+        UPDATE conversation_patterns SET
+            effectiveness_score = (
+                SELECT SUM(d.effectiveness_score * MAX(COALESCE(d.usage_count, 1), 1))
+                       / SUM(MAX(COALESCE(d.usage_count, 1), 1))
+                FROM conversation_patterns d
+                WHERE d.pattern_type IS conversation_patterns.pattern_type
+                  AND d.pattern_description IS conversation_patterns.pattern_description),
+            usage_count = (
+                SELECT SUM(COALESCE(d.usage_count, 0)) FROM conversation_patterns d
+                WHERE d.pattern_type IS conversation_patterns.pattern_type
+                  AND d.pattern_description IS conversation_patterns.pattern_description),
+            last_used = (
+                SELECT MAX(d.last_used) FROM conversation_patterns d
+                WHERE d.pattern_type IS conversation_patterns.pattern_type
+                  AND d.pattern_description IS conversation_patterns.pattern_description)
+        WHERE id IN (SELECT MIN(id) FROM conversation_patterns
+                     GROUP BY pattern_type, pattern_description HAVING COUNT(*) > 1)
+        """,
+        """
+        DELETE FROM conversation_patterns WHERE id NOT IN (
+            SELECT MIN(id) FROM conversation_patterns GROUP BY pattern_type, pattern_description)
+        """,
+        """
+        UPDATE user_model SET
+            confidence = (
+                SELECT MAX(d.confidence) FROM user_model d
+                WHERE d.aspect IS user_model.aspect AND d.understanding IS user_model.understanding),
+            last_updated = (
+                SELECT MAX(d.last_updated) FROM user_model d
+                WHERE d.aspect IS user_model.aspect AND d.understanding IS user_model.understanding)
+        WHERE id IN (SELECT MIN(id) FROM user_model
+                     GROUP BY aspect, understanding HAVING COUNT(*) > 1)
+        """,
+        """
+        DELETE FROM user_model WHERE id NOT IN (
+            SELECT MIN(id) FROM user_model GROUP BY aspect, understanding)
+        """,
+        "DROP INDEX IF EXISTS idx_learned_preferences_lookup",  # Superseded by the unique key
+        "CREATE UNIQUE INDEX uq_learned_preferences ON learned_preferences(preference_type, preference_value)",
+        "CREATE UNIQUE INDEX uq_conversation_patterns ON conversation_patterns(pattern_type, pattern_description)",
+        "CREATE UNIQUE INDEX uq_user_model ON user_model(aspect, understanding)",
+    ]),
+    (5, "full-text search", [_create_search_index]),
+    (6, "semantic memory index", [
+        # Maps rows of the vector matrix of each embedding space back to their memory
+        """
+        CREATE TABLE semantic_memories (
+            space TEXT NOT NULL,
+            row INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            ref INTEGER NOT NULL,
+            text TEXT,
+            PRIMARY KEY (space, row)
+        )
+        """,
+        "CREATE UNIQUE INDEX uq_semantic_memories_ref ON semantic_memories(space, source, ref)",
+    ]),
+    (7, "segmented journal", [
+        # journal becomes the offset index of the segment files; entry keeps a preview
+        "ALTER TABLE journal ADD COLUMN segment INTEGER",
+        "ALTER TABLE journal ADD COLUMN position INTEGER",
+        "ALTER TABLE journal ADD COLUMN size INTEGER",
+        # The journal feeds journal_fts itself from here on, with the full text
+        "DROP TRIGGER IF EXISTS journal_fts_insert",
+        "DROP TRIGGER IF EXISTS journal_fts_delete",
+        "DROP TRIGGER IF EXISTS journal_fts_update",
+        _segment_journal,
+    ]),
+    (8, "standalone journal search", [
+        # journal.entry is only a preview, so journal_fts keeps its own copy of the full
+        # text; an external-content index would reindex the previews on any rebuild
+        "DROP TABLE journal_fts",
+        "CREATE VIRTUAL TABLE journal_fts USING fts5(entry, tokenize='porter unicode61')",
+        "CREATE TRIGGER journal_fts_delete AFTER DELETE ON journal BEGIN "
+        "DELETE FROM journal_fts WHERE rowid = old.id; END",
+        _index_journal,
+    ]),
+]
+
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn=None):
+    """Apply pending migrations, each in its own transaction; returns the version reached"""
+    conn = conn or get_connection()
+    for version, name, steps in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+
+        conn.execute("BEGIN IMMEDIATE")  # Another process may be migrating too
+        try:
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"🗄️ Memory schema upgraded to v{version} ({name})")
+    return schema_version(conn)
+
+
+def ensure_schema():
+    """Create, seed and migrate the database once per process"""
+    with _schema_lock:
+        if not _schema_ready:
+            init_db()
+
+
 def init_db():
     """Initialize all database tables"""
-    conn = sqlite3.connect(DB_PATH)
+    global _schema_ready
+    conn = get_connection()
     c = conn.cursor()
     
     # Main interaction log
@@ -24,7 +363,7 @@ def init_db():
     )
     """)
     
-    # Activity monitoring
+    # Activity monitoring (moved onto interned names by migration 3)
     c.execute("""
     CREATE TABLE IF NOT EXISTS activity_log (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -121,29 +460,19 @@ def init_db():
             """, (trait, weight, datetime.now().isoformat(), "Initial setup"))
     
     conn.commit()
+    migrate(conn)
     conn.close()
+    _schema_ready = True
     print("🗄️ Luna's memory banks initialized")
 
 def record_activity(processes, window_title):
-    """Record user activity"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute("""
-    INSERT INTO activity_log (timestamp, processes, window_title)
-    VALUES (?, ?, ?)
-    """, (
-        datetime.now().isoformat(),
-        ", ".join(processes) if isinstance(processes, list) else str(processes),
-        window_title
-    ))
-    
-    conn.commit()
-    conn.close()
+    """Record user activity (buffered; reaches the table in batches)"""
+    from storage.activity_buffer import activity_recorder
+    activity_recorder.record(processes, window_title)
 
 def log_interaction(message, response):
     """Log a conversation interaction"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     
     c.execute("""
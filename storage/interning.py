@@ -0,0 +1,113 @@
+"""
+Dictionary tables for activity names
+Process names and window titles are stored once and referenced by id, so
+activity samples are a few integers and pattern counts are integer
+aggregation inside SQLite.
+"""
+
+CATEGORY_TERMS = [
+    ("coding", ("code", "python", "programming")),
+    ("browsing", ("chrome", "firefox", "browser")),
+    ("entertainment", ("music", "spotify", "youtube")),
+    ("communication", ("discord", "slack", "chat")),
+]
+
+# Keep IN (...) lists under SQLite's bound-variable limit
+_CHUNK = 500
+
+
+def categorize_window(window):
+    """Broad activity category for a window title"""
+    window_lower = window.lower()
+    for category, terms in CATEGORY_TERMS:
+        if any(term in window_lower for term in terms):
+            return category
+    return "work"
+
+
+def split_processes(processes):
+    """Process names from a list or a legacy ", "-joined string"""
+    if not processes:
+        return ()
+    if isinstance(processes, str):
+        processes = processes.split(", ")
+    return tuple(dict.fromkeys(name for name in processes if name))
+
+
+def _lookup(conn, table, column, values):
+    values = list(values)
+    ids = {}
+    for start in range(0, len(values), _CHUNK):
+        chunk = values[start:start + _CHUNK]
+        ids.update((value, row_id) for row_id, value in conn.execute(
+            f"SELECT id, {column} FROM {table} WHERE {column} IN ({','.join('?' * len(chunk))})", chunk
+        ))
+    return ids
+
+
+def intern_processes(conn, names):
+    """Ids for process names, adding new ones (call inside the writing transaction)"""
+    names = set(names)
+    conn.executemany("INSERT OR IGNORE INTO process_names (name) VALUES (?)", [(name,) for name in names])
+    return _lookup(conn, "process_names", "name", names)
+
+
+def intern_windows(conn, titles):
+    """Ids for window titles, adding new ones with their category"""
+    titles = set(titles)
+    conn.executemany(
+        "INSERT OR IGNORE INTO window_titles (title, category) VALUES (?, ?)",
+        [(title, categorize_window(title)) for title in titles]
+    )
+    return _lookup(conn, "window_titles", "title", titles)
+
+
+def insert_samples(conn, rows):
+    """Append (timestamp, process names, window title) samples; returns how many
+
+    Sample ids are assigned here so the process links can go in with one
+    executemany as well, which needs the write lock already held.
+    """
+    process_ids = intern_processes(conn, {name for _, names, _ in rows for name in names})
+    window_ids = intern_windows(conn, {window for _, _, window in rows if window})
+    next_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM activity_log").fetchone()[0]
+
+    samples, links = [], []
+    for sample_id, (timestamp, names, window) in enumerate(rows, next_id):
+        samples.append((sample_id, timestamp, window_ids.get(window)))
+        links.extend((sample_id, process_ids[name]) for name in names)
+
+    conn.executemany("INSERT INTO activity_log (id, timestamp, window_id) VALUES (?, ?, ?)", samples)
+    conn.executemany("INSERT INTO activity_processes (sample_id, process_id) VALUES (?, ?)", links)
+    return len(samples)
+
+
+def normalize_activity(conn):
+    """Migration step: copy text-based activity rows and rollups onto interned ids"""
+    old = conn.execute("SELECT id, timestamp, processes, window_title FROM activity_log ORDER BY id")
+    while True:
+        batch = old.fetchmany(5000)
+        if not batch:
+            break
+        process_ids = intern_processes(conn, {name for row in batch for name in split_processes(row[2])})
+        window_ids = intern_windows(conn, {row[3] for row in batch if row[3]})
+        conn.executemany(
+            "INSERT INTO activity_samples (id, timestamp, window_id) VALUES (?, ?, ?)",
+            [(row_id, timestamp, window_ids.get(window)) for row_id, timestamp, _, window in batch]
+        )
+        conn.executemany(
+            "INSERT INTO activity_processes (sample_id, process_id) VALUES (?, ?)",
+            [(row[0], process_ids[name]) for row in batch for name in split_processes(row[2])]
+        )
+
+    # Rollups: totals keep ref 0, names become ids, categories now come from window_titles
+    for table, column in (("activity_hourly", "hour"), ("activity_daily", "day")):
+        rows = conn.execute(f"SELECT {column}, kind, name, samples, seconds FROM {table}").fetchall()
+        process_ids = intern_processes(conn, {name for _, kind, name, _, _ in rows if kind == "process"})
+        window_ids = intern_windows(conn, {name for _, kind, name, _, _ in rows if kind == "window"})
+        refs = {"total": lambda name: 0, "process": process_ids.get, "window": window_ids.get}
+        conn.executemany(
+            f"INSERT INTO {table}_ids ({column}, kind, ref, samples, seconds) VALUES (?, ?, ?, ?, ?)",
+            [(key, kind, refs[kind](name), samples, seconds)
+             for key, kind, name, samples, seconds in rows if kind in refs]
+        )
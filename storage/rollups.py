@@ -0,0 +1,209 @@
+import os
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from storage.activity_buffer import activity_recorder
+from storage.db import get_connection
+from storage.interning import categorize_window
+
+# Raw samples are kept this long (hours) after being rolled up, then deleted
+RAW_RETENTION_HOURS = float(os.environ.get("LUNA_ACTIVITY_RAW_HOURS", 48))
+
+# Hourly rollups are kept this long (days); daily rollups are kept for good
+HOURLY_RETENTION_DAYS = float(os.environ.get("LUNA_ACTIVITY_HOURLY_DAYS", 30))
+
+# A sample counts as dwell time until the next one, but never longer than this (seconds)
+DWELL_CAP = float(os.environ.get("LUNA_ACTIVITY_DWELL_CAP", 300))
+
+# Rollup row kinds; ref is the process or window id (0 for totals).
+# Category counts come from window_titles.category, so they need no rows of their own.
+TOTAL = "total"
+PROCESS = "process"
+WINDOW = "window"
+
+
+def _hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def rolled_up_until(conn):
+    """ISO timestamp before which every raw sample is already in the rollups"""
+    row = conn.execute("SELECT value FROM rollup_state WHERE key = 'activity_watermark'").fetchone()
+    return row[0] if row else ""
+
+
+
+
+def _aggregate(samples, links, boundary):
+    """Bucket samples (id, timestamp, window_id) by hour and by day"""
+    hourly = defaultdict(lambda: [0, 0.0])
+    daily = defaultdict(lambda: [0, 0.0])
+
+    for i, (sample_id, timestamp, window_id) in enumerate(samples):
+        taken = datetime.fromisoformat(timestamp)
+        following = datetime.fromisoformat(samples[i + 1][1]) if i + 1 < len(samples) else boundary
+        dwell = max(0.0, min((following - taken).total_seconds(), DWELL_CAP))
+
+        refs = [(TOTAL, 0)] + [(PROCESS, process_id) for process_id in links.get(sample_id, ())]
+        if window_id is not None:
+            refs.append((WINDOW, window_id))
+
+        hour = taken.strftime("%Y-%m-%dT%H:00")
+        day = taken.date().isoformat()
+        for kind, ref in refs:
+            for buckets, key in ((hourly, hour), (daily, day)):
+                bucket = buckets[(key, kind, ref)]
+                bucket[0] += 1
+                bucket[1] += dwell
+    return hourly, daily
+
+
+def _next_hour(timestamp):
+    """Rollup key of the first hour starting after an ISO timestamp
+
+    Strictly after: a sample taken exactly at timestamp is in that hour's bucket.
+    """
+    return (_hour_start(datetime.fromisoformat(timestamp)) + timedelta(hours=1)).strftime("%Y-%m-%dT%H:00")
+
+
+def _first_id_after(c, timestamp, inclusive=False):
+    """Id of the first sample taken after timestamp, or at it if inclusive (ids grow with time)"""
+    c.execute(f"SELECT MIN(id) FROM activity_log WHERE timestamp {'>=' if inclusive else '>'} ?", (timestamp,))
+    first = c.fetchone()[0]
+    if first is None:
+        c.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM activity_log")
+        first = c.fetchone()[0]
+    return first
+
+
+def compact_activity(now=None):
+    """Roll completed hours of raw activity into the rollup tables and apply retention
+
+    Rolling up and advancing the watermark happen in one transaction, so
+    no sample is ever counted twice. Returns how many samples were rolled up.
+    """
+    now = now or datetime.now()
+    boundary = _hour_start(now)
+    activity_recorder.flush()  # Buffered samples must not slip behind the watermark
+
+    conn = get_connection()
+    c = conn.cursor()
+    watermark = rolled_up_until(conn)
+
+    c.execute("""
+    SELECT id, timestamp, window_id FROM activity_log
+    WHERE timestamp > ? AND timestamp <= ?
+    ORDER BY timestamp
+    """, (watermark, boundary.isoformat()))
+    samples = c.fetchall()
+
+    links = defaultdict(list)
+    if samples:
+        c.execute("""
+        SELECT sample_id, process_id FROM activity_processes
+        WHERE sample_id BETWEEN ? AND ?
+        """, (min(s[0] for s in samples), max(s[0] for s in samples)))
+        for sample_id, process_id in c.fetchall():
+            links[sample_id].append(process_id)
+
+    hourly, daily = _aggregate(samples, links, boundary)
+    for table, column, buckets in (("activity_hourly", "hour", hourly), ("activity_daily", "day", daily)):
+        c.executemany(f"""
+        INSERT INTO {table} ({column}, kind, ref, samples, seconds)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT ({column}, kind, ref) DO UPDATE SET
+            samples = samples + excluded.samples,
+            seconds = seconds + excluded.seconds
+        """, [(key, kind, ref, samples, seconds) for (key, kind, ref), (samples, seconds) in buckets.items()])
+
+    c.execute("""
+    INSERT INTO rollup_state (key, value) VALUES ('activity_watermark', ?)
+    ON CONFLICT (key) DO UPDATE SET value = excluded.value
+    """, (boundary.isoformat(),))
+
+    # Retention: raw samples only once they are rolled up, hourly buckets after a month
+    raw_cutoff = min(boundary, now - timedelta(hours=RAW_RETENTION_HOURS))
+    first_kept = _first_id_after(c, (raw_cutoff - timedelta(microseconds=1)).isoformat())
+    c.execute("DELETE FROM activity_processes WHERE sample_id < ?", (first_kept,))
+    c.execute("DELETE FROM activity_log WHERE id < ?", (first_kept,))
+    hourly_cutoff = (now - timedelta(days=HOURLY_RETENTION_DAYS)).strftime("%Y-%m-%dT%H:00")
+    c.execute("DELETE FROM activity_hourly WHERE hour < ?", (hourly_cutoff,))
+
+    conn.commit()
+    conn.close()
+    return len(samples)
+
+
+def activity_totals(since):
+    """Sample counts per process and per category since an ISO timestamp
+
+    Whole hours come from the hourly rollups, and the rest of the hour
+    since falls in plus the samples after the watermark from the raw
+    tables, summed by id inside SQLite; only still-buffered samples are
+    counted here. Once the raw samples of since's hour are gone, that
+    whole hour counts. Returns
+    (process_counts, category_counts, total_samples).
+    """
+    with activity_recorder.holding_flushes():
+        processes, categories, total = _stored_totals(since)
+        for timestamp, names, window in activity_recorder.buffered():
+            if timestamp > since:
+                total += 1
+                processes.update(names)
+                if window:
+                    categories[categorize_window(window)] += 1
+
+    return processes, categories, total
+
+
+def _stored_totals(since):
+    conn = get_connection()
+    c = conn.cursor()
+    watermark = rolled_up_until(conn)
+    tail = _first_id_after(c, max(since, watermark))
+
+    c.execute("SELECT MIN(timestamp) FROM activity_log")
+    oldest = c.fetchone()[0]
+    if oldest is not None and oldest <= since:
+        # Raw samples still cover since: they fill in its hour up to the first whole one
+        first_hour = _next_hour(since)
+        head = (_first_id_after(c, since), min(_first_id_after(c, first_hour, inclusive=True), tail))
+    else:
+        first_hour = since[:13] + ":00"
+        head = (tail, tail)
+    hours = (first_hour, watermark)
+    raw = head + (tail,)
+
+    c.execute("""
+    SELECT p.name, SUM(counts.samples) FROM (
+        SELECT ref AS process_id, samples FROM activity_hourly
+        WHERE kind = 'process' AND hour >= ? AND hour < ?
+        UNION ALL
+        SELECT process_id, 1 FROM activity_processes
+        WHERE (sample_id >= ? AND sample_id < ?) OR sample_id >= ?
+    ) counts
+    JOIN process_names p ON p.id = counts.process_id
+    GROUP BY counts.process_id
+    """, hours + raw)
+    processes = Counter(dict(c.fetchall()))
+
+    c.execute("""
+    SELECT w.category, SUM(counts.samples) FROM (
+        SELECT ref AS window_id, samples FROM activity_hourly
+        WHERE kind = 'window' AND hour >= ? AND hour < ?
+        UNION ALL
+        SELECT window_id, 1 FROM activity_log WHERE (id >= ? AND id < ?) OR id >= ?
+    ) counts
+    JOIN window_titles w ON w.id = counts.window_id
+    GROUP BY w.category
+    """, hours + raw)
+    categories = Counter(dict(c.fetchall()))
+
+    c.execute("""
+    SELECT (SELECT COALESCE(SUM(samples), 0) FROM activity_hourly
+            WHERE kind = 'total' AND hour >= ? AND hour < ?)
+         + (SELECT COUNT(*) FROM activity_log WHERE (id >= ? AND id < ?) OR id >= ?)
+    """, hours + raw)
+    total = c.fetchone()[0]
+    conn.close()
+    return processes, categories, total
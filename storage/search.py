@@ -0,0 +1,108 @@
+"""
+Full-text search over Luna's past conversations, reflections and journal
+Each source table has an external-content FTS5 index kept in sync by
+triggers, so the text is stored once and every write is indexed as it
+happens. Results from all sources are ranked together by bm25.
+The journal table only keeps previews (the text lives in memory.journal
+segments), so journal_fts is a standalone index holding its own copy of
+each entry, written by Journal.append and cleared by a delete trigger.
+"""
+import re
+
+from storage.db import get_connection
+
+# source table -> indexed text columns
+SEARCH_SOURCES = {
+    "interactions": ("message", "response"),
+    "reflections": ("reflection_content",),
+    "journal": ("entry",),
+}
+
+# Words too common to say anything about relevance
+STOP_WORDS = frozenset("""
+a an and are as at be but by can do for from had has have he her him his how i if in into is
+it its just me my no not of on or our she so that the their them then there they this to too
+was we were what when where which who why will with you your
+""".split())
+
+# Longer inputs only keep their first distinct terms
+MAX_TERMS = 12
+
+
+def _fts(table):
+    return f"{table}_fts"
+
+
+def _index_steps(table, columns):
+    fts = _fts(table)
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    delete = f"INSERT INTO {fts} ({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    insert = f"INSERT INTO {fts} (rowid, {names}) VALUES (new.id, {new});"
+    return [
+        f"""
+        CREATE VIRTUAL TABLE {fts} USING fts5(
+            {names}, content='{table}', content_rowid='id', tokenize='porter unicode61'
+        )
+        """,
+        f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER {fts}_update AFTER UPDATE ON {table} BEGIN {delete} {insert} END",
+        f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')",  # Index what is already there
+    ]
+
+
+def create_search_index(conn):
+    """Migration step: build the FTS5 indexes and their sync triggers"""
+    for table, columns in SEARCH_SOURCES.items():
+        for step in _index_steps(table, columns):
+            conn.execute(step)
+
+
+def match_query(text):
+    """FTS5 query matching any meaningful word of free text, or None if there is none
+
+    Words are quoted, so user input can never be read as query syntax.
+    """
+    terms = [
+        word for word in re.findall(r"\w+", (text or "").lower())
+        if len(word) > 1 and word not in STOP_WORDS
+    ]
+    terms = list(dict.fromkeys(terms))[:MAX_TERMS]
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def search(text, sources=None, limit=5, since=None):
+    """Past entries most relevant to free text, best first
+
+    Rows are (source, id, timestamp, snippet, score); a lower score is a
+    better match. sources narrows the tables searched, since (an ISO
+    timestamp) drops older entries.
+    """
+    query = match_query(text)
+    if query is None or limit <= 0:
+        return []
+
+    conn = get_connection()
+    c = conn.cursor()
+    results = []
+    for table in sources or SEARCH_SOURCES:
+        if table not in SEARCH_SOURCES:
+            raise ValueError(f"Unknown search source: {table}")
+        fts = _fts(table)
+        where, params = ("AND t.timestamp >= ?", [query, since]) if since else ("", [query])
+        c.execute(f"""
+        SELECT '{table}', t.id, t.timestamp, snippet({fts}, -1, '', '', '…', 24), bm25({fts})
+        FROM {fts} JOIN {table} t ON t.id = {fts}.rowid
+        WHERE {fts} MATCH ? {where}
+        ORDER BY bm25({fts})
+        LIMIT ?
+        """, params + [limit])
+        results.extend(c.fetchall())
+    conn.close()
+
+    results.sort(key=lambda row: row[4])
+    return results[:limit]
@@ -0,0 +1,107 @@
+import threading
+import time
+import unittest
+
+from core.background import BLOCK, DROP_NEW, DROP_OLDEST, BackgroundJobs
+
+
+class BackgroundJobsTest(unittest.TestCase):
+    """Overflow policies, key coalescing and draining"""
+
+    def setUp(self):
+        self.jobs = BackgroundJobs(workers=1, max_pending=2, name="test-bg")
+        self.ran = []
+        self.release = threading.Event()
+        started = threading.Event()
+
+        def blocker():
+            started.set()
+            self.release.wait(5)
+
+        # Hold the only worker so later submissions stay queued
+        self.jobs.submit(blocker)
+        started.wait(5)
+
+    def tearDown(self):
+        self.release.set()
+        self.jobs.drain(5)
+
+    def record(self, name):
+        self.ran.append(name)
+
+    def fill(self):
+        self.assertTrue(self.jobs.submit(self.record, "a"))
+        self.assertTrue(self.jobs.submit(self.record, "b"))
+
+    def finish(self):
+        self.release.set()
+        self.assertTrue(self.jobs.wait_idle(5))
+
+    def test_drop_new_refuses_the_incoming_job(self):
+        self.fill()
+        self.assertFalse(self.jobs.submit(self.record, "c", policy=DROP_NEW))
+        self.finish()
+        self.assertEqual(self.ran, ["a", "b"])
+        self.assertEqual(self.jobs.stats()["dropped"], 1)
+
+    def test_drop_oldest_evicts_the_oldest_pending_job(self):
+        self.fill()
+        self.assertTrue(self.jobs.submit(self.record, "c", policy=DROP_OLDEST))
+        self.finish()
+        self.assertEqual(self.ran, ["b", "c"])
+        self.assertEqual(self.jobs.stats()["dropped"], 1)
+
+    def test_block_waits_for_room(self):
+        self.fill()
+        self.assertFalse(self.jobs.submit(self.record, "late", policy=BLOCK, timeout=0.1))
+
+        submitted = []
+        waiter = threading.Thread(target=lambda: submitted.append(self.jobs.submit(self.record, "c", policy=BLOCK)))
+        waiter.start()
+        time.sleep(0.1)
+        self.assertEqual(submitted, [])  # Still waiting: the queue is full
+        self.release.set()
+        waiter.join(5)
+        self.finish()
+
+        self.assertEqual(submitted, [True])
+        self.assertEqual(self.ran, ["a", "b", "c"])
+        self.assertEqual(self.jobs.stats()["dropped"], 1)
+
+    def test_repeated_key_coalesces(self):
+        owner = object()
+        key = ("reflection_batch", id(owner))
+        self.assertTrue(self.jobs.submit(self.record, "first", key=key))
+        self.assertTrue(self.jobs.submit(self.record, "second", key=key))
+        self.assertTrue(self.jobs.submit(self.record, "other"))
+        self.finish()
+
+        self.assertEqual(self.ran, ["second", "other"])
+        self.assertEqual(self.jobs.stats()["coalesced"], 1)
+
+        # Once the keyed job has run, the key queues again
+        self.assertTrue(self.jobs.submit(self.record, "third", key=key))
+        self.assertTrue(self.jobs.wait_idle(5))
+        self.assertEqual(self.ran[-1], "third")
+
+    def test_drain_finishes_queued_jobs_then_refuses_more(self):
+        self.fill()
+        threading.Timer(0.1, self.release.set).start()
+        self.assertTrue(self.jobs.drain(5))
+
+        self.assertEqual(self.ran, ["a", "b"])
+        self.assertFalse(self.jobs.submit(self.record, "after"))
+        self.assertEqual(self.jobs.stats()["completed"], 3)
+
+    def test_drain_timeout_drops_what_is_left(self):
+        self.fill()
+        self.assertFalse(self.jobs.drain(0.1))
+        self.release.set()
+        self.assertTrue(self.jobs.wait_idle(5))
+
+        self.assertEqual(self.ran, [])
+        self.assertEqual(self.jobs.stats()["dropped"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
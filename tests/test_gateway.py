@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from core import llm
+from core.async_llm import ThreadedBackend
+from core.fake_backend import FakeBackend
+from core.gateway import INTERACTIVE, PING, REFLECTION, SYNTHESIS, GatewayCancelled, ModelGateway
+
+
+class RecordingBackend(FakeBackend):
+    """Fake model that records the order calls start in and how many overlap"""
+
+    def __init__(self, latency):
+        super().__init__(first_token_latency=latency)
+        self.started = []
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, timeout=30, options=None, format=None):
+        with self._lock:
+            self.started.append(prompt)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            return super().generate(prompt, timeout=timeout, options=options, format=format)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+class GatewayTest(unittest.TestCase):
+    """Priorities, the interactive grace hold, cancellation and the in-flight limit"""
+
+    def gateway(self, latency=0.2, **kwargs):
+        self.backend = RecordingBackend(latency)
+        kwargs.setdefault("interactive_grace", 0)
+        return ModelGateway(client=self.backend, async_client=ThreadedBackend(self.backend), **kwargs)
+
+    def call(self, gateway, prompt, priority, timeout=10):
+        """Start a generate on its own thread; returns (thread, outcome dict)"""
+        outcome = {}
+
+        def run():
+            try:
+                outcome["response"] = gateway.generate(prompt, timeout=timeout, priority=priority)
+            except llm.OllamaError as e:
+                outcome["error"] = e
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(0.05)  # Let it reach the gateway before the next call
+        return thread, outcome
+
+    def test_interactive_goes_ahead_of_queued_background_work(self):
+        gateway = self.gateway()
+        calls = [
+            self.call(gateway, "ping", PING),  # Takes the only slot
+            self.call(gateway, "reflection", REFLECTION),
+            self.call(gateway, "chat", INTERACTIVE),
+        ]
+        for thread, _ in calls:
+            thread.join()
+        self.assertEqual(self.backend.started, ["ping", "chat", "reflection"])
+
+    def test_grace_hold_delays_background_work(self):
+        gateway = self.gateway(latency=0, interactive_grace=0.5)
+        gateway.generate("chat", priority=INTERACTIVE)
+        finished = time.monotonic()
+        gateway.generate("reflection", priority=REFLECTION)
+        self.assertGreaterEqual(time.monotonic() - finished, 0.4)
+        self.assertGreaterEqual(gateway.stats()["reflection"]["max_wait"], 0.4)
+
+        # Pings are not background work and go straight through
+        started = time.monotonic()
+        gateway.generate("chat", priority=INTERACTIVE)
+        gateway.generate("ping", priority=PING)
+        self.assertLess(time.monotonic() - started, 0.3)
+
+    def test_interactive_cancels_queued_synthesis(self):
+        gateway = self.gateway()
+        ping, _ = self.call(gateway, "ping", PING)
+        synthesis, outcome = self.call(gateway, "synthesis", SYNTHESIS)
+        chat, _ = self.call(gateway, "chat", INTERACTIVE)
+        for thread in (ping, synthesis, chat):
+            thread.join()
+
+        self.assertIsInstance(outcome.get("error"), GatewayCancelled)
+        self.assertEqual(self.backend.started, ["ping", "chat"])
+        self.assertEqual(gateway.stats()["synthesis"]["cancelled"], 1)
+
+    def test_running_synthesis_finishes_before_interactive(self):
+        # A request already sent to the model is not interrupted; the user waits for the slot
+        gateway = self.gateway()
+        synthesis, outcome = self.call(gateway, "synthesis", SYNTHESIS)
+        chat, _ = self.call(gateway, "chat", INTERACTIVE)
+        synthesis.join()
+        chat.join()
+
+        self.assertIn("response", outcome)
+        self.assertEqual(self.backend.started, ["synthesis", "chat"])
+        self.assertGreater(gateway.stats()["interactive"]["max_wait"], 0.05)
+
+    def test_max_in_flight_is_respected(self):
+        gateway = self.gateway(latency=0.1, max_in_flight=2)
+        threads = [self.call(gateway, f"ping {i}", PING)[0] for i in range(5)]
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.backend.peak, 2)
+        self.assertEqual(len(self.backend.started), 5)
+
+    def test_queue_timeout_is_counted(self):
+        gateway = self.gateway(latency=0.5)
+        ping, _ = self.call(gateway, "ping", PING)
+        with self.assertRaises(llm.OllamaTimeout):
+            gateway.generate("reflection", timeout=0.1, priority=REFLECTION)
+        ping.join()
+
+        stats = gateway.stats()
+        self.assertEqual(stats["reflection"]["timed_out"], 1)
+        self.assertEqual(stats["reflection"]["served"], 0)
+        self.assertEqual(stats["ping"]["served"], 1)
+
+    def test_stats_count_every_class(self):
+        gateway = self.gateway(latency=0)
+        for priority in (INTERACTIVE, INTERACTIVE, PING, REFLECTION):
+            gateway.generate("hello", priority=priority)
+
+        stats = gateway.stats()
+        self.assertEqual(stats["interactive"]["served"], 2)
+        self.assertEqual(stats["ping"]["served"], 1)
+        self.assertEqual(stats["reflection"]["served"], 1)
+        self.assertEqual(stats["synthesis"]["served"], 0)
+        for counts in stats.values():
+            self.assertEqual((counts["waiting"], counts["in_flight"]), (0, 0))
+
+    def test_async_interactive_shares_the_queue(self):
+        gateway = self.gateway()
+        ping, _ = self.call(gateway, "ping", PING)
+        reflection, _ = self.call(gateway, "reflection", REFLECTION)
+
+        async def chat():
+            return await gateway.generate_async("chat", priority=INTERACTIVE)
+
+        self.assertTrue(asyncio.run(chat()))
+        ping.join()
+        reflection.join()
+        self.assertEqual(self.backend.started, ["ping", "chat", "reflection"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from core import agent
+from memory.journal import Journal, segment_journal
+from storage import db
+from storage.search import search
+
+_cwd = os.getcwd()
+_tmp = None
+
+
+def setUpModule():
+    global _tmp
+    _tmp = tempfile.TemporaryDirectory()
+    os.chdir(_tmp.name)  # Storage paths are relative to the working directory
+    os.makedirs(db.STORAGE_DIR)
+    db.close_connections()
+    db.init_db()
+
+
+def tearDownModule():
+    db.close_connections()
+    os.chdir(_cwd)
+    _tmp.cleanup()
+
+
+class JournalSearchTest(unittest.TestCase):
+    """journal_fts holds the full text even though the table keeps previews"""
+
+    def setUp(self):
+        self.journal = Journal()
+        self.entry_id = self.journal.append(
+            "Tonight the user hummed along to the fans. " * 40 + "The last word was axolotl."
+        )
+
+    def tearDown(self):
+        self.journal.close()
+
+    def test_rebuild_keeps_the_full_text(self):
+        conn = db.get_connection()
+        conn.execute("INSERT INTO journal_fts (journal_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO journal_fts (journal_fts) VALUES ('integrity-check')")
+        conn.commit()
+        conn.close()
+
+        results = search("axolotl", sources=["journal"])
+        self.assertEqual([row[1] for row in results], [self.entry_id])
+        self.assertIn("axolotl", results[0][3])
+
+    def test_deleting_an_entry_removes_it_from_search(self):
+        conn = db.get_connection()
+        conn.execute("DELETE FROM journal WHERE id = ?", (self.entry_id,))
+        conn.commit()
+        left = conn.execute("SELECT COUNT(*) FROM journal_fts WHERE rowid = ?", (self.entry_id,)).fetchone()[0]
+        conn.close()
+
+        self.assertEqual(left, 0)
+        self.assertEqual(search("axolotl", sources=["journal"]), [])
+
+
+class RolledBackWriteTest(unittest.TestCase):
+    """Bytes written by a transaction that rolled back are written over, never duplicated"""
+
+    def setUp(self):
+        self.journal = Journal()
+
+    def tearDown(self):
+        self.journal.close()
+
+    def tail_size(self):
+        conn = db.get_connection()
+        segment = conn.execute("SELECT MAX(segment) FROM journal").fetchone()[0]
+        conn.close()
+        return os.path.getsize(self.journal._path(segment))
+
+    def test_append_after_a_rollback_takes_its_place(self):
+        self.journal.append("Anchoring the tail.")
+        conn = db.get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        orphan = self.journal.write(conn, "This entry never made it into the index.")
+        conn.rollback()
+        conn.close()
+
+        entry_id = self.journal.append("This one did.")
+        conn = db.get_connection()
+        location = conn.execute("SELECT segment, position FROM journal WHERE id = ?", (entry_id,)).fetchone()
+        conn.close()
+        self.assertEqual(location, orphan[:2])
+        self.assertEqual(self.journal.latest(1)[0].text, "This one did.")
+
+    def test_retried_segment_migration_writes_each_entry_once(self):
+        texts = [f"Legacy entry {i}: the user talked to their plants again." for i in range(5)]
+        conn = db.get_connection()
+        conn.executemany("INSERT INTO journal (timestamp, entry) VALUES ('2024-01-01T00:00:00', ?)",
+                         [(text,) for text in texts])
+        conn.commit()
+
+        conn.execute("BEGIN IMMEDIATE")
+        segment_journal(conn)
+        conn.rollback()  # The migration failed after the step ran
+        size = self.tail_size()
+
+        conn.execute("BEGIN IMMEDIATE")
+        segment_journal(conn)
+        conn.commit()
+        conn.close()
+
+        self.assertEqual(self.tail_size(), size)
+        legacy = self.journal.between(since="2024-01-01", until="2024-01-02")
+        self.assertEqual([entry.text for entry in legacy], texts)
+
+
+class DailyReflectionTest(unittest.TestCase):
+    """A rerun of the daily reflection that gets the cached answer back journals it once"""
+
+    def setUp(self):
+        self.journal = Journal()
+        with mock.patch.object(agent, "start_model_keeper"), redirect_stdout(io.StringIO()):
+            self.luna = agent.LunaAgent()
+
+    def tearDown(self):
+        self.journal.close()
+
+    def reflect(self, answer):
+        with mock.patch.object(agent, "journal", self.journal), \
+                mock.patch.object(self.luna, "safe_subprocess_call", return_value=answer), \
+                redirect_stdout(io.StringIO()):
+            return self.luna.daily_self_reflection()
+
+    def entries(self):
+        conn = db.get_connection()
+        count = conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+        conn.close()
+        return count
+
+    def test_rerun_does_not_duplicate_the_entry(self):
+        before = self.entries()
+        self.assertEqual(self.reflect("Today I learned the user fears geese."), "Today I learned the user fears geese.")
+        self.assertEqual(self.reflect("Today I learned the user fears geese."), "Today I learned the user fears geese.")
+        self.assertEqual(self.entries(), before + 1)
+
+        self.reflect("Today the geese won.")
+        self.assertEqual(self.entries(), before + 2)
+        self.assertEqual(self.journal.latest(1)[0].text, "Today the geese won.")
+
+    def test_glitch_is_not_journaled(self):
+        before = self.entries()
+        self.reflect("[consciousness timeout - Luna is processing deeply]")
+        self.assertEqual(self.entries(), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from core.json_stream import JSONStreamExtractor, extract_json, strip_trailing_commas
+
+# (name, chunks fed in order, expected result())
+EXTRACTOR_CASES = [
+    ("plain object", ['{"mood": "chaotic"}'], {"mood": "chaotic"}),
+    ("prose around the object", ['Sure! Here you go: {"a": 1} Hope that helps {"b": 2}'], {"a": 1}),
+    ("markdown fence", ['```json\n{"a": [1, 2]}\n```'], {"a": [1, 2]}),
+    ("split into tokens", ['{"an', 'alysis": "fi', 'ne", "n": ', "3", "}"], {"analysis": "fine", "n": 3}),
+    ("braces inside strings", ['{"text": "a } and a { and ]"}'], {"text": "a } and a { and ]"}),
+    ("escaped quotes", [r'{"quote": "she said \"hi\" }"}'], {"quote": 'she said "hi" }'}),
+    ("trailing commas", ['{"a": [1, 2,], "b": {"c": 3,},}'], {"a": [1, 2], "b": {"c": 3}}),
+    ("unicode", ['{"glyph": "⛧ 🌙"}'], {"glyph": "⛧ 🌙"}),
+    ("object inside an array", ['[1, {"a": 1}]'], {"a": 1}),
+    ("stray closer before the object", ['} ] {"a": 1}'], {"a": 1}),
+    ("truncated mid-string", ['{"a": 1, "b": "half a thou'], {"a": 1, "b": "half a thou"}),
+    ("truncated after a comma", ['{"a": {"b": 1,'], {"a": {"b": 1}}),
+    ("truncated inside an array", ['{"items": ["x", "y"'], {"items": ["x", "y"]}),
+    ("truncated after a key", ['{"a": 1, "b":'], None),
+    ("truncated after an escape", ['{"a": "line\\'], None),
+    ("mismatched brackets", ['{"a": [1}'], None),
+    ("no object at all", ["I would rather not answer in JSON."], None),
+    ("empty stream", [], None),
+    ("invalid literal", ['{"a": nope}'], None),
+]
+
+
+class JSONStreamExtractorTest(unittest.TestCase):
+    """Odd but plausible model output never raises, and yields the object when there is one"""
+
+    def test_cases(self):
+        for name, chunks, expected in EXTRACTOR_CASES:
+            with self.subTest(name):
+                extractor = JSONStreamExtractor()
+                for chunk in chunks:
+                    extractor.feed(chunk)
+                self.assertEqual(extractor.result(), expected)
+
+    def test_cases_fed_one_character_at_a_time(self):
+        for name, chunks, expected in EXTRACTOR_CASES:
+            with self.subTest(name):
+                extractor = JSONStreamExtractor()
+                for ch in "".join(chunks):
+                    extractor.feed(ch)
+                self.assertEqual(extractor.result(), expected)
+
+    def test_feed_reports_the_moment_the_object_closes(self):
+        extractor = JSONStreamExtractor()
+        tokens = ['Thinking... {"a"', ": {", '"b": 1', "}", "}", " and then a long epilogue", "..."]
+        closed_at = next(i for i, token in enumerate(tokens) if extractor.feed(token))
+        self.assertEqual(closed_at, 4)
+        self.assertTrue(extractor.complete)
+        self.assertTrue(extractor.feed("more chatter"))  # Stays complete
+        self.assertEqual(extractor.result(), {"a": {"b": 1}})
+
+    def test_extract_json_accepts_nothing(self):
+        self.assertIsNone(extract_json(None))
+        self.assertIsNone(extract_json(""))
+
+    def test_strip_trailing_commas_leaves_strings_alone(self):
+        self.assertEqual(strip_trailing_commas('{"a": ",}", "b": [1,],}'), '{"a": ",}", "b": [1]}')
+
+
+if __name__ == "__main__":
+    unittest.main()
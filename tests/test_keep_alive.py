@@ -0,0 +1,75 @@
+import asyncio
+import io
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from core import llm
+from core.async_llm import AsyncOllamaClient
+from core.fake_backend import FakeBackend
+from core.ollama_stub import StubOllamaServer
+from core.warmup import ModelKeeper
+
+AWAKE = datetime(2025, 1, 1, 12, 0)
+ASLEEP = datetime(2025, 1, 1, 3, 0)
+
+
+class KeepAliveTest(unittest.TestCase):
+    """Every request carries the keeper's keep_alive while Luna is awake"""
+
+    def setUp(self):
+        self.server = StubOllamaServer().start()
+        self.client = llm.OllamaClient(host=self.server.address)
+        self.keeper = ModelKeeper(backend=self.client, keep_alive="15m", embed_model=llm.EMBED_MODEL)
+
+    def tearDown(self):
+        llm.set_keep_alive(None)
+        self.client.close()
+        self.server.stop()
+
+    def test_awake_requests_keep_the_model_resident(self):
+        self.assertTrue(self.keeper.hold(AWAKE))
+        self.keeper.warm_now()
+        self.client.generate("Hello Luna")
+        list(self.client.stream("Tell me something"))
+
+        async def talk():
+            client = AsyncOllamaClient(host=self.server.address)
+            await client.generate("Hello again")
+            [token async for token in client.stream("And again")]
+            await client.close()
+
+        asyncio.run(talk())
+        self.assertEqual(self.server.keep_alives, ["15m"] * 6)
+
+    def test_asleep_requests_use_the_server_default(self):
+        self.assertFalse(self.keeper.hold(ASLEEP))
+        self.client.generate("Hello Luna")
+        list(self.client.stream("Tell me something"))
+        self.assertEqual(self.server.keep_alives, [None, None])
+
+
+class NoEmbeddingModel(FakeBackend):
+    """A server that has the chat model but not the embedding model"""
+
+    def warm_embeddings(self, keep_alive="15m", timeout=120, model=None):
+        raise llm.OllamaError(f"model '{model}' not found")
+
+
+class ModelKeeperTest(unittest.TestCase):
+    """The chat model's warm-up status does not depend on the embedding model"""
+
+    def test_missing_embedding_model_leaves_the_chat_model_warm(self):
+        keeper = ModelKeeper(backend=NoEmbeddingModel(), embed_model="missing-embed")
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            self.assertTrue(keeper.warm_now())
+            self.assertTrue(keeper.warm_now())
+        self.assertTrue(keeper.warm)
+        self.assertIs(keeper.embeddings_warm, False)
+        self.assertEqual(stdout.getvalue().count("[Embedding warm-up glitch]"), 1)
+        self.assertNotIn("[Warm-up glitch]", stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
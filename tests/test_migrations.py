@@ -0,0 +1,149 @@
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from memory.journal import Journal
+from storage import db
+from storage.search import search
+
+_cwd = os.getcwd()
+_tmp = None
+
+ACTIVITY = [
+    ("2025-03-01T10:00:00", "code.exe, chrome.exe", "main.py - Visual Studio Code"),
+    ("2025-03-01T10:01:00", "chrome.exe", "YouTube - Google Chrome"),
+    ("2025-03-01T10:02:00", "", None),
+    ("2025-03-01T10:03:00", "code.exe, code.exe", "main.py - Visual Studio Code"),
+]
+
+
+def setUpModule():
+    """A database at the baseline schema, with the rows older versions let pile up"""
+    global _tmp
+    _tmp = tempfile.TemporaryDirectory()
+    os.chdir(_tmp.name)  # Storage paths are relative to the working directory
+    os.makedirs(db.STORAGE_DIR)
+    db.close_connections()
+
+    with mock.patch.object(db, "MIGRATIONS", []), redirect_stdout(io.StringIO()):
+        db.init_db()
+    db._schema_ready = False
+
+    conn = db.get_connection()
+    conn.executemany(
+        "INSERT INTO learned_preferences (preference_type, preference_value, confidence_score, "
+        "last_observed, observation_count) VALUES (?, ?, ?, ?, ?)", [
+            ("humor", "dry sarcasm", 0.4, "2025-01-01T09:00:00", 1),
+            ("music", "lofi beats", 0.5, "2025-01-02T09:00:00", 1),
+            ("humor", "dry sarcasm", 0.8, "2025-02-01T09:00:00", 3),
+        ])
+    conn.executemany(
+        "INSERT INTO conversation_patterns (pattern_type, pattern_description, effectiveness_score, "
+        "last_used, usage_count) VALUES (?, ?, ?, ?, ?)", [
+            ("joke", "roast their code", 0.2, "2025-01-01T09:00:00", 0),
+            ("joke", "roast their code", 0.6, "2025-01-05T09:00:00", 2),
+        ])
+    conn.executemany(
+        "INSERT INTO user_model (aspect, understanding, confidence, last_updated) VALUES (?, ?, ?, ?)", [
+            ("schedule", "a night owl", 0.3, "2025-01-03T09:00:00"),
+            ("schedule", "a night owl", 0.7, "2025-01-01T09:00:00"),
+        ])
+    conn.executemany("INSERT INTO activity_log (timestamp, processes, window_title) VALUES (?, ?, ?)", ACTIVITY)
+    conn.execute("INSERT INTO journal (timestamp, entry) VALUES (?, ?)",
+                 ("2025-03-01T23:00:00", "The user named their sourdough starter Gregory."))
+    conn.commit()
+    conn.close()
+
+
+def tearDownModule():
+    db.close_connections()
+    os.chdir(_cwd)
+    _tmp.cleanup()
+
+
+class MigrationTest(unittest.TestCase):
+    """Every migration runs in order on a baseline database and keeps its data"""
+
+    @classmethod
+    def setUpClass(cls):
+        with redirect_stdout(io.StringIO()):
+            db.ensure_schema()
+        cls.conn = db.get_connection()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def test_reaches_the_latest_version(self):
+        self.assertEqual(db.schema_version(self.conn), 8)
+        self.assertEqual(db.schema_version(self.conn), db.MIGRATIONS[-1][0])
+        with redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(db.migrate(self.conn), 8)
+        self.assertEqual(out.getvalue(), "")  # Nothing left to apply
+
+    def test_duplicate_preferences_are_merged(self):
+        rows = self.conn.execute("""
+        SELECT id, preference_type, preference_value, confidence_score, last_observed, observation_count
+        FROM learned_preferences ORDER BY id
+        """).fetchall()
+        self.assertEqual(len(rows), 2)
+        humor = rows[0]
+        self.assertEqual(humor[:3], (1, "humor", "dry sarcasm"))  # The oldest row survives
+        self.assertAlmostEqual(humor[3], (0.4 * 1 + 0.8 * 3) / 4)
+        self.assertEqual(humor[4:], ("2025-02-01T09:00:00", 4))
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.conn.execute("INSERT INTO learned_preferences (preference_type, preference_value) "
+                              "VALUES ('humor', 'dry sarcasm')")
+        self.conn.rollback()
+
+    def test_duplicate_patterns_and_user_model_are_merged(self):
+        patterns = self.conn.execute(
+            "SELECT effectiveness_score, usage_count, last_used FROM conversation_patterns").fetchall()
+        self.assertEqual(len(patterns), 1)
+        self.assertAlmostEqual(patterns[0][0], (0.2 * 1 + 0.6 * 2) / 3)
+        self.assertEqual(patterns[0][1:], (2, "2025-01-05T09:00:00"))
+
+        model = self.conn.execute("SELECT confidence, last_updated FROM user_model").fetchall()
+        self.assertEqual(model, [(0.7, "2025-01-03T09:00:00")])
+
+    def test_interned_activity_round_trips(self):
+        samples = self.conn.execute("""
+        SELECT s.timestamp, w.title,
+               (SELECT GROUP_CONCAT(name, ', ') FROM (
+                    SELECT p.name FROM activity_processes ap JOIN process_names p ON p.id = ap.process_id
+                    WHERE ap.sample_id = s.id ORDER BY p.name))
+        FROM activity_log s LEFT JOIN window_titles w ON w.id = s.window_id
+        ORDER BY s.id
+        """).fetchall()
+        self.assertEqual(samples, [
+            ("2025-03-01T10:00:00", "main.py - Visual Studio Code", "chrome.exe, code.exe"),
+            ("2025-03-01T10:01:00", "YouTube - Google Chrome", "chrome.exe"),
+            ("2025-03-01T10:02:00", None, None),
+            ("2025-03-01T10:03:00", "main.py - Visual Studio Code", "code.exe"),
+        ])
+
+        names = self.conn.execute("SELECT name FROM process_names ORDER BY name").fetchall()
+        self.assertEqual(names, [("chrome.exe",), ("code.exe",)])
+        categories = dict(self.conn.execute("SELECT title, category FROM window_titles"))
+        self.assertEqual(categories, {"main.py - Visual Studio Code": "coding",
+                                      "YouTube - Google Chrome": "browsing"})
+
+    def test_journal_moves_into_segments_and_stays_searchable(self):
+        segments = self.conn.execute("SELECT segment, position FROM journal").fetchall()
+        self.assertEqual(segments, [(1, 0)])
+        journal = Journal()
+        try:
+            entry = journal.latest(1)[0]
+            self.assertEqual(entry.text, "The user named their sourdough starter Gregory.")
+        finally:
+            journal.close()
+        self.assertEqual([row[1] for row in search("sourdough", sources=["journal"])], [entry.id])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import io
+import time
+import unittest
+from contextlib import redirect_stderr
+
+from core import llm
+from core.ollama_stub import StubOllamaServer
+
+
+class StubStreamTest(unittest.TestCase):
+    """The stub server copes with clients that stop reading mid-reply"""
+
+    def test_client_closing_a_stream_early_leaves_stderr_clean(self):
+        reply = " ".join(f"word{i}" for i in range(400))
+        stderr = io.StringIO()
+        with redirect_stderr(stderr), StubOllamaServer(lambda prompt: reply, token_delay=0.002) as server:
+            client = llm.OllamaClient(host=server.address)
+            tokens = client.stream("Talk for a while")
+            self.assertEqual(next(tokens), "word0 ")
+            tokens.close()  # Drops the connection, as the early-stop paths do
+
+            waited = 0.0
+            while not server.streams_cut and waited < 5:
+                time.sleep(0.05)
+                waited += 0.05
+            self.assertEqual(server.streams_cut, 1)
+            time.sleep(0.1)  # Let the handler thread finish the request
+            client.close()
+
+        self.assertEqual(stderr.getvalue(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import io
+import os
+import tempfile
+import unittest
+from collections import Counter
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from unittest import mock
+
+from storage import db, rollups
+from storage.interning import categorize_window, insert_samples
+from storage.rollups import activity_totals, compact_activity, rolled_up_until
+
+_cwd = os.getcwd()
+_tmp = None
+
+START = datetime(2025, 3, 1, 9, 0)
+WINDOWS = ["main.py - Visual Studio Code", "YouTube - Google Chrome", "#general - Discord", None]
+
+
+def setUpModule():
+    global _tmp
+    _tmp = tempfile.TemporaryDirectory()
+    os.chdir(_tmp.name)  # Storage paths are relative to the working directory
+    os.makedirs(db.STORAGE_DIR)
+    db.close_connections()
+    with redirect_stdout(io.StringIO()):
+        db.init_db()
+
+
+def tearDownModule():
+    db.close_connections()
+    os.chdir(_cwd)
+    _tmp.cleanup()
+
+
+def at(hour, minute=0, second=0):
+    return START.replace(hour=hour, minute=minute, second=second)
+
+
+class RollupTest(unittest.TestCase):
+    """Samples are counted exactly once across the watermark, and raw rows go only once rolled up"""
+
+    def setUp(self):
+        conn = db.get_connection()
+        for table in ("activity_processes", "activity_log", "activity_hourly", "activity_daily", "rollup_state"):
+            conn.execute(f"DELETE FROM {table}")
+
+        # A sample every ten minutes from 09:00 to 13:50, several exactly on the hour
+        self.samples = []
+        for i in range(30):
+            names = ("code.exe", "chrome.exe")[: i % 3] if i % 5 else ("spotify.exe",)
+            self.samples.append(((START + timedelta(minutes=10 * i)).isoformat(), names, WINDOWS[i % 4]))
+        insert_samples(conn, self.samples)
+        conn.commit()
+        conn.close()
+
+    def expected(self, since):
+        """Brute-force totals over every sample taken after since"""
+        processes, categories, total = Counter(), Counter(), 0
+        for timestamp, names, window in self.samples:
+            if timestamp > since:
+                total += 1
+                processes.update(names)
+                if window:
+                    categories[categorize_window(window)] += 1
+        return processes, categories, total
+
+    def assertTotalsExact(self, sinces):
+        for since in sinces:
+            with self.subTest(since=since, watermark=self.watermark()):
+                self.assertEqual(activity_totals(since), self.expected(since))
+
+    def watermark(self):
+        conn = db.get_connection()
+        try:
+            return rolled_up_until(conn)
+        finally:
+            conn.close()
+
+    def raw_timestamps(self):
+        conn = db.get_connection()
+        rows = [row[0] for row in conn.execute("SELECT timestamp FROM activity_log ORDER BY id")]
+        conn.close()
+        return rows
+
+    def rolled_total(self):
+        conn = db.get_connection()
+        total = conn.execute("SELECT COALESCE(SUM(samples), 0) FROM activity_hourly WHERE kind = 'total'").fetchone()[0]
+        conn.close()
+        return total
+
+    def test_watermark_counts_every_sample_once(self):
+        sinces = [
+            at(8).isoformat(),              # Before everything
+            at(9, 35).isoformat(),          # Mid-hour, inside the rollups
+            at(10).isoformat(),             # On an hour boundary
+            at(11, 59, 59).isoformat(),     # Just before the watermark
+            at(12).isoformat(),             # On the watermark
+            at(12, 5).isoformat(),          # After the watermark
+        ]
+        self.assertTotalsExact(sinces)  # Nothing rolled up yet
+
+        rolled = compact_activity(now=at(12, 30))
+        self.assertEqual(self.watermark(), at(12).isoformat())
+        self.assertEqual(rolled, 19)  # 09:00 through 12:00, the sample on the watermark included
+        self.assertEqual(self.rolled_total(), 19)
+        self.assertTotalsExact(sinces)
+
+        self.assertEqual(compact_activity(now=at(12, 45)), 0)  # Same hour: nothing new
+        self.assertEqual(self.rolled_total(), 19)
+
+        self.assertEqual(compact_activity(now=at(14, 5)), 11)  # Up to 13:50
+        self.assertEqual(self.rolled_total(), 30)
+        self.assertTotalsExact(sinces + [at(13, 15).isoformat()])
+
+    def test_daily_rollup_matches_the_hours(self):
+        compact_activity(now=at(14, 5))
+        conn = db.get_connection()
+        hourly = conn.execute("SELECT kind, ref, SUM(samples), SUM(seconds) FROM activity_hourly "
+                              "GROUP BY kind, ref ORDER BY kind, ref").fetchall()
+        daily = conn.execute("SELECT kind, ref, samples, seconds FROM activity_daily "
+                             "ORDER BY kind, ref").fetchall()
+        conn.close()
+        self.assertEqual([row[:3] for row in hourly], [row[:3] for row in daily])
+        for hour_row, day_row in zip(hourly, daily):
+            self.assertAlmostEqual(hour_row[3], day_row[3])
+        self.assertEqual(dict((row[0], row[2]) for row in daily if row[0] == "total"), {"total": 30})
+
+    def test_raw_rows_are_deleted_only_once_rolled_up(self):
+        with mock.patch.object(rollups, "RAW_RETENTION_HOURS", 0):
+            compact_activity(now=at(12, 30))
+
+        # Everything before the watermark is gone; 12:00 onward is kept, rolled up or not
+        raw = self.raw_timestamps()
+        self.assertEqual(raw[0], at(12).isoformat())
+        self.assertEqual(len(raw), 12)
+        self.assertIn(at(12, 10).isoformat(), raw)
+        self.assertTotalsExact([at(8).isoformat(), at(12).isoformat(), at(12, 5).isoformat()])
+
+        # Without its raw samples, the hour since falls in counts whole
+        self.assertEqual(activity_totals(at(10, 35).isoformat()), self.expected(at(9, 59, 59).isoformat()))
+
+    def test_default_retention_keeps_recent_raw_rows(self):
+        compact_activity(now=at(14, 5))
+        self.assertEqual(len(self.raw_timestamps()), 30)  # Within RAW_RETENTION_HOURS
+
+        compact_activity(now=START + timedelta(days=3))
+        self.assertEqual(self.raw_timestamps(), [])
+        self.assertEqual(self.rolled_total(), 30)
+        self.assertTotalsExact([at(8).isoformat()])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import io
+import json
+import re
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from core import gateway
+from core.fake_backend import FakeBackend
+from core.json_stream import REPAIR_OPTIONS, stream_json
+from core.schemas import ACTIVITY_EVOLUTION_SCHEMA, LEARNING_SCHEMA, REFLECTION_SCHEMA, validate
+
+VALID_REFLECTION = {
+    "analysis": "Sharper than intended",
+    "trait_adjustments": {"sarcasm": {"new_weight": 0.6, "reason": "They laughed"}},
+}
+
+# (name, data, schema, expected problems)
+VALIDATE_CASES = [
+    ("valid reflection", VALID_REFLECTION, REFLECTION_SCHEMA, []),
+    ("not an object", ["analysis"], REFLECTION_SCHEMA, ["$: expected object"]),
+    ("missing required", {"analysis": "ok"}, REFLECTION_SCHEMA, ["$.trait_adjustments: missing"]),
+    ("weight out of range",
+     {"analysis": "ok", "trait_adjustments": {"chaos": {"new_weight": 1.5, "reason": "why not"}}},
+     REFLECTION_SCHEMA, ["$.trait_adjustments.chaos.new_weight: above 1.0"]),
+    ("bool is not a number",
+     {"analysis": "ok", "trait_adjustments": {"chaos": {"new_weight": True, "reason": "x"}}},
+     REFLECTION_SCHEMA, ["$.trait_adjustments.chaos.new_weight: expected number"]),
+    ("number given as a string",
+     {"analysis": "ok", "trait_adjustments": {"chaos": {"new_weight": "0.5", "reason": "x"}}},
+     REFLECTION_SCHEMA, ["$.trait_adjustments.chaos.new_weight: expected number"]),
+    ("enum and array items",
+     {"learned_preferences": [{"type": "vibes", "value": "x", "confidence": 0.5}],
+      "effective_patterns": [], "user_insights": []},
+     LEARNING_SCHEMA, ["$.learned_preferences[0].type: must be one of communication_style, humor, topic, timing"]),
+    ("unknown keys are allowed", {"observations": "ok", "trait_changes": {}, "extra": [1, None]},
+     ACTIVITY_EVOLUTION_SCHEMA, []),
+    ("null where an object belongs", {"observations": "ok", "trait_changes": None},
+     ACTIVITY_EVOLUTION_SCHEMA, ["$.trait_changes: expected object"]),
+]
+
+
+class ValidateTest(unittest.TestCase):
+
+    def test_cases(self):
+        for name, data, schema, expected in VALIDATE_CASES:
+            with self.subTest(name):
+                self.assertEqual(validate(data, schema), expected)
+
+
+class ScriptedBackend(FakeBackend):
+    """Streams scripted answers in order and records what each call asked and how much was read"""
+
+    def __init__(self, answers):
+        super().__init__()
+        self.answers = list(answers)
+        self.requests = []  # (prompt, options, tokens read)
+
+    def stream(self, prompt, timeout=30, options=None, format=None):
+        call = [prompt, options, 0]
+        self.requests.append(call)
+        for token in re.findall(r"\S*\s*", self.answers.pop(0)):
+            if token:
+                call[2] += 1
+                yield token
+
+
+class StreamJSONTest(unittest.TestCase):
+    """stream_json stops at the closing brace and repairs an invalid answer once"""
+
+    def run_json(self, *answers, schema=REFLECTION_SCHEMA):
+        self.backend = ScriptedBackend(answers)
+        shared = gateway.ModelGateway(client=self.backend, interactive_grace=0)
+        with mock.patch.object(gateway, "_gateway", shared), redirect_stdout(io.StringIO()):
+            return stream_json("Reflect on this", timeout=10, schema=schema)
+
+    def test_valid_answer_stops_at_the_closing_brace(self):
+        epilogue = " I hope this reflection captures my inner static." * 20
+        data, _ = self.run_json(json.dumps(VALID_REFLECTION) + epilogue)
+        self.assertEqual(data, VALID_REFLECTION)
+        self.assertEqual(len(self.backend.requests), 1)
+        self.assertLess(self.backend.requests[0][2], 20)  # The epilogue was never read
+
+    def test_invalid_answer_is_repaired_once(self):
+        data, text = self.run_json('{"analysis": "forgot the rest"}', json.dumps(VALID_REFLECTION))
+        self.assertEqual(data, VALID_REFLECTION)
+        self.assertEqual(json.loads(text), VALID_REFLECTION)
+        self.assertEqual(len(self.backend.requests), 2)
+        repair_prompt, options, _ = self.backend.requests[1]
+        self.assertIn("$.trait_adjustments: missing", repair_prompt)
+        self.assertEqual(options, REPAIR_OPTIONS)
+
+    def test_failed_repair_gives_up_with_the_raw_text(self):
+        data, text = self.run_json("Just vibes, no JSON.", '{"analysis": 42}')
+        self.assertIsNone(data)
+        self.assertEqual(text, "Just vibes, no JSON.")
+        self.assertEqual(len(self.backend.requests), 2)  # One repair, never a second
+
+    def test_truncated_answer_is_salvaged_without_repair(self):
+        truncated = '{"analysis": "cut short", "trait_adjustments": {"chaos": {"new_weight": 0.4, "reason": "ok"'
+        data, _ = self.run_json(truncated)
+        self.assertEqual(data["trait_adjustments"]["chaos"]["new_weight"], 0.4)
+        self.assertEqual(len(self.backend.requests), 1)
+
+    def test_without_a_schema_no_repair_is_attempted(self):
+        data, text = self.run_json("not json", schema=None)
+        self.assertIsNone(data)
+        self.assertEqual(text, "not json")
+        self.assertEqual(len(self.backend.requests), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+
+from core import llm
+from core.deadline import MIN_STEP_TIME, TURN_BUDGET, Deadline
+from core.gateway import ModelGateway
+from core.ollama_stub import StubOllamaServer
+from memory.semantic import HashEmbedder, ModelEmbedder, SemanticMemory
+from storage import db
+
+_cwd = os.getcwd()
+_tmp = None
+
+
+def setUpModule():
+    global _tmp
+    _tmp = tempfile.TemporaryDirectory()
+    os.chdir(_tmp.name)  # Storage paths are relative to the working directory
+    os.makedirs(db.STORAGE_DIR)
+    db.close_connections()
+    db.init_db()
+
+
+def tearDownModule():
+    db.close_connections()
+    os.chdir(_cwd)
+    _tmp.cleanup()
+
+
+class ModelEmbedderTest(unittest.TestCase):
+    """Semantic memory embedding with the model, through the gateway"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubOllamaServer().start()
+        cls.client = llm.OllamaClient(host=cls.server.address)
+        cls.gateway = ModelGateway(client=cls.client, interactive_grace=0)
+        cls.semantic = SemanticMemory(embedder=ModelEmbedder(gateway=cls.gateway))
+
+        conn = db.get_connection()
+        conn.executemany(
+            "INSERT INTO learned_preferences (preference_type, preference_value) VALUES (?, ?)",
+            [("music", "lofi beats while coding"), ("humor", "dry sarcasm"), ("timing", "late night chats")]
+        )
+        conn.commit()
+        conn.close()
+        cls.indexed = cls.semantic.sync()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.close()
+        cls.server.stop()
+
+    def test_sync_embeds_at_reflection_priority(self):
+        self.assertEqual(self.indexed, 3)
+        self.assertEqual(self.semantic.space, "model-nomic-embed-text-64")
+        self.assertGreater(self.gateway.stats()["reflection"]["served"], 0)
+
+    def test_search_embeds_the_query_at_interactive_priority(self):
+        served = self.gateway.stats()["interactive"]["served"]
+        results = self.semantic.search("any good lofi beats?", k=2, deadline=Deadline(TURN_BUDGET))
+        self.assertEqual(results[0][:2], ("preference", "music: lofi beats while coding"))
+        self.assertEqual(self.gateway.stats()["interactive"]["served"], served + 1)
+
+    def test_search_skips_the_model_when_the_turn_is_nearly_over(self):
+        embeds = self.server.embeds
+        self.assertEqual(self.semantic.search("lofi beats", deadline=Deadline(MIN_STEP_TIME / 2)), [])
+        self.assertEqual(self.server.embeds, embeds)
+
+
+class ForgottenMemoryTest(unittest.TestCase):
+    """Deleted memories are never recalled, and sync drops their entries"""
+
+    def test_deleted_exchange_is_not_recalled(self):
+        semantic = SemanticMemory(embedder=HashEmbedder())
+        conn = db.get_connection()
+        ref = conn.execute(
+            "INSERT INTO interactions (timestamp, message, response) VALUES (?, ?, ?)",
+            ("2025-01-01T12:00:00", "my cat knocked over the aquarium", "Chaos is a family trait")
+        ).lastrowid
+        conn.commit()
+        semantic.sync()
+        self.assertEqual(semantic.search("cat aquarium", k=1)[0][0], "exchange")
+
+        conn.execute("DELETE FROM interactions WHERE id = ?", (ref,))
+        conn.commit()
+        self.assertEqual(semantic.search("cat aquarium", k=1, sources=["exchange"]), [])
+
+        semantic.sync()
+        left = conn.execute("SELECT COUNT(*) FROM semantic_memories WHERE source = 'exchange' AND ref = ?",
+                            (ref,)).fetchone()[0]
+        conn.close()
+        self.assertEqual(left, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
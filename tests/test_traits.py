@@ -0,0 +1,146 @@
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from core import traits
+from core.background import BackgroundJobs
+from core.traits import TraitStore
+from storage import db
+
+_cwd = os.getcwd()
+_tmp = None
+
+
+def setUpModule():
+    global _tmp
+    _tmp = tempfile.TemporaryDirectory()
+    os.chdir(_tmp.name)  # Storage paths are relative to the working directory
+    os.makedirs(db.STORAGE_DIR)
+    db.close_connections()
+    with redirect_stdout(io.StringIO()):
+        db.init_db()
+
+
+def tearDownModule():
+    db.close_connections()
+    os.chdir(_cwd)
+    _tmp.cleanup()
+
+
+def stored(trait):
+    """(weight, evolution_notes) of a trait as personality_traits has it"""
+    conn = db.get_connection()
+    row = conn.execute("SELECT weight, evolution_notes FROM personality_traits WHERE trait_name = ?",
+                       (trait,)).fetchone()
+    conn.close()
+    return row
+
+
+class TraitStoreTest(unittest.TestCase):
+    """Changes apply in memory at once, reach the table on flush, and are announced"""
+
+    def setUp(self):
+        self.store = TraitStore(flush_delay=60, refresh=60)
+        self.announced = []
+        self.store.subscribe(self.announced.append)
+
+    def tearDown(self):
+        self.store.flush()
+
+    def test_set_weights_reaches_the_table_on_flush(self):
+        before = stored("sarcasm")
+        changed = self.store.set_weights({"sarcasm": 0.25, "whimsy": (1.7, "Discovered whimsy")})
+
+        self.assertEqual(changed, {"sarcasm": 0.25, "whimsy": 1.0})  # Clamped to 0-1
+        self.assertEqual(self.store.get("sarcasm"), 0.25)
+        self.assertEqual(stored("sarcasm"), before)  # Not written yet
+        self.assertEqual(self.store.stats()["pending"], 2)
+
+        self.assertEqual(self.store.flush(), 2)
+        self.assertEqual(stored("sarcasm"), (0.25, "Self-adjustment"))
+        self.assertEqual(stored("whimsy"), (1.0, "Discovered whimsy"))
+        self.assertEqual(self.store.stats(), {"pending": 0, "loads": 1, "writes": 1})
+        self.assertEqual(self.store.flush(), 0)  # Nothing left to write
+
+    def test_subscribers_see_the_new_snapshot(self):
+        seen = []
+        self.store.subscribe(lambda changed: seen.append((changed, self.store.snapshot())))
+        self.store.set_weights({"chaos": 0.1, "caring": self.store.get("caring")})
+
+        self.assertEqual(self.announced, [{"chaos": 0.1}])  # Unchanged traits are not announced
+        changed, snapshot = seen[0]
+        self.assertEqual(changed, {"chaos": 0.1})
+        self.assertEqual(snapshot["chaos"], 0.1)
+
+        self.store.adjust({"chaos": 0.2, "unknown": 0.5})
+        self.assertAlmostEqual(self.announced[-1]["chaos"], 0.3)
+        self.assertNotIn("unknown", self.store.snapshot())
+
+    def test_failing_subscriber_does_not_stop_the_others(self):
+        def broken(changed):
+            raise RuntimeError("listener exploded")
+
+        store = TraitStore(flush_delay=60)
+        store.subscribe(broken)
+        store.subscribe(self.announced.append)
+        with redirect_stdout(io.StringIO()) as out:
+            store.set_weights({"mischief": 0.33})
+        store.flush()
+        self.assertEqual(self.announced, [{"mischief": 0.33}])
+        self.assertIn("[Trait listener glitch] listener exploded", out.getvalue())
+
+    def test_changes_are_written_together_after_the_delay(self):
+        store = TraitStore(flush_delay=0.1)
+        store.set_weights({"curiosity": 0.11})
+        store.adjust({"curiosity": 0.1, "moodiness": -0.1})
+        self.assertEqual(store.stats()["writes"], 0)
+
+        time.sleep(0.4)
+        self.assertEqual(store.stats(), {"pending": 0, "loads": 1, "writes": 1})
+        self.assertAlmostEqual(stored("curiosity")[0], 0.21)
+
+    def test_refresh_picks_up_other_writers_under_pending_changes(self):
+        store = TraitStore(flush_delay=60, refresh=0)
+        store.subscribe(self.announced.append)
+        store.set_weights({"helpfulness": 0.9})
+
+        # Another Luna process writes to the table meanwhile
+        conn = db.get_connection()
+        conn.execute("UPDATE personality_traits SET weight = 0.05 WHERE trait_name IN ('helpfulness', 'sarcasm')")
+        conn.commit()
+        conn.close()
+
+        snapshot = store.snapshot()
+        store.flush()
+        self.assertEqual((snapshot["sarcasm"], snapshot["helpfulness"]), (0.05, 0.9))  # Pending stays on top
+        self.assertEqual(self.announced[-1], {"sarcasm": 0.05})
+
+
+class ExitFlushTest(unittest.TestCase):
+    """At exit, background jobs finish before the last trait changes are written"""
+
+    def test_changes_made_by_draining_jobs_are_written(self):
+        store = TraitStore(flush_delay=60)
+        jobs = BackgroundJobs(workers=1, name="test-exit")
+        release = threading.Event()
+
+        def late_reflection():
+            release.wait(5)
+            store.set_weights({"moodiness": 0.12}, note="Late reflection")
+
+        jobs.submit(late_reflection)
+        threading.Timer(0.1, release.set).start()
+        with mock.patch.object(traits, "background_jobs", jobs), mock.patch.object(traits, "trait_store", store):
+            traits._flush_at_exit()
+
+        self.assertEqual(stored("moodiness"), (0.12, "Late reflection"))
+        self.assertEqual(store.stats()["pending"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,22 +4,27 @@ import win32process
 from datetime import datetime
 from storage.db import record_activity
 
+def sample_activity():
+    """Interesting running processes and the active window title (nothing is stored)"""
+    # Get running processes
+    running_processes = []
+    for proc in psutil.process_iter(['name']):
+        try:
+            running_processes.append(proc.info['name'])
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    
+    # Filter interesting processes
+    interesting_processes = filter_interesting_processes(running_processes)
+    
+    # Get active window
+    active_process, window_title = get_active_window_title()
+    return interesting_processes, window_title
+
 def capture_activity():
     """Capture user activity and store it for Luna's evolution"""
     try:
-        # Get running processes
-        running_processes = []
-        for proc in psutil.process_iter(['name']):
-            try:
-                running_processes.append(proc.info['name'])
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
-        
-        # Filter interesting processes
-        interesting_processes = filter_interesting_processes(running_processes)
-        
-        # Get active window
-        active_process, window_title = get_active_window_title()
+        interesting_processes, window_title = sample_activity()
         
         # Record activity
         if interesting_processes or window_title:
@@ -76,33 +81,19 @@ def get_active_window_title():
 
 def get_recent_activity_summary():
     """Get summary of recent activity for Luna to understand user context"""
-    from storage.db import DB_PATH
-    import sqlite3
+    from storage.activity_buffer import activity_recorder
     from datetime import datetime, timedelta
     
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Get last hour's activity
+    # Get last hour's activity (samples not yet flushed included)
     one_hour_ago = (datetime.now() - timedelta(hours=1)).isoformat()
-    
-    c.execute("""
-    SELECT processes, window_title, timestamp 
-    FROM activity_log 
-    WHERE timestamp > ? 
-    ORDER BY timestamp DESC 
-    LIMIT 10
-    """, (one_hour_ago,))
-    
-    recent_activity = c.fetchall()
-    conn.close()
+    recent_activity = activity_recorder.recent(since=one_hour_ago, limit=10)
     
     if not recent_activity:
         return "No recent activity detected"
     
     # Summarize activity
     summary_parts = []
-    for processes, window, timestamp in recent_activity[:5]:
+    for timestamp, processes, window in recent_activity[:5]:
         if window and window.strip():
             summary_parts.append(f"{window}")
         elif processes:
@@ -112,62 +103,24 @@ def get_recent_activity_summary():
 
 def detect_activity_patterns():
     """Detect patterns in user activity for Luna's evolution"""
-    from storage.db import DB_PATH
-    import sqlite3
+    from storage.rollups import activity_totals
     from datetime import datetime, timedelta
-    from collections import Counter
-    
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     
-    # Get last 24 hours
+    # Last 24 hours: whole hours from the rollups, the rest from raw samples
     yesterday = (datetime.now() - timedelta(days=1)).isoformat()
+    process_counts, activity_counts, total = activity_totals(yesterday)
     
-    c.execute("""
-    SELECT processes, window_title 
-    FROM activity_log 
-    WHERE timestamp > ?
-    """, (yesterday,))
-    
-    activities = c.fetchall()
-    conn.close()
-    
-    if not activities:
+    if not total:
         return None
     
-    # Analyze patterns
-    all_processes = []
-    window_types = []
-    
-    for processes, window in activities:
-        if processes:
-            all_processes.extend(processes.split(', '))
-        
-        if window:
-            # Categorize window types
-            window_lower = window.lower()
-            if any(term in window_lower for term in ['code', 'python', 'programming']):
-                window_types.append('coding')
-            elif any(term in window_lower for term in ['chrome', 'firefox', 'browser']):
-                window_types.append('browsing')
-            elif any(term in window_lower for term in ['music', 'spotify', 'youtube']):
-                window_types.append('entertainment')
-            elif any(term in window_lower for term in ['discord', 'slack', 'chat']):
-                window_types.append('communication')
-            else:
-                window_types.append('work')
-    
     # Find dominant patterns
-    process_counts = Counter(all_processes)
-    activity_counts = Counter(window_types)
-    
     dominant_processes = process_counts.most_common(3)
     dominant_activities = activity_counts.most_common(2)
     
     return {
         "dominant_processes": dominant_processes,
         "activity_types": dominant_activities,
-        "total_activity_points": len(activities),
+        "total_activity_points": total,
         "analysis_timestamp": datetime.now().isoformat()
     }
 